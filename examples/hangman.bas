@@ -100,8 +100,11 @@ ROUND_START:
 	
 	GOSUB CHECK_GUESS
 	
-	IF NOT found THEN GOSUB ERROR_WRONG
-	IF found THEN PRINT "Good guess: ", guess$
+	IF found THEN
+		PRINT "Good guess: ", guess$
+	ELSE
+		GOSUB ERROR_WRONG
+	END IF
 	IF letters <= 0 THEN GOTO WIN
 	
 	GOTO ROUND_START
@@ -1,3 +1,4 @@
+from .function_registry import *
 from .interpreter_vm import *
 from .tiny_basic import *
 from .tiny_basic_io import *
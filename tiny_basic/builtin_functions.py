@@ -1,10 +1,13 @@
-import random
+import bisect
+import operator
+from .errors import TinyBasicException
+from .vm import Variable, MapVariable
 
 
-def fn_rnd(args):
+def fn_rnd(vm, args):
     range_begin = 0 if 2 != len(args) else args[0]
     range_end = args[0] if 1 == len(args) else args[1]
-    return random.randrange(range_begin, range_end)
+    return vm.random.randrange(range_begin, range_end)
 
 
 def fn_mid(args):
@@ -14,4 +17,63 @@ def fn_mid(args):
         index_to = index_from + args[2]
         return src[index_from:index_to]
     else:
-        return src[index_from]
\ No newline at end of file
+        return src[index_from]
+
+def fn_alen(args):
+    """
+    :return: number of elements, or the extent of a dimension (1 for the first) when it is given
+    """
+    if 1 == len(args):
+        return args[0].dim
+    return args[0].get_extent(args[1])
+
+
+def fn_instr(args):
+    """
+    :return: index of the first occurrence of the second string in the first one, from the optional start index,
+        -1 when there is none
+    """
+    return args[0].find(args[1], *args[2:])
+
+
+def fn_right(args):
+    count = args[1]
+    return args[0][len(args[0]) - count:] if 0 < count else ''
+
+
+def fn_join(args):
+    separator = args[1] if 1 < len(args) else ''
+    return separator.join(map(str, args[0].read_array()))
+
+
+def fn_sum(args):
+    return sum(args[0].read_num_array())
+
+
+def fn_dot(args):
+    left = args[0].read_num_array()
+    right = args[1].read_num_array()
+    if len(left) != len(right):
+        raise TinyBasicException(f'DIMENSIONS OF {args[0].name} AND {args[1].name} DO NOT MATCH')
+    return sum(map(operator.mul, left, right))
+
+
+def fn_find(args):
+    """
+    Binary search in an ascending sorted array
+    :return: index of the first element equal to the value, -1 when there is none
+    """
+    values = args[0].read_array()
+    value = args[1]
+    if isinstance(value, str) != (args[0].base_type == Variable.TYPE_STR):
+        raise TinyBasicException(f'{value} IS NOT {args[0].base_type}')
+    index = bisect.bisect_left(values, value)
+    if index < len(values) and values[index] == value:
+        return index
+    return -1
+
+
+def fn_haskey(args):
+    if not isinstance(args[0], MapVariable):
+        raise TinyBasicException(f'{args[0].name} IS NOT A MAP')
+    return int(args[0].has_key(args[1]))
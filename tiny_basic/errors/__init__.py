@@ -1,3 +1,6 @@
 from .tiny_basic_exception import *
 from .run_stop import *
-from .quit_exception import *
\ No newline at end of file
+from .quit_exception import *
+from .input_pending import *
+from .limit_exceeded import *
+from .type_error import *
\ No newline at end of file
@@ -0,0 +1,8 @@
+from tiny_basic.errors.tiny_basic_exception import TinyBasicException
+
+
+class TinyBasicInputPendingException(TinyBasicException):
+    def __init__(self):
+        super().__init__("WAITING FOR INPUT")
+        # Rest of the line starting with the INPUT statement, so execution can resume without repeating statements
+        self.resume_line: str or None = None
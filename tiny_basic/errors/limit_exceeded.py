@@ -0,0 +1,8 @@
+from tiny_basic.errors.tiny_basic_exception import TinyBasicException
+
+
+class TinyBasicLimitException(TinyBasicException):
+    def __init__(self, limit: str, maximum):
+        super().__init__(f"{limit} LIMIT EXCEEDED: {maximum}")
+        self.limit = limit
+        self.maximum = maximum
@@ -0,0 +1,8 @@
+from tiny_basic.errors.tiny_basic_exception import TinyBasicException
+
+
+class TinyBasicTypeException(TinyBasicException):
+    def __init__(self, errors: list[tuple[int, str]]):
+        super().__init__('TYPE ERROR: ' + ', '.join(f'LINE {line_number}: {message}' for line_number, message in errors))
+        # Line number and message of every type error found in the program
+        self.errors = errors
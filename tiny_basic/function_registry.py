@@ -0,0 +1,154 @@
+from enum import Enum
+
+from .errors import TinyBasicException
+from .lexer import TinyBasicTokenType, tokenize_line
+from .lexer.syntax_error import TinyBasicSyntaxError
+from .vm import Variable, is_user_function_name
+
+_TYPE_NAMES = {
+    Variable.TYPE_INT: 'INT',
+    Variable.TYPE_NUM: 'NUM',
+    Variable.TYPE_STR: 'STRING'
+}
+# Checks of argument and result values, TYPE_ANY accepts every value
+_TYPE_CHECKS = {
+    Variable.TYPE_INT: lambda x: isinstance(x, int),
+    Variable.TYPE_NUM: lambda x: isinstance(x, int) or isinstance(x, float),
+    Variable.TYPE_STR: lambda x: isinstance(x, str)
+}
+
+
+class NativeFunction:
+    """
+    Function implemented in Python, called with the list of its arguments.
+    An argument type None passes a variable, Channel passes an open channel, the other types pass values.
+    Functions with_vm are called with the VM before the arguments.
+    The signature is compiled once into validate, which checks the evaluated arguments of a call.
+    """
+    def __init__(self, name: str, ret_type: str, fn, min_args: int, max_args: int or None, arg_types: list,
+                 with_vm: bool = False):
+        self.name = name
+        self.ret_type = ret_type
+        self.fn = fn
+        self.min_args = min_args
+        self.max_args = max_args
+        self.arg_types = arg_types
+        self.with_vm = with_vm
+        self.validate = self.compile_validator()
+        # Argument parsers of the interpreter, derived from arg_types on the first call
+        self.parsers = None
+
+    def compile_validator(self):
+        name = self.name
+        min_args = self.min_args
+        max_args = self.max_args
+        checks = [(index, _TYPE_CHECKS[arg_type], _TYPE_NAMES[arg_type])
+                  for index, arg_type in enumerate(self.arg_types) if arg_type in _TYPE_CHECKS]
+
+        def validate_count(args: list):
+            if max_args is not None and max_args < len(args):
+                raise TinyBasicException(f'TOO MUCH ARGUMENTS FOR {name}')
+            if len(args) < min_args:
+                raise TinyBasicException(f'TOO FEW ARGUMENTS FOR {name}')
+
+        if not checks:
+            return validate_count
+
+        def validate(args: list):
+            validate_count(args)
+            for index, check, type_name in checks:
+                if index < len(args) and not check(args[index]):
+                    raise TinyBasicException(f'{args[index]} IS NOT {type_name}, ARGUMENT {index + 1} OF {name}')
+        return validate
+
+    def call(self, args: list):
+        """
+        Call with evaluated arguments, the arguments and the result are checked against the signature
+        """
+        self.validate(args)
+        result = self.fn(args)
+        if self.ret_type in _TYPE_CHECKS and not _TYPE_CHECKS[self.ret_type](result):
+            raise TinyBasicException(f'{self.name} RETURNED {result}, NOT {_TYPE_NAMES[self.ret_type]}')
+        return result
+
+
+class FunctionRegistry:
+    """
+    Native functions by upper case name. The builtin functions have their own tokens, the functions registered by
+    the host are called by their identifier, so registering a function does not change the lexer.
+    Every VM has its own registry layered over the shared builtins, functions registered with one VM are not
+    visible to the others. The type inference and the compiled lines depend on the signatures, on_change is
+    called when a function is registered or unregistered to drop them.
+    """
+    def __init__(self, builtins: dict[Enum, tuple] or None = None, parent: 'FunctionRegistry' or None = None,
+                 on_change=None):
+        """
+        :param builtins: by TinyBasicFunction, the return type, the function, the argument count range, the
+            argument types and optionally with_vm
+        :param parent: registry of the functions visible unless this registry has a function with the same name
+        :param on_change: called without arguments after register and unregister
+        """
+        self.functions: dict[str, NativeFunction] = {}
+        self.parent = parent
+        self.on_change = on_change
+        for function_name, definition in ({} if builtins is None else builtins).items():
+            self.functions[function_name.value] = NativeFunction(function_name.value, *definition)
+
+    def copy(self, on_change=None) -> 'FunctionRegistry':
+        """
+        :return: registry with the same functions and parent, later registrations only change one of them
+        """
+        result = FunctionRegistry(parent=self.parent, on_change=on_change)
+        result.functions = dict(self.functions)
+        return result
+
+    def __contains__(self, name: str) -> bool:
+        return self.get(name) is not None
+
+    def get(self, name: str) -> NativeFunction or None:
+        function = self.functions.get(name.upper())
+        if function is None and self.parent is not None:
+            return self.parent.get(name)
+        return function
+
+    def call(self, name: str, args: list):
+        function = self.get(name)
+        if function is None:
+            raise TinyBasicException(f'UNKNOWN FUNCTION: {name.upper()}')
+        return function.call(args)
+
+    def register(self, name: str, fn, arg_types: list[str], ret_type: str = Variable.TYPE_ANY,
+                 min_args: int or None = None, max_args: int or None = None) -> NativeFunction:
+        """
+        Expose a Python function to BASIC programs, they call it like name(arguments)
+        :param name: identifier, it must not start with FN, the prefix of user functions
+        :param fn: called with the list of argument values
+        :param arg_types: Variable.TYPE_INT, TYPE_NUM, TYPE_STR or TYPE_ANY for every argument
+        :param ret_type: type of the result, the type inference relies on it
+        :param min_args: number of required arguments, all when None
+        :param max_args: maximum number of arguments, the number of argument types when None
+        :return: the registered function, it replaces a function with the same name
+        """
+        name = name.upper()
+        try:
+            tokens = tokenize_line(name)
+        except TinyBasicSyntaxError:
+            tokens = []
+        if len(tokens) != 2 or tokens[0][0].type != TinyBasicTokenType.IDENTIFIER or is_user_function_name(name):
+            raise TinyBasicException(f'{name} CAN NOT BE A FUNCTION NAME')
+        for value_type in list(arg_types) + [ret_type]:
+            if value_type not in _TYPE_CHECKS and value_type != Variable.TYPE_ANY:
+                raise TinyBasicException(f'UNKNOWN TYPE {value_type} IN THE SIGNATURE OF {name}')
+        function = NativeFunction(name, ret_type, fn, len(arg_types) if min_args is None else min_args,
+                                  len(arg_types) if max_args is None else max_args, list(arg_types))
+        self.functions[name] = function
+        if self.on_change is not None:
+            self.on_change()
+        return function
+
+    def unregister(self, name: str):
+        """
+        Remove a function registered with this registry, the functions of the parent stay visible
+        """
+        if self.functions.pop(name.upper(), None) is not None and self.on_change is not None:
+            self.on_change()
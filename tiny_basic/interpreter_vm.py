@@ -1,11 +1,40 @@
+from .function_registry import FunctionRegistry
+from .lexer import tokenize_line
 from .tiny_basic import TinyBasicInterpreter
-from .vm import AbstractVM, AbstractIo
+from .tiny_basic_compiler import TinyBasicCompiler
+from .tiny_basic_types import check_program_types
+from .vm import AbstractVM, AbstractIo, ExecutionLimits
 
 
 class TinyInterpreterVM(AbstractVM):
-    def __init__(self, io: AbstractIo):
-        super().__init__(io)
+    def __init__(self, io: AbstractIo, limits: ExecutionLimits or None = None):
+        super().__init__(io, limits)
+        # Functions registered by the host for this VM and its clones made afterwards
+        self.functions = FunctionRegistry(parent=TinyBasicInterpreter.builtin_functions,
+                                          on_change=lambda: self.text.reset_types())
+
+    def clone(self, io: AbstractIo or None = None) -> 'TinyInterpreterVM':
+        result = super().clone(io)
+        result.functions = self.functions.copy(on_change=lambda: result.text.reset_types())
+        return result
 
     def execute(self, line: str):
-        interpreter = TinyBasicInterpreter(self, line)
+        interpreter = TinyBasicInterpreter(self, line, self.text.get_tokens(line))
         interpreter.interpret()
+
+    def check_types(self):
+        check_program_types(self.text, self.functions)
+
+    def compile(self, line: str):
+        tokens = self.text.get_tokens(line)
+        if tokens is None:
+            return None
+        return TinyBasicCompiler(self, line, tokens).compile()
+
+    def compile_function(self, source: str):
+        # Without a program line the compiler and the interpreter keep every type check
+        tokens = tokenize_line(source)
+        code = TinyBasicCompiler(self, None, tokens).compile_expression()
+        if code is None:
+            return lambda: TinyBasicInterpreter(self, None, tokens).function_body()
+        return code
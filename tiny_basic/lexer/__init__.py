@@ -1,4 +1,5 @@
-from .tiny_basic_tokens import TinyBasicToken, TinyBasicTokenizer
+from .tiny_basic_tokens import TinyBasicToken, TinyBasicTokenizer, TinyBasicTokenReplay, tokenize_line, \
+    tokenize_source_line
 from .statements import TinyBasicStatement
 from .token_type import TinyBasicTokenType
 from .operators import TinyBasicBoolOperator
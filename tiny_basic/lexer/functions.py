@@ -10,3 +10,16 @@ class TinyBasicFunction(Enum):
     ALEN = "ALEN"
     MID = "MID$"
     RND = "RND"
+    EOF = "EOF"
+    SUM = "SUM"
+    DOT = "DOT"
+    FIND = "FIND"
+    HASKEY = "HASKEY"
+    INSTR = "INSTR"
+    LEFT = "LEFT$"
+    RIGHT = "RIGHT$"
+    UCASE = "UCASE$"
+    LCASE = "LCASE$"
+    REPLACE = "REPLACE$"
+    JOIN = "JOIN$"
+    IIF = "IIF"
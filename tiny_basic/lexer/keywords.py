@@ -7,5 +7,13 @@ class TinyBasicKeyword(Enum):
     STEP = "STEP"
     THEN = "THEN"
     ELSE = "ELSE"
+    AS = "AS"
+    OUTPUT = "OUTPUT"
+    APPEND = "APPEND"
+    BINARY = "BINARY"
+    ZER = "ZER"
+    CON = "CON"
+    DESC = "DESC"
+    CACHED = "CACHED"
 
 
@@ -31,3 +31,19 @@ class TinyBasicStatement(Enum):
     NEXT = "NEXT"
     REPEAT = "REPEAT"
     UNTIL = "UNTIL"
+    WHILE = "WHILE"
+    WEND = "WEND"
+    OPEN = "OPEN"
+    CLOSE = "CLOSE"
+    LINE = "LINE"
+    SNAPSHOT = "SNAPSHOT"
+    RESTORE = "RESTORE"
+    MAT = "MAT"
+    SORT = "SORT"
+    FILL = "FILL"
+    COPY = "COPY"
+    DELETE = "DELETE"
+    KEYS = "KEYS"
+    SPLIT = "SPLIT"
+    DEF = "DEF"
+    RANDOMIZE = "RANDOMIZE"
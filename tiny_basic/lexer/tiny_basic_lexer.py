@@ -1,4 +1,4 @@
-from .tiny_basic_tokens import TinyBasicTokenizer, TinyBasicToken
+from .tiny_basic_tokens import TinyBasicTokenizer, TinyBasicToken, TinyBasicTokenReplay
 from .token_type import TinyBasicTokenType
 from .syntax_error import TinyBasicSyntaxError
 
@@ -12,8 +12,11 @@ class TinyBasicLexerError(Exception):
 
 
 class TinyBasicLexer:
-    def __init__(self, line: str):
-        self.tokenizer = TinyBasicTokenizer(line)
+    def __init__(self, line: str, tokens: list[tuple[TinyBasicToken, int]] or None = None):
+        if tokens is None:
+            self.tokenizer = TinyBasicTokenizer(line)
+        else:
+            self.tokenizer = TinyBasicTokenReplay(tokens)
         self.pos = self.tokenizer.pos
         self.look = self.read()
         self.has_line_number, self.line_number = self.read_on_match(TinyBasicTokenType.LINE_NUMBER)
@@ -47,7 +50,8 @@ class TinyBasicLexer:
             raise TinyBasicSyntaxError(self.tokenizer.src, f'{expected_token} expected, but {self.look.type} found')
         else:
             raise TinyBasicSyntaxError(
-                f'{expected_token} "{expected_token}" expected, but {self.look.type} "{self.look.value}" found')
+                self.tokenizer.src,
+                f'{expected_token} "{expected_value}" expected, but {self.look.type} "{self.look.value}" found')
 
     def expect(self, token_type: TinyBasicTokenType, value=None):
         found, token_value = self.read_on_match(token_type, value)
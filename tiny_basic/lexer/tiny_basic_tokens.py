@@ -67,6 +67,12 @@ class TinyBasicToken:
             return '['
         if self.type == TinyBasicTokenType.SQUARE_BRACKETS_CLOSE:
             return ']'
+        if self.type == TinyBasicTokenType.CURLY_BRACKETS_OPEN:
+            return '{'
+        if self.type == TinyBasicTokenType.CURLY_BRACKETS_CLOSE:
+            return '}'
+        if self.type == TinyBasicTokenType.HASH:
+            return '#'
         if self.type == TinyBasicTokenType.LINE_NUMBER:
             return str(self.value)
 
@@ -88,6 +94,25 @@ def is_in_enum(value, enum):
     return value in values
 
 
+class TinyBasicTokenReplay:
+    """
+    Tokenizer interface over a tokenized line, see tokenize_line
+    """
+    def __init__(self, tokens: list[tuple[TinyBasicToken, int]]):
+        self.tokens = tokens
+        self.index = 0
+        self.pos = 0
+        self.line = 1
+        # Syntax errors report the position through the source handler, the replay is its own source
+        self.src = self
+
+    def next(self) -> TinyBasicToken:
+        token, self.pos = self.tokens[self.index]
+        if self.index < len(self.tokens) - 1:
+            self.index += 1
+        return token
+
+
 class TinyBasicTokenizer(AbstractLexer):
     def __init__(self, line: str):
         self.is_comment = False
@@ -151,6 +176,12 @@ class TinyBasicTokenizer(AbstractLexer):
             return TinyBasicToken(TinyBasicTokenType.SQUARE_BRACKETS_OPEN, '[')
         if self.match_ch(']'):
             return TinyBasicToken(TinyBasicTokenType.SQUARE_BRACKETS_CLOSE, ']')
+        if self.match_ch('{'):
+            return TinyBasicToken(TinyBasicTokenType.CURLY_BRACKETS_OPEN, '{')
+        if self.match_ch('}'):
+            return TinyBasicToken(TinyBasicTokenType.CURLY_BRACKETS_CLOSE, '}')
+        if self.match_ch('#'):
+            return TinyBasicToken(TinyBasicTokenType.HASH, '#')
         if self.match_ch('<'):
             if self.match_ch('='):
                 return TinyBasicToken(TinyBasicTokenType.COMPARISON_OPERATOR, '<=')
@@ -206,3 +237,43 @@ class TinyBasicTokenizer(AbstractLexer):
         if upper_name == "MOD":
             return TinyBasicToken(TinyBasicTokenType.MUL_OP, "MOD")
         return TinyBasicToken(TinyBasicTokenType.IDENTIFIER, name)
+
+
+def tokenize_line(line: str) -> list[tuple[TinyBasicToken, int]]:
+    """
+    Tokenize a whole line, so it can be executed many times without lexing it again
+    :param line: source line
+    :return: tokens with the tokenizer position after each, the last token is THE_END
+    """
+    tokenizer = TinyBasicTokenizer(line)
+    result = []
+    while True:
+        token = tokenizer.next()
+        result.append((token, tokenizer.pos))
+        if token.type == TinyBasicTokenType.THE_END:
+            return result
+
+
+def tokenize_source_line(line: str) -> tuple[int or None, str or None, list[tuple[TinyBasicToken, int]] or None]:
+    """
+    Tokenize a line of a program source in one pass
+    :param line: source line, with or without line number
+    :return: the line number, None without one; the line as stored by the program text, None when the line is
+        a line number only; and the tokens of the stored line, like tokenize_line returns them for it
+    """
+    tokens = tokenize_line(line)
+    line_number = None
+    if tokens[0][0].type == TinyBasicTokenType.LINE_NUMBER:
+        line_number = tokens[0][0].value
+        tokens = tokens[1:]
+    if len(tokens) == 1:
+        return line_number, None, None
+    # The stored line separates the tokens by single spaces, and the tokens start where their source starts
+    sources = [token.to_src() for token, _ in tokens[:-1]]
+    result = []
+    pos = 1
+    for (token, _), source in zip(tokens, sources):
+        result.append((token, pos))
+        pos += len(source) + 1
+    result.append((tokens[-1][0], result[-1][1]))
+    return line_number, ' '.join(sources), result
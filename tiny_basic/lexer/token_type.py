@@ -23,4 +23,8 @@ class TinyBasicTokenType(Enum):
     PARENS_CLOSE = auto(),
     SQUARE_BRACKETS_OPEN = auto(),
     SQUARE_BRACKETS_CLOSE = auto(),
-    THE_END = auto()
+    HASH = auto(),
+    THE_END = auto(),
+    # Appended, the tokenized program files store the token types by their position
+    CURLY_BRACKETS_OPEN = auto(),
+    CURLY_BRACKETS_CLOSE = auto()
@@ -0,0 +1,941 @@
+import os
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+
+from .errors import TinyBasicException, TinyBasicLimitException, TinyBasicTypeException
+from .interpreter_vm import TinyInterpreterVM
+from .lexer import tokenize_line
+from .lexer.syntax_error import TinyBasicSyntaxError
+from .tiny_basic import TinyBasicInterpreter
+from .tiny_basic_terminal import exec_line
+from .tiny_basic_load_benchmark import write_generated_program
+from . import tiny_basic_types
+from .vm import AbstractIo, ExecutionLimits, VMPool, SourceText, Variable
+from .vm.array_file import ARRAY_FILE_HEADER, read_array, write_binary_array
+from .vm import program_loader, text as source_text
+from .vm.program_loader import load_program
+
+
+class RecordingIo(AbstractIo):
+    def __init__(self, inputs: list[str] or None = None):
+        self.output = []
+        self.inputs = [] if inputs is None else list(inputs)
+
+    def input_str(self, message: str or None = None) -> str:
+        return self.inputs.pop(0)
+
+    def print_msg(self, message: str, new_line: bool = True):
+        self.output.append(message)
+
+
+def run_program(lines: list[str], io: RecordingIo or None = None,
+                limits: ExecutionLimits or None = None) -> TinyInterpreterVM:
+    vm = TinyInterpreterVM(RecordingIo() if io is None else io, limits)
+    for line in lines:
+        exec_line(vm, line)
+    exec_line(vm, 'RUN')
+    return vm
+
+
+class TinyBasicTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+
+    def tmp_file(self, name: str) -> str:
+        return os.path.join(self.tmp_dir.name, name).replace('\\', '/')
+
+
+class ChannelTest(TinyBasicTestCase):
+    def test_copy_file_line_by_line(self):
+        src = self.tmp_file('in.txt')
+        dst = self.tmp_file('out.txt')
+        with open(src, 'wt') as f:
+            f.write('alpha\nbeta\ngamma\n')
+        vm = run_program([
+            f'10 OPEN "{src}" FOR INPUT AS #1',
+            f'20 OPEN "{dst}" FOR OUTPUT AS #2',
+            '30 n = 0',
+            '40 IF EOF(1) THEN GOTO 80',
+            '50 LINE INPUT #1, a$',
+            '60 n = n + 1: PRINT #2, n; a$',
+            '70 GOTO 40',
+            '80 CLOSE #1, #2',
+        ])
+        self.assertEqual(3, vm.variables.read_num_var('n'))
+        with open(dst) as f:
+            self.assertEqual('1 alpha\n2 beta\n3 gamma\n', f.read())
+        self.assertEqual({}, vm.channels.channels)
+
+    def test_end_closes_channels(self):
+        dst = self.tmp_file('out.txt')
+        vm = run_program([
+            f'10 OPEN "{dst}" FOR OUTPUT AS 1',
+            '20 PRINT #1, "hello",',
+            '30 END',
+        ])
+        self.assertEqual({}, vm.channels.channels)
+        with open(dst) as f:
+            self.assertEqual('hello', f.read())
+
+    def test_end_of_program_closes_channels(self):
+        dst = self.tmp_file('out.txt')
+        vm = run_program([f'10 OPEN "{dst}" FOR OUTPUT AS #1', '20 PRINT #1, "hello"'])
+        self.assertEqual({}, vm.channels.channels)
+        with open(dst) as f:
+            self.assertEqual('hello\n', f.read())
+
+    def test_error_flushes_channels(self):
+        dst = self.tmp_file('out.txt')
+        vm = TinyInterpreterVM(RecordingIo())
+        for line in [f'10 OPEN "{dst}" FOR OUTPUT AS #1', '20 PRINT #1, "hello"', '30 GOTO 99',
+                     '40 PRINT #1, "world"']:
+            exec_line(vm, line)
+        self.assertRaises(TinyBasicException, lambda: exec_line(vm, 'RUN'))
+        with open(dst) as f:
+            self.assertEqual('hello\n', f.read())
+        exec_line(vm, '30 REM fixed')
+        exec_line(vm, 'CONT')
+        self.assertEqual({}, vm.channels.channels)
+        with open(dst) as f:
+            self.assertEqual('hello\nworld\n', f.read())
+
+    def test_read_past_end(self):
+        src = self.tmp_file('empty.txt')
+        open(src, 'wt').close()
+        vm = TinyInterpreterVM(RecordingIo())
+        exec_line(vm, f'OPEN "{src}" FOR INPUT AS #1')
+        self.assertRaises(TinyBasicException, lambda: exec_line(vm, 'LINE INPUT #1, a$'))
+        self.assertRaises(TinyBasicException, lambda: exec_line(vm, 'PRINT #1, "x"'))
+        self.assertRaises(TinyBasicException, lambda: exec_line(vm, 'CLOSE #2'))
+        exec_line(vm, 'CLOSE')
+        self.assertEqual({}, vm.channels.channels)
+
+
+class ArrayFileTest(TinyBasicTestCase):
+    def round_trip(self, binary: bool):
+        file_name = self.tmp_file('a.dat')
+        suffix = ' AS BINARY' if binary else ''
+        vm = run_program([
+            '10 DIM a(4)',
+            '20 a(0) = 1: a(1) = 0 - 2: a(2) = 30000000000: a(3) = 4',
+            f'30 WRITE a, "{file_name}"{suffix}',
+            f'40 READ b, "{file_name}"',
+        ])
+        self.assertEqual([1, -2, 30000000000, 4], vm.variables.access_var('b').value)
+        return file_name
+
+    def test_text_round_trip(self):
+        file_name = self.round_trip(False)
+        with open(file_name) as f:
+            self.assertEqual('1\n-2\n30000000000\n4\n', f.read())
+
+    def test_binary_round_trip(self):
+        file_name = self.round_trip(True)
+        self.assertTrue(open(file_name, 'rb').read().startswith(b'TBAR'))
+
+    def test_string_lines(self):
+        file_name = self.tmp_file('s.txt')
+        vm = run_program([
+            '10 DIM s$(2)',
+            '20 s$(0) = "first": s$(1) = "second"',
+            f'30 WRITE s$, "{file_name}"',
+            f'40 READ t$, "{file_name}"',
+        ])
+        self.assertEqual(['first', 'second'], vm.variables.access_var('t$').value)
+
+    def test_unassigned_element(self):
+        file_name = self.tmp_file('a.dat')
+        vm = TinyInterpreterVM(RecordingIo())
+        exec_line(vm, 'DIM a(2)')
+        self.assertRaises(TinyBasicException, lambda: exec_line(vm, f'WRITE a, "{file_name}"'))
+
+
+class BinaryArrayFileTest(TinyBasicTestCase):
+    def test_mixed_array_reads_back_floats(self):
+        file_name = self.tmp_file('a.dat')
+        write_binary_array(file_name, 'A', [1, 2.5])
+        self.assertEqual([1.0, 2.5], read_array(file_name, True))
+        self.assertIsInstance(read_array(file_name, True)[0], float)
+
+    def test_text_starting_with_magic(self):
+        file_name = self.tmp_file('t.txt')
+        with open(file_name, 'wt') as f:
+            f.write('TBAR is not a header\nTBAR\n')
+        self.assertEqual(['TBAR is not a header', 'TBAR'], read_array(file_name, False))
+
+    def test_short_file_starting_with_magic(self):
+        file_name = self.tmp_file('t.txt')
+        with open(file_name, 'wt') as f:
+            f.write('TBAR')
+        self.assertEqual(['TBAR'], read_array(file_name, False))
+
+    def test_truncated_binary_array(self):
+        file_name = self.tmp_file('a.dat')
+        write_binary_array(file_name, 'A', [1, 2, 3])
+        with open(file_name, 'r+b') as f:
+            f.truncate(ARRAY_FILE_HEADER.size + 4)
+        self.assertRaises(TinyBasicException, lambda: read_array(file_name, True))
+
+
+class ExecutionLimitsTest(unittest.TestCase):
+    def run_limited(self, lines: list[str], limits: ExecutionLimits) -> TinyBasicLimitException:
+        with self.assertRaises(TinyBasicLimitException) as cm:
+            run_program(lines, limits=limits)
+        return cm.exception
+
+    def test_step_limit(self):
+        e = self.run_limited(['10 GOTO 10'], ExecutionLimits(max_steps=1000))
+        self.assertEqual(ExecutionLimits.LIMIT_STEPS, e.limit)
+
+    def test_single_line_loop_counts_steps(self):
+        e = self.run_limited(['10 FOR i = 1 TO 100000: x = i'], ExecutionLimits(max_steps=1000))
+        self.assertEqual(ExecutionLimits.LIMIT_STEPS, e.limit)
+
+    def test_deadline(self):
+        e = self.run_limited(['10 GOTO 10'], ExecutionLimits(max_time=0.05))
+        self.assertEqual(ExecutionLimits.LIMIT_TIME, e.limit)
+
+    def test_array_elements(self):
+        e = self.run_limited(['10 DIM a(100000000)'], ExecutionLimits(max_array_elements=10000))
+        self.assertEqual(ExecutionLimits.LIMIT_ARRAY_ELEMENTS, e.limit)
+
+    def test_redim_releases_elements(self):
+        limits = ExecutionLimits(max_array_elements=150)
+        run_program(['10 DIM a(100)', '20 DIM a(100)', '30 b = 1'], limits=limits)
+        self.assertEqual(101, limits.array_elements)
+
+    def test_string_bytes(self):
+        e = self.run_limited(['10 a$ = "x"', '20 a$ = a$ + a$', '30 GOTO 20'], ExecutionLimits(max_string_bytes=1000))
+        self.assertEqual(ExecutionLimits.LIMIT_STRING_BYTES, e.limit)
+
+    def test_overwritten_strings_are_released(self):
+        limits = ExecutionLimits(max_string_bytes=10)
+        run_program(['10 FOR i = 1 TO 100', '20 a$ = "12345678"', '30 NEXT'], limits=limits)
+        self.assertEqual(8, limits.string_bytes)
+
+
+class SnapshotTest(TinyBasicTestCase):
+    def test_snapshot_and_continue(self):
+        file_name = self.tmp_file('vm.snap')
+        vm = run_program([
+            '10 DIM a(3): DIM s$(2): DIM m(2)',
+            '20 a(0) = 1: a(1) = 2: a(2) = 3: s$(0) = "x": s$(1) = "y": m(0) = NUM(3) / 2',
+            '30 FOR i = 1 TO 3',
+            f'40 IF i = 2 THEN SNAPSHOT "{file_name}": END',
+            '50 PRINT i',
+            '60 NEXT',
+        ])
+        self.assertEqual(['1', 'DONE.'], vm.io.output)
+        restored = TinyInterpreterVM(RecordingIo())
+        exec_line(restored, f'RESTORE "{file_name}"')
+        self.assertEqual(vm.text.text, restored.text.text)
+        self.assertEqual([1, 2, 3], restored.variables.access_var('a').value)
+        self.assertEqual(['x', 'y'], restored.variables.access_var('s$').value)
+        self.assertEqual([1.5, None], restored.variables.access_var('m').value)
+        exec_line(restored, 'CONT')
+        self.assertEqual(['2', '3', 'DONE.'], restored.io.output)
+
+    def test_values_keep_their_types(self):
+        file_name = self.tmp_file('vm.snap')
+        vm = TinyInterpreterVM(RecordingIo())
+        vm.variables.dim('A', 5)
+        vm.variables.access_var('A').value = [1, True, 2 ** 70, 0.5, None]
+        vm.snapshot(file_name)
+        restored = TinyInterpreterVM(RecordingIo())
+        restored.restore(file_name)
+        values = restored.variables.access_var('A').value
+        self.assertEqual([int, bool, int, float, type(None)], [type(value) for value in values])
+        self.assertEqual([1, True, 2 ** 70, 0.5, None], values)
+
+    def test_random_numbers_continue(self):
+        file_name = self.tmp_file('vm.snap')
+        program = ['10 RANDOMIZE 7', '20 FOR i = 1 TO 4', '40 PRINT RND(1000); RND(1099511627776)', '50 NEXT']
+        expected = run_program(program).io.output
+        vm = run_program(program + [f'30 IF i = 3 THEN SNAPSHOT "{file_name}": END'])
+        self.assertEqual(expected[:2] + ['DONE.'], vm.io.output)
+        restored = TinyInterpreterVM(RecordingIo())
+        exec_line(restored, f'RESTORE "{file_name}"')
+        self.assertTrue(restored.random.seeded)
+        exec_line(restored, 'CONT')
+        self.assertEqual(expected[2:], restored.io.output)
+
+    def test_not_a_snapshot(self):
+        file_name = self.tmp_file('vm.snap')
+        with open(file_name, 'wt') as f:
+            f.write('10 PRINT 1')
+        vm = TinyInterpreterVM(RecordingIo())
+        self.assertRaises(TinyBasicException, lambda: vm.restore(file_name))
+
+
+class ProgramFileTest(TinyBasicTestCase):
+    PROGRAM = ['10 REM tokenized', '20 lbl: ', '30 FOR i = 1 TO 2 : PRINT "A"; i MOD 2 : NEXT',
+               '40 IF i <= 3 AND NOT i = 1 THEN GOSUB lbl', '50 PRINT MID$("XYZ", 1, 1)', '60 END']
+
+    def test_binary_round_trip(self):
+        file_name = self.tmp_file('program.tbp')
+        vm = TinyInterpreterVM(RecordingIo())
+        for line in self.PROGRAM:
+            exec_line(vm, line)
+        exec_line(vm, f'SAVE "{file_name}" AS BINARY')
+        loaded = TinyInterpreterVM(RecordingIo())
+        exec_line(loaded, f'LOAD "{file_name}"')
+        self.assertEqual(vm.text.text, loaded.text.text)
+        self.assertEqual(6, len(loaded.text.tokens))
+        for line, tokens in loaded.text.tokens.items():
+            self.assertEqual([(token.type, token.value, pos) for token, pos in tokenize_line(line)],
+                             [(token.type, token.value, pos) for token, pos in tokens])
+        exec_line(loaded, 'LIST')
+        self.assertEqual(['PROGRAM LOADED: ' + file_name + ', 6 LINES'] + vm.text.get_program_text() + ['DONE'],
+                         loaded.io.output)
+
+    def test_text_files_still_load(self):
+        file_name = self.tmp_file('program.bas')
+        with open(file_name, 'wt') as f:
+            f.write('PRINT 1\nPRINT 2\n')
+        vm = run_program([f'LOAD "{file_name}"'])
+        self.assertEqual(['PROGRAM LOADED: ' + file_name + ', 2 LINES', '1', '2', 'DONE.'], vm.io.output)
+
+
+class ProgramLoaderTest(TinyBasicTestCase):
+    def write_source(self, lines: list[str]) -> str:
+        file_name = self.tmp_file('program.bas')
+        with open(file_name, 'wt') as f:
+            f.writelines(f'{line}\n' for line in lines)
+        return file_name
+
+    def test_streamed_chunks_load_like_text(self):
+        lines = ['PRINT  "A"', '', '20 x=1 : REM one', '20', '110 PRINT x;"B"', 'GOTO   20', '20 END']
+        file_name = self.write_source(lines)
+        expected = SourceText()
+        expected.set_text(lines)
+        for workers in [0, 2]:
+            text = SourceText()
+            self.assertEqual(7, load_program(file_name, text, workers, chunk_lines=2))
+            self.assertEqual(expected.text, text.text)
+            for line in text.text.values():
+                self.assertEqual([(token.type, token.value, pos) for token, pos in tokenize_line(line)],
+                                 [(token.type, token.value, pos) for token, pos in text.tokens[line]])
+
+    def test_syntax_error_of_a_worker(self):
+        file_name = self.write_source(['10 PRINT 1', '20 PRINT @'])
+        for workers in [0, 2]:
+            self.assertRaises(TinyBasicSyntaxError, lambda: load_program(file_name, SourceText(), workers, 1))
+
+    def test_every_line_is_lexed_once(self):
+        # The load time itself is measured by tiny_basic_load_benchmark
+        for lines in [500, 4000]:
+            file_name = self.tmp_file(f'generated{lines}.bas')
+            write_generated_program(file_name, lines)
+            text = SourceText()
+            with mock.patch.object(program_loader, 'tokenize_source_line',
+                                   wraps=program_loader.tokenize_source_line) as tokenize, \
+                    mock.patch.object(program_loader, 'tokenize_chunk', wraps=program_loader.tokenize_chunk) as chunk, \
+                    mock.patch.object(source_text, 'tokenize_line', wraps=source_text.tokenize_line) as lex_again:
+                self.assertEqual(lines, load_program(file_name, text, 0, chunk_lines=256))
+            self.assertEqual(lines, tokenize.call_count)
+            self.assertEqual((lines + 255) // 256, chunk.call_count)
+            self.assertEqual(0, lex_again.call_count)
+            self.assertEqual(lines, len(text.tokens))
+
+
+class MatTest(unittest.TestCase):
+    def test_array_operations(self):
+        vm = run_program(['10 DIM a(3): DIM b(3): DIM c(3)', '20 FOR i = 0 TO 2', '30 a(i) = i + 1', '40 NEXT',
+                          '50 MAT b = CON', '60 MAT c = a + b', '70 s = 2', '80 MAT a = s * a',
+                          '90 MAT b = (NUM(1) / 2) * c', '100 PRINT SUM(a); DOT(a, c); SUM(b)', '110 MAT c = a - c',
+                          '120 MAT d = c', '130 MAT c = ZER', '140 PRINT SUM(c); d(2)'])
+        self.assertEqual(['12 40 4.5', '0 2', 'DONE.'], vm.io.output)
+        self.assertEqual([1.0, 1.5, 2.0], vm.variables.access_var('b').value)
+
+    def test_array_checks(self):
+        for line, message in [('MAT c = a + b', 'DIMENSIONS OF A AND B DO NOT MATCH'),
+                              ('MAT c = 2 * u', 'U[1] IS NOT YET ASSIGNED'),
+                              ('PRINT DOT(a, s$)', 'S$ IS NOT NUM'),
+                              ('MAT x = ZER', 'Undefined variable: X')]:
+            with self.assertRaises(TinyBasicException) as error:
+                run_program(['10 DIM a(2): DIM b(3): DIM u(2): DIM s$(2)', '20 MAT a = CON: MAT b = CON',
+                             '30 u(0) = 1', f'40 {line}'])
+            self.assertEqual(message, str(error.exception))
+
+
+class ArrayStatementTest(unittest.TestCase):
+    def test_sort_and_find(self):
+        vm = run_program(['10 DIM w$(4)', '20 w$(0) = "pear": w$(1) = "apple": w$(2) = "fig": w$(3) = "kiwi"',
+                          '30 SORT w$', '40 PRINT w$(0); FIND(w$, "kiwi"); FIND(w$, "plum")', '50 SORT w$ DESC',
+                          '60 PRINT w$(0); w$(3)'])
+        self.assertEqual(['apple 2 -1', 'pear apple', 'DONE.'], vm.io.output)
+
+    def test_fill_and_copy(self):
+        vm = run_program(['10 DIM a(3)', '20 FILL a, 7', '30 COPY a TO b', '40 b(1) = 3', '50 SORT b',
+                          '60 PRINT a(1); b(0); ALEN(b); FIND(b, 7)'])
+        self.assertEqual(['7 3 3 1', 'DONE.'], vm.io.output)
+
+    def test_checks(self):
+        for line, message in [('SORT u', 'U[1] IS NOT YET ASSIGNED'),
+                              ('COPY u TO v$', 'U IS NOT STRING'),
+                              ('PRINT FIND(a, "x")', 'x IS NOT NUM'),
+                              ('FILL x, 1', 'Undefined variable: X')]:
+            with self.assertRaises(TinyBasicException) as error:
+                run_program(['10 DIM a(2): DIM u(2)', '20 FILL a, 1: u(0) = 1', f'30 {line}'])
+            self.assertEqual(message, str(error.exception))
+
+
+class MapTest(TinyBasicTestCase):
+    PROGRAM = ['10 DIM m{}: DIM n${}', '20 m("a") = 1: m(5) = 2: n$("x") = "y"', '30 FOR i = 1 TO 3', '40 m(i) = i * 2',
+               '50 NEXT', '60 DELETE m, "a"', '70 KEYS m, k$']
+
+    def test_map_operations(self):
+        vm = run_program(self.PROGRAM + ['80 PRINT m(5); n$("x"); ALEN(m); HASKEY(m, "a"); HASKEY(m, 3); k$(0)'])
+        self.assertEqual(['2 y 4 0 1 5', 'DONE.'], vm.io.output)
+
+    def test_map_errors(self):
+        for line, message in [('PRINT m("b")', 'b IS NOT A KEY OF M'),
+                              ('DELETE m, "b"', 'b IS NOT A KEY OF M'),
+                              ('PRINT a("b")', 'A IS NOT A MAP'),
+                              ('PRINT HASKEY(a, 1)', 'A IS NOT A MAP'),
+                              ('SORT m', 'M IS A MAP')]:
+            with self.assertRaises(TinyBasicException) as error:
+                run_program(['10 DIM m{}: DIM a(2)', f'20 {line}'])
+            self.assertEqual(message, str(error.exception))
+
+    def test_map_limits(self):
+        limits = ExecutionLimits(max_array_elements=3)
+        vm = run_program(['10 DIM m$ {}', '20 m$("a") = "xy": m$("a") = "xyz": m$("b") = ""', '30 DELETE m$, "a"'],
+                         limits=limits)
+        self.assertEqual((1, 0), (limits.array_elements, limits.string_bytes))
+        exec_line(vm, 'm$(1) = "": m$(2) = ""')
+        self.assertRaises(TinyBasicLimitException, lambda: exec_line(vm, 'm$(3) = ""'))
+
+    def test_snapshot_and_clone(self):
+        file_name = self.tmp_file('vm.snap')
+        vm = run_program(self.PROGRAM + [f'80 SNAPSHOT "{file_name}"'])
+        restored = TinyInterpreterVM(RecordingIo())
+        restored.restore(file_name)
+        self.assertEqual({5: 2, 1: 2, 2: 4, 3: 6}, restored.variables.access_var('m').value)
+        clone = restored.clone()
+        exec_line(clone, 'm(5) = 7')
+        self.assertEqual(2, restored.variables.read_num_var('m', 5))
+        self.assertEqual(7, clone.variables.read_num_var('m', 5))
+
+
+class MultiDimArrayTest(TinyBasicTestCase):
+    PROGRAM = ['10 DIM g(3, 4): DIM s$(2, 2)', '20 FOR y = 0 TO 2', '30 FOR x = 0 TO 3', '40 g(y, x) = y * 10 + x',
+               '50 NEXT', '60 NEXT', '70 s$(1, 0) = "a"']
+
+    def test_row_major_storage(self):
+        vm = run_program(self.PROGRAM + ['80 PRINT g(2, 3); g(1, 0); ALEN(g); ALEN(g, 1); ALEN(g, 2); s$(1, 0)'])
+        self.assertEqual(['23 10 12 3 4 a', 'DONE.'], vm.io.output)
+        self.assertEqual([0, 1, 2, 3, 10, 11, 12, 13, 20, 21, 22, 23], vm.variables.access_var('g').value)
+
+    def test_errors(self):
+        for line, message in [('PRINT g(3, 0)', '(3, 0) IS OUT OF BOUNDS FOR G: NUM[3, 4]'),
+                              ('PRINT g(0, 4)', '(0, 4) IS OUT OF BOUNDS FOR G: NUM[3, 4]'),
+                              ('PRINT g(0, 0, 0)', 'G HAS 2 DIMENSIONS, NOT 3'),
+                              ('PRINT ALEN(g, 3)', 'G HAS NO DIMENSION 3'),
+                              ('DIM h(2, 0 - 1)', 'DIM should be a positive number, not (2, -1) for H')]:
+            with self.assertRaises(TinyBasicException) as error:
+                run_program(['10 DIM g(3, 4)', f'20 {line}'])
+            self.assertEqual(message, str(error.exception))
+
+    def test_snapshot(self):
+        file_name = self.tmp_file('vm.snap')
+        run_program(self.PROGRAM + [f'80 SNAPSHOT "{file_name}"'])
+        restored = TinyInterpreterVM(RecordingIo())
+        restored.restore(file_name)
+        exec_line(restored, 'PRINT g(2, 1); ALEN(g, 2)')
+        self.assertEqual(['21 4'], restored.io.output)
+
+
+class StringFunctionTest(unittest.TestCase):
+    def test_string_functions(self):
+        vm = run_program(['10 a$ = "Hello World"',
+                          '20 PRINT INSTR(a$, "o"); INSTR(a$, "o", 5); INSTR(a$, "x"); LEFT$(a$, 5); RIGHT$(a$, 3)',
+                          '30 PRINT UCASE$(a$); LCASE$(a$); REPLACE$(a$, "o", "0"); RIGHT$(a$, 0)'])
+        self.assertEqual(['4 7 -1 Hello rld', 'HELLO WORLD hello world Hell0 W0rld ', 'DONE.'], vm.io.output)
+
+    def test_split_and_join(self):
+        vm = run_program(['10 SPLIT "a,b,,c", p$, ","', '20 SPLIT " x  y ", w$', '30 DIM n(2): n(0) = 1: n(1) = 2',
+                          '40 PRINT ALEN(p$); p$(3); ALEN(w$); JOIN$(p$, "-"); JOIN$(w$); JOIN$(n, "+")'])
+        self.assertEqual(['4 c 2 a-b--c xy 1+2', 'DONE.'], vm.io.output)
+
+    def test_split_errors(self):
+        for line, message in [('SPLIT "a", p$, ""', 'EMPTY SEPARATOR'), ('SPLIT "a", p, ","', 'STRING VARIABLE')]:
+            with self.assertRaises(TinyBasicException) as error:
+                run_program([f'10 {line}'])
+            self.assertIn(message, str(error.exception))
+
+
+class UserFunctionTest(TinyBasicTestCase):
+    PROGRAM = ['10 DEF FNfib(n) = IIF(n < 2, n, FNfib(n - 1) + FNfib(n - 2)) CACHED',
+               '20 DEF FNsq(x) = x * x: DEF FNrep$(a$, n) = a$ * n', '30 n = 5']
+
+    def test_functions(self):
+        vm = run_program(self.PROGRAM + ['40 PRINT FNfib(60); FNsq(3); FNsq(NUM(7) / 2); FNrep$("ab", 2); n'])
+        self.assertEqual(['1548008755920 9 12.25 abab 5', 'DONE.'], vm.io.output)
+        self.assertIsNotNone(vm.user_functions['FNSQ'].body)
+
+    def test_recursion(self):
+        vm = run_program(['10 DEF FNack(m, n) = IIF(m = 0, n + 1, IIF(n = 0, FNack(m - 1, 1), '
+                          'FNack(m - 1, FNack(m, n - 1))))', '20 PRINT FNack(2, 3)'])
+        self.assertEqual(['9', 'DONE.'], vm.io.output)
+
+    def test_bounded_cache(self):
+        vm = run_program(['10 DEF FNsq(x) = x * x CACHED 2: s = 0', '20 FOR i = 1 TO 5', '30 s = s + FNsq(i)', '40 NEXT'])
+        self.assertEqual([((int, 4),), ((int, 5),)], list(vm.user_functions['FNSQ'].cache))
+        self.assertEqual(55, vm.variables.read_num_var('s'))
+
+    def test_errors(self):
+        for line, message in [('PRINT FNx(1)', 'Undefined variable: FNX'),
+                              ('DEF FNa(x) = "s": PRINT FNa(1)', 's IS NOT A NUMBER'),
+                              ('DEF FNa(x, x) = 1', 'DUPLICATE PARAMETER X OF FNA'),
+                              ('DEF FNa(x) = x: PRINT FNa(1, 2)', 'FNA EXPECTS 1 ARGUMENTS, NOT 2'),
+                              ('DEF FNa(x$) = x$: PRINT FNa(1)', '1 IS NOT A STRING'),
+                              ('DEF FNd(n) = FNd(n + 1): PRINT FNd(1)', 'RECURSION TOO DEEP IN FND')]:
+            with self.assertRaises(TinyBasicException) as error:
+                run_program([f'10 {line}'])
+            self.assertEqual(message, str(error.exception))
+
+    def test_undefined_names_are_arrays(self):
+        vm = run_program(['10 DIM fnord(3): fnord(1) = 5: PRINT fnord(1)'])
+        self.assertEqual(['5', 'DONE.'], vm.io.output)
+        vm = TinyInterpreterVM(RecordingIo())
+        vm.context.hot_threshold = 1
+        for line in ['10 DIM fnord(4): s = 0', '20 FOR i = 1 TO 3', '30 fnord(i) = i: s = s + fnord(i)', '40 NEXT',
+                     '50 PRINT s']:
+            exec_line(vm, line)
+        exec_line(vm, 'RUN')
+        self.assertEqual(['6', 'DONE.'], vm.io.output)
+
+    def test_snapshot_and_clone(self):
+        file_name = self.tmp_file('vm.snap')
+        run_program(self.PROGRAM + [f'40 SNAPSHOT "{file_name}"'])
+        restored = TinyInterpreterVM(RecordingIo())
+        restored.restore(file_name)
+        clone = restored.clone(RecordingIo())
+        exec_line(clone, 'PRINT FNfib(10); FNrep$("x", 3)')
+        self.assertEqual(['55 xxx'], clone.io.output)
+
+
+class FunctionRegistryTest(unittest.TestCase):
+    @staticmethod
+    def new_vm() -> TinyInterpreterVM:
+        vm = TinyInterpreterVM(RecordingIo())
+        vm.functions.register('CRC32', lambda x: zlib.crc32(x[0].encode()), [Variable.TYPE_STR], Variable.TYPE_INT)
+        vm.functions.register('CLAMP', lambda x: max(x[1], min(x[0], x[2])),
+                              [Variable.TYPE_NUM, Variable.TYPE_NUM, Variable.TYPE_NUM], Variable.TYPE_NUM)
+        return vm
+
+    def run_lines(self, vm: TinyInterpreterVM, lines: list[str]) -> TinyInterpreterVM:
+        for line in lines + ['RUN']:
+            exec_line(vm, line)
+        return vm
+
+    def test_registered_functions(self):
+        vm = self.run_lines(self.new_vm(), ['5 s = 0', '10 FOR i = 1 TO 3', '20 s = s + crc32(STR$(i))', '30 NEXT',
+                                            '40 PRINT s; CLAMP(12, 0, 10); CLAMP(NUM(1) / 2, 0, 10)'])
+        expected = sum(zlib.crc32(str(i).encode()) for i in range(1, 4))
+        self.assertEqual([f'{expected} 10 0.5', 'DONE.'], vm.io.output)
+
+    def test_signature_errors(self):
+        for line, message in [('PRINT CRC32(1)', '1 IS NOT STRING, ARGUMENT 1 OF CRC32'),
+                              ('PRINT CRC32("a", "b")', 'TOO MUCH ARGUMENTS FOR CRC32'),
+                              ('PRINT CLAMP(1, 2)', 'TOO FEW ARGUMENTS FOR CLAMP')]:
+            with self.assertRaises(TinyBasicException) as error:
+                exec_line(self.new_vm(), line)
+            self.assertEqual(message, str(error.exception))
+        self.assertRaises(TinyBasicTypeException, lambda: self.run_lines(self.new_vm(), ['10 PRINT CRC32(1)']))
+        for name in ['PRINT', 'FNX', 'MID$', 'A B']:
+            self.assertRaises(TinyBasicException, lambda: self.new_vm().functions.register(name, len, []))
+
+    def test_result_is_checked(self):
+        vm = self.new_vm()
+        vm.functions.register('CRC32', lambda x: 'x', [Variable.TYPE_STR], Variable.TYPE_INT)
+        with self.assertRaises(TinyBasicException) as error:
+            self.run_lines(vm, ['10 PRINT CRC32("a")'])
+        self.assertEqual('CRC32 RETURNED x, NOT INT', str(error.exception))
+
+    def test_registries_are_per_vm(self):
+        vm = self.new_vm()
+        clone = vm.clone(RecordingIo())
+        clone.functions.register('TWICE', lambda x: x[0] * 2, [Variable.TYPE_INT], Variable.TYPE_INT)
+        other = TinyInterpreterVM(RecordingIo())
+        self.assertNotIn('CRC32', other.functions)
+        self.assertNotIn('CRC32', TinyBasicInterpreter.builtin_functions)
+        self.assertNotIn('TWICE', vm.functions)
+        self.assertIn('CRC32', clone.functions)
+        self.assertIn('LEN', other.functions)
+        # Without a registered function the name reads an array
+        with self.assertRaises(TinyBasicException) as error:
+            self.run_lines(other, ['10 PRINT CRC32("a")'])
+        self.assertEqual('Undefined variable: CRC32', str(error.exception))
+
+    def test_register_drops_inferred_types(self):
+        vm = self.new_vm()
+        vm.context.hot_threshold = 1
+        vm.functions.register('SCALE', lambda x: x[0] * 2, [Variable.TYPE_NUM], Variable.TYPE_INT)
+        lines = ['5 s = 0', '10 FOR i = 1 TO 3', '20 s = s + SCALE(i)', '30 NEXT', '40 PRINT s']
+        self.run_lines(vm, lines)
+        self.assertIn('S', vm.text.int_variables)
+        vm.functions.register('SCALE', lambda x: x[0] / 2, [Variable.TYPE_NUM], Variable.TYPE_NUM)
+        self.assertIsNone(vm.text.runtime_checks)
+        self.assertEqual({}, vm.text.type_cache)
+        self.assertEqual({}, vm.text.compiled)
+        exec_line(vm, 'RUN')
+        self.assertNotIn('S', vm.text.int_variables)
+        self.assertEqual(['12', 'DONE.', '3.0', 'DONE.'], vm.io.output)
+
+
+class RandomTest(unittest.TestCase):
+    PROGRAM = ['10 RANDOMIZE 42', '20 FOR i = 1 TO 300', '30 s = s + RND(6) * i', '40 NEXT', '50 PRINT s; RND(5, 8)']
+
+    def test_same_seed_same_numbers(self):
+        first = run_program(['5 s = 0'] + self.PROGRAM)
+        second = run_program(['5 s = 0'] + self.PROGRAM)
+        self.assertEqual(first.io.output, second.io.output)
+        values = [first.random.randrange(5, 8) for _ in range(1000)]
+        self.assertEqual({5, 6, 7}, set(values))
+
+    def test_vms_have_their_own_generator(self):
+        template = TinyInterpreterVM(RecordingIo())
+        exec_line(template, 'RANDOMIZE "seed"')
+        clone = template.clone()
+        self.assertIsNot(template.random, clone.random)
+        self.assertEqual([template.random.randrange(0, 100) for _ in range(10)],
+                         [clone.random.randrange(0, 100) for _ in range(10)])
+
+    def test_empty_range(self):
+        with self.assertRaises(TinyBasicException) as error:
+            run_program(['10 PRINT RND(0)'])
+        self.assertEqual('EMPTY RANGE FOR RND: 0..0', str(error.exception))
+
+
+class OnStatementTest(unittest.TestCase):
+    def test_on_goto_and_gosub(self):
+        vm = run_program(['10 FOR i = 0 TO 4', '20 ON i GOSUB 100, 200, THREE', '30 NEXT', '40 ON 2 GOTO 60, 70',
+                          '50 END', '60 PRINT "sixty": END', '70 PRINT "seventy": END', '100 PRINT "one": RETURN',
+                          '200 PRINT "two": RETURN', '300 THREE:', '310 PRINT "three": RETURN'])
+        self.assertEqual(['one', 'two', 'three', 'seventy', 'DONE.'], vm.io.output)
+
+    def test_only_the_selected_target_is_evaluated(self):
+        vm = run_program(['10 ON 1 GOTO 30, undefined_target', '20 END', '30 PRINT "ok"'])
+        self.assertEqual(['ok', 'DONE.'], vm.io.output)
+
+    def test_compiled_jump_table(self):
+        vm = TinyInterpreterVM(RecordingIo())
+        vm.context.hot_threshold = 1
+        for line in ['5 a = 0: b = 0: c = 0', '10 FOR i = 1 TO 300', '20 ON i MOD 3 + 1 GOTO 30, 40, 50',
+                     '30 a = a + 1: GOTO 60', '40 b = b + 1: GOTO 60', '50 c = c + 1', '60 NEXT', '70 ON 9 GOTO 5',
+                     '80 PRINT a; b; c']:
+            exec_line(vm, line)
+        exec_line(vm, 'RUN')
+        self.assertEqual(['100 100 100', 'DONE.'], vm.io.output)
+        self.assertTrue(vm.text.compiled[20])
+
+    def test_missing_line(self):
+        with self.assertRaises(TinyBasicException) as error:
+            run_program(['10 ON 1 GOTO 99'])
+        self.assertEqual('Line number not found: 99', str(error.exception))
+
+
+class BlockLoopTest(unittest.TestCase):
+    def test_nested_while_and_repeat(self):
+        vm = run_program(['10 i = 0: s = 0', '20 WHILE i < 3', '30 j = 0', '40 REPEAT', '50 s = s + 1', '60 j = j + 1',
+                          '70 UNTIL j >= i', '80 i = i + 1', '90 WEND', '100 PRINT i; s'])
+        self.assertEqual(['3 4', 'DONE.'], vm.io.output)
+        self.assertEqual([], vm.context.stack)
+
+    def test_while_skips_a_false_loop(self):
+        vm = run_program(['10 WHILE 0', '20 PRINT "never"', '30 WEND', '40 PRINT "after"'])
+        self.assertEqual(['after', 'DONE.'], vm.io.output)
+
+    def test_compiled_loops(self):
+        vm = TinyInterpreterVM(RecordingIo())
+        vm.context.hot_threshold = 1
+        for line in ['10 i = 0: s = 0', '20 WHILE i < 500', '30 i = i + 1', '40 n = 0', '50 REPEAT', '60 n = n + 1',
+                     '70 UNTIL n = 2', '80 s = s + n', '90 WEND', '100 PRINT s']:
+            exec_line(vm, line)
+        exec_line(vm, 'RUN')
+        self.assertEqual(['1000', 'DONE.'], vm.io.output)
+        self.assertTrue(vm.text.compiled[20])
+        self.assertTrue(vm.text.compiled[70])
+
+    def test_edits_match_the_blocks_again(self):
+        vm = TinyInterpreterVM(RecordingIo())
+        for line in ['10 i = 0', '20 WHILE i < 2', '30 i = i + 1', '40 WEND', '50 PRINT i']:
+            exec_line(vm, line)
+        exec_line(vm, 'RUN')
+        exec_line(vm, '35 i = i + 1')
+        exec_line(vm, 'RUN')
+        self.assertEqual(['2', 'DONE.', '2', 'DONE.'], vm.io.output)
+
+    def test_unmatched_blocks(self):
+        for lines, message in [(['10 WHILE 1', '20 PRINT 1'], 'WHILE WITHOUT WEND'),
+                               (['10 WEND'], 'WEND WITHOUT WHILE'),
+                               (['10 REPEAT', '20 WEND'], 'REPEAT WITHOUT UNTIL'),
+                               (['10 WHILE 1', '20 UNTIL 1', '30 WEND'], 'UNTIL WITHOUT REPEAT')]:
+            with self.assertRaises(TinyBasicException) as error:
+                run_program(lines)
+            self.assertEqual(message, str(error.exception))
+
+    def test_statements_after_a_loop_statement(self):
+        for lines, line_number, statement in [
+                (['10 i = 0', '20 WHILE i < 2: PRINT "x"', '30 i = i + 1', '40 WEND'], 20, 'WHILE'),
+                (['10 i = 0', '20 WHILE i < 2', '30 i = i + 1', '40 WEND: PRINT "x"'], 40, 'WEND'),
+                (['10 REPEAT: PRINT "x"', '20 UNTIL 1'], 10, 'REPEAT'),
+                (['10 c = 0', '20 REPEAT', '30 c = c + 1', '40 UNTIL c: PRINT "x"'], 40, 'UNTIL')]:
+            with self.assertRaises(TinyBasicTypeException) as error:
+                run_program(lines)
+            self.assertEqual([(line_number, f'{statement} MUST END ITS LINE')], error.exception.errors)
+            # Without the type inference the interpreter rejects the line, also when it is hot
+            for hot_threshold in [None, 1]:
+                vm = TinyInterpreterVM(RecordingIo())
+                vm.context.hot_threshold = hot_threshold
+                for line in lines:
+                    exec_line(vm, line)
+                with mock.patch.object(TinyInterpreterVM, 'check_types'):
+                    with self.assertRaises(TinyBasicException) as error:
+                        exec_line(vm, 'RUN')
+                self.assertEqual(f'{statement} MUST END ITS LINE', str(error.exception))
+                self.assertNotIn('x', vm.io.output)
+
+
+class BlockIfTest(unittest.TestCase):
+    def test_if_else_end_if(self):
+        vm = run_program(['10 FOR i = 1 TO 4', '20 IF i MOD 2 = 0 THEN', '30 PRINT i; "even"', '40 ELSE',
+                          '50 IF i = 1 THEN', '60 PRINT i; "one"', '70 END IF', '80 PRINT i; "odd"', '90 END IF',
+                          '100 NEXT'])
+        self.assertEqual(['1 one', '1 odd', '2 even', '3 odd', '4 even', 'DONE.'], vm.io.output)
+
+    def test_if_without_else(self):
+        vm = run_program(['10 IF 0 THEN', '20 PRINT "never"', '30 END IF', '40 IF 1 THEN PRINT "single"'])
+        self.assertEqual(['single', 'DONE.'], vm.io.output)
+
+    def test_compiled_blocks(self):
+        vm = TinyInterpreterVM(RecordingIo())
+        vm.context.hot_threshold = 1
+        for line in ['5 a = 0: b = 0', '10 FOR i = 1 TO 300', '20 IF i MOD 3 = 0 THEN', '30 a = a + 1', '40 ELSE',
+                     '50 b = b + 1', '60 END IF', '70 NEXT', '80 PRINT a; b']:
+            exec_line(vm, line)
+        exec_line(vm, 'RUN')
+        self.assertEqual(['100 200', 'DONE.'], vm.io.output)
+        self.assertTrue(vm.text.compiled[20])
+        self.assertTrue(vm.text.compiled[40])
+        self.assertTrue(vm.text.compiled[60])
+
+    def test_unmatched_blocks(self):
+        for lines, message in [(['10 IF 1 THEN', '20 PRINT 1'], 'IF WITHOUT END IF'),
+                               (['10 ELSE'], 'ELSE WITHOUT IF'),
+                               (['10 END IF'], 'END IF WITHOUT IF'),
+                               (['10 IF 1 THEN', '20 WHILE 0', '30 END IF', '40 WEND'], 'IF WITHOUT END IF'),
+                               (['10 IF 1 THEN', '20 PRINT 1: ELSE', '30 END IF'], 'ELSE WITHOUT IF')]:
+            with self.assertRaises(TinyBasicException) as error:
+                run_program(lines)
+            self.assertEqual(message, str(error.exception))
+
+    def test_statements_after_else_and_end_if(self):
+        for lines, line_number, statement in [
+                (['10 IF 1 THEN', '20 PRINT "a"', '30 ELSE: PRINT "x"', '40 END IF'], 30, 'ELSE'),
+                (['10 IF 1 THEN', '20 PRINT "a"', '30 END IF: PRINT "x"'], 30, 'END IF')]:
+            with self.assertRaises(TinyBasicTypeException) as error:
+                run_program(lines)
+            self.assertEqual([(line_number, f'{statement} MUST END ITS LINE')], error.exception.errors)
+            for hot_threshold in [None, 1]:
+                vm = TinyInterpreterVM(RecordingIo())
+                vm.context.hot_threshold = hot_threshold
+                for line in lines:
+                    exec_line(vm, line)
+                with mock.patch.object(TinyInterpreterVM, 'check_types'):
+                    with self.assertRaises(TinyBasicException) as error:
+                        exec_line(vm, 'RUN')
+                self.assertEqual(f'{statement} MUST END ITS LINE', str(error.exception))
+                self.assertEqual(['a'], vm.io.output)
+
+
+class CloneTest(unittest.TestCase):
+    def test_clones_copy_variables_on_write(self):
+        template = TinyInterpreterVM(RecordingIo())
+        for line in ['10 a(0) = a(0) + 1', '20 PRINT a(0)']:
+            exec_line(template, line)
+        template.reset()
+        template.variables.dim('a', 2)
+        template.variables.write_num_var('a', 10, 0)
+        first = template.clone(RecordingIo())
+        second = template.clone(RecordingIo())
+        self.assertIs(template.variables.access_var('a'), first.variables.access_var('a'))
+        first.run()
+        second.run()
+        second.context.ip = 0
+        second.run()
+        self.assertEqual(['11', 'DONE.'], first.io.output)
+        self.assertEqual(['11', 'DONE.', '12', 'DONE.'], second.io.output)
+        self.assertEqual(10, template.variables.read_num_var('a'))
+        self.assertIs(template.text.text, first.text.text)
+        self.assertIs(template.context.line_tab, first.context.line_tab)
+
+    def test_editing_a_clone_keeps_the_template(self):
+        template = TinyInterpreterVM(RecordingIo())
+        exec_line(template, '10 PRINT 1')
+        clone = template.clone()
+        exec_line(clone, '10 PRINT 2')
+        exec_line(clone, '20 PRINT 3')
+        self.assertEqual({10: 'PRINT 1'}, template.text.text)
+        self.assertEqual([10], template.text.get_line_table())
+        self.assertEqual([10, 20], clone.text.get_line_table())
+
+    def test_replaced_lines_leave_the_token_cache(self):
+        vm = TinyInterpreterVM(RecordingIo())
+        for i in range(100):
+            exec_line(vm, f'10 PRINT {i}')
+            exec_line(vm, 'RUN')
+        exec_line(vm, '20 PRINT 0')
+        exec_line(vm, '20')
+        self.assertEqual(['PRINT 99'], list(vm.text.tokens))
+        exec_line(vm, 'NEW')
+        self.assertEqual({}, vm.text.tokens)
+
+    def test_pool(self):
+        template = TinyInterpreterVM(RecordingIo())
+        for line in ['10 GOTO DONE', '20 PRINT "SKIPPED"', '30 DONE:', '40 PRINT "OK"']:
+            exec_line(template, line)
+        pool = VMPool(template, size=2)
+        vms = [pool.acquire(RecordingIo()) for _ in range(3)]
+        pool.refill()
+        self.assertEqual(2, len(pool.ready))
+        for vm in vms:
+            vm.run()
+            self.assertEqual(['OK', 'DONE.'], vm.io.output)
+
+
+class CompiledLinesTest(unittest.TestCase):
+    PROGRAM = [
+        '10 s = 0 : t$ = ""',
+        '20 FOR i = 1 TO 30',
+        '30 s = s + i * 2 MOD 7 : t$ = MID$("ABC", i MOD 3, 1) + STR$(i / 4)',
+        '40 IF s > 10 AND NOT i = 3 THEN s = s - 10 : PRINT s; t$',
+        '50 NEXT i',
+        '60 PRINT s, NUM(s) / 4',
+    ]
+
+    def run_with_threshold(self, lines: list[str], hot_threshold: int or None) -> TinyInterpreterVM:
+        vm = TinyInterpreterVM(RecordingIo())
+        vm.context.hot_threshold = hot_threshold
+        for line in lines:
+            exec_line(vm, line)
+        exec_line(vm, 'RUN')
+        return vm
+
+    def test_compiled_lines_behave_like_interpreted_lines(self):
+        interpreted = self.run_with_threshold(self.PROGRAM, None)
+        compiled = self.run_with_threshold(self.PROGRAM, 2)
+        self.assertEqual(interpreted.io.output, compiled.io.output)
+        self.assertEqual({}, interpreted.text.compiled)
+        self.assertTrue(compiled.text.compiled[30])
+
+    def test_type_errors_are_reported_like_the_interpreter(self):
+        lines = ['10 i = 0', '20 i = i + 1', '30 IF i > 5 THEN x = "A"', '40 GOTO 20']
+        messages = []
+        for hot_threshold in [None, 1]:
+            with self.assertRaises(TinyBasicException) as error:
+                self.run_with_threshold(lines, hot_threshold)
+            messages.append(str(error.exception))
+        self.assertEqual(messages[0], messages[1])
+
+    def test_lines_without_compiled_form_stay_interpreted(self):
+        vm = self.run_with_threshold(['10 DIM a(2)', '20 a(1) = 5 : PRINT "A" + "B"; a(1)'], 1)
+        self.assertEqual(['AB 5', 'DONE.'], vm.io.output)
+        self.assertFalse(vm.text.compiled[10])
+        self.assertTrue(vm.text.compiled[20])
+
+    def test_integer_arithmetic(self):
+        lines = ['10 f = NUM(7)', '20 FOR i = 1 TO 3', '30 q = i * 7 / 2', '40 r = f / 2', '50 PRINT q; r', '60 NEXT']
+        interpreted = self.run_with_threshold(lines, None)
+        compiled = self.run_with_threshold(lines, 1)
+        self.assertEqual(['3 3.5', '7 3.5', '10 3.5', 'DONE.'], compiled.io.output)
+        self.assertEqual(interpreted.io.output, compiled.io.output)
+        self.assertEqual(frozenset(['I', 'Q']), compiled.text.int_variables)
+
+    def test_edit_invalidates_compiled_line(self):
+        vm = self.run_with_threshold(['10 PRINT "OLD"', '20 PRINT "END"'], 1)
+        exec_line(vm, '10 PRINT "NEW"')
+        self.assertNotIn(10, vm.text.compiled)
+        self.assertIn(20, vm.text.compiled)
+        exec_line(vm, 'RUN')
+        self.assertEqual(['OLD', 'END', 'DONE.', 'NEW', 'END', 'DONE.'], vm.io.output)
+
+    def test_edit_invalidates_dependent_lines(self):
+        vm = self.run_with_threshold(['10 n = 1', '20 m = n * 2', '30 k = m + 1', '40 PRINT "END"'], 1)
+        self.assertEqual(frozenset(['N', 'M', 'K']), vm.text.int_variables)
+        exec_line(vm, '10 n = NUM(1) / 2')
+        self.assertEqual(frozenset(), vm.text.int_variables)
+        self.assertEqual({40}, set(vm.text.compiled))
+        self.assertNotIn('m = n * 2', vm.text.proven_lines)
+        exec_line(vm, 'PRINT n')
+        self.assertEqual(['END', 'DONE.', '1'], vm.io.output)
+        exec_line(vm, 'RUN')
+        exec_line(vm, 'PRINT k')
+        self.assertEqual(['END', 'DONE.', '1', 'END', 'DONE.', '2.0'], vm.io.output)
+
+    def test_run_after_edit_of_large_program(self):
+        lines = [f'{line_number} v{line_number} = {line_number} * 2' for line_number in range(1, 5001)]
+        vm = self.run_with_threshold(lines, None)
+        checks = []
+        for line in ['2500 v2500 = v2499 + 1', 'RUN', 'PRINT v2500', 'RUN']:
+            with mock.patch.object(tiny_basic_types.TinyBasicTypeChecker, 'check', autospec=True,
+                                   side_effect=tiny_basic_types.TinyBasicTypeChecker.check) as check:
+                exec_line(vm, line)
+            checks.append(check.call_count)
+        # Only the edited line is checked again, a RUN without edits checks nothing
+        self.assertEqual([0, 1, 0, 0], checks)
+        self.assertIn('V2500', vm.text.int_variables)
+
+
+class TypeInferenceTest(unittest.TestCase):
+    def test_type_errors_are_reported_before_the_run(self):
+        io = RecordingIo()
+        with self.assertRaises(TinyBasicTypeException) as error:
+            run_program(['10 PRINT "START"', '20 END', '30 x = "A"', '40 a$ = 1 + 2', '50 y = "A" - 1'], io)
+        self.assertEqual([(30, 'NUMERIC EXPRESSION EXPECTED'), (40, 'STRING EXPRESSION EXPECTED'),
+                          (50, 'CAN NOT APPLY - TO STRING AND INT')], error.exception.errors)
+        self.assertEqual([], io.output)
+
+    def test_integer_variables(self):
+        vm = run_program(['10 DIM a(3)', '20 FOR i = 0 TO 2', '30 a(i) = i * 2', '40 f = i / 2 + NUM(1)',
+                          '50 n = 1', '60 n = n + f', '70 NEXT', '80 PRINT a(2)', '90 END', '100 READ b, "missing"', '110 a(f) = 1'])
+        self.assertEqual(frozenset(['A', 'I']), vm.text.int_variables)
+        self.assertIn('a ( i ) = i * 2', vm.text.proven_lines)
+        self.assertIn('n = n + f', vm.text.proven_lines)
+        self.assertNotIn('a ( f ) = 1', vm.text.proven_lines)
+        self.assertEqual(['4', 'DONE.'], vm.io.output)
+
+    def test_restore_disables_integer_variables(self):
+        vm = run_program(['10 i = 1', '20 IF i = 0 THEN RESTORE "missing"'])
+        self.assertEqual(frozenset(), vm.text.int_variables)
+
+    def test_cont_clears_types(self):
+        vm = run_program(['10 i = 1', '20 PRINT i'])
+        self.assertEqual(frozenset(['I']), vm.text.int_variables)
+        exec_line(vm, 'i = NUM(i)')
+        self.assertEqual(frozenset(['I']), vm.text.int_variables)
+        exec_line(vm, 'CONT')
+        self.assertIsNone(vm.text.runtime_checks)
+        self.assertEqual(frozenset(), vm.text.proven_lines)
+
+    def test_assignment_chain_is_checked_in_linear_time(self):
+        sizes = [100, 200, 400]
+        counts = []
+        for size in sizes:
+            lines = ['1 v0 = NUM(1)'] + [f'{i + 1} v{i} = v{i - 1} + 1' for i in range(1, size)]
+            with mock.patch.object(tiny_basic_types, 'check_line_types', wraps=tiny_basic_types.check_line_types) \
+                    as check_line_types:
+                vm = run_program(lines)
+            self.assertEqual(frozenset(), vm.text.int_variables)
+            counts.append(check_line_types.call_count)
+        # Every line is checked once, and once more after the variable it reads is demoted
+        self.assertEqual([2 * size - 1 for size in sizes], counts)
+
+
+if __name__ == '__main__':
+    unittest.main()
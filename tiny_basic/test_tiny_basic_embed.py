@@ -0,0 +1,44 @@
+import unittest
+
+from .errors import TinyBasicException
+from .tiny_basic_embed import TinyBasicProgram
+
+PROGRAM = [
+    'END',
+    'ADD:',
+    '  r = a + b',
+    '  RETURN',
+    'GREET:',
+    '  calls = calls + 1',
+    '  g$ = "HELLO " + n$',
+    '  RETURN',
+    'FACT:',
+    '  f = 1',
+    '  FOR i = 2 TO n',
+    '    f = f * i',
+    '  NEXT',
+    '  RETURN',
+]
+
+
+class TinyBasicProgramTest(unittest.TestCase):
+    def setUp(self):
+        self.program = TinyBasicProgram(PROGRAM)
+
+    def test_call(self):
+        self.assertEqual([5], self.program.call('ADD', {'a': 2, 'b': 3}, ['r']))
+        self.assertEqual([120], self.program.call('fact', {'n': 5}, ['f']))
+        self.assertEqual([3628800], self.program.call('FACT', {'n': 10}, ['f']))
+
+    def test_repeated_calls_keep_globals(self):
+        self.program.call('ADD', {'calls': 0, 'a': 0, 'b': 0})
+        for name in ['ANN', 'BOB']:
+            self.assertEqual([f'HELLO {name}'], self.program.call('GREET', {'n$': name}, ['g$']))
+        self.assertEqual([2], self.program.call('ADD', outputs=['calls']))
+
+    def test_unknown_label(self):
+        self.assertRaises(TinyBasicException, lambda: self.program.call('MISSING'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import asyncio
+import unittest
+
+from .tiny_basic_load_test import load_test, read_until_ready
+from .tiny_basic_server import TinyBasicSession, start_tiny_basic_server
+
+
+class TinyBasicServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.server = await start_tiny_basic_server('127.0.0.1', 0, yield_steps=10)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def command(self, reader, writer, line: str) -> list[str]:
+        writer.write(f'{line}\n'.encode())
+        await writer.drain()
+        return await read_until_ready(reader)
+
+    async def test_session(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        await read_until_ready(reader)
+        await self.command(reader, writer, '10 INPUT "A="; a')
+        await self.command(reader, writer, '20 PRINT a * 2')
+        writer.write(b'RUN\n')
+        await writer.drain()
+        self.assertEqual(b'A=?', await asyncio.wait_for(reader.readexactly(3), 5))
+        self.assertEqual(['42', 'DONE.'], await self.command(reader, writer, '21'))
+        error = await self.command(reader, writer, 'RETURN')
+        self.assertTrue(error[0].startswith('BASIC ERROR: STACK IS EMPTY'))
+        writer.close()
+        await writer.wait_closed()
+
+    async def test_busy_session_does_not_starve_others(self):
+        reader, writer = await asyncio.open_connection('127.0.0.1', self.port)
+        await read_until_ready(reader)
+        await self.command(reader, writer, '10 GOTO 10')
+        writer.write(b'RUN\n')
+        await writer.drain()
+        result = await asyncio.wait_for(load_test('127.0.0.1', self.port, sessions=5, commands=['PRINT 1']), 10)
+        self.assertEqual(0, result['errors'])
+        self.assertEqual(5, result['commands'])
+        writer.close()
+        await writer.wait_closed()
+
+
+class TinyBasicSessionTest(unittest.IsolatedAsyncioTestCase):
+    async def test_disconnect_stops_running_program(self):
+        finished = asyncio.Event()
+
+        async def handle_client(reader, writer):
+            await TinyBasicSession(reader, writer, yield_steps=10).serve()
+            finished.set()
+
+        server = await asyncio.start_server(handle_client, '127.0.0.1', 0)
+        async with server:
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            await read_until_ready(reader)
+            writer.write(b'10 GOTO 10\nRUN\n')
+            await writer.drain()
+            writer.close()
+            await writer.wait_closed()
+            await asyncio.wait_for(finished.wait(), 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,64 +1,42 @@
-from .builtin_functions import fn_mid, fn_rnd
-from .errors import TinyBasicException, TinyBasicQuitException, TinyBasicRunStopException
-from .lexer import TinyBasicLexer, TinyBasicStatement, TinyBasicTokenType, TinyBasicBoolOperator, TinyBasicKeyword
+import math
+import operator
+from itertools import repeat
+
+from .builtin_functions import fn_mid, fn_rnd, fn_alen, fn_sum, fn_dot, fn_find, fn_haskey, fn_instr, fn_right, \
+    fn_join
+from .errors import TinyBasicException, TinyBasicQuitException, TinyBasicRunStopException, \
+    TinyBasicInputPendingException
+from .function_registry import FunctionRegistry
+from .lexer import TinyBasicLexer, TinyBasicToken, TinyBasicStatement, TinyBasicTokenType, TinyBasicBoolOperator, \
+    TinyBasicKeyword
 from .lexer.functions import TinyBasicFunction
-from .vm import AbstractVM, Variable
+from .vm import AbstractVM, Variable, MapVariable, Channel, UserFunction, FUNCTION_CACHE_SIZE, is_user_function_name
+from .vm.array_file import read_array, write_text_array, write_binary_array
+from .vm.program_file import is_program_file, read_program_file, write_program_file
+from .vm.program_loader import load_program
 
 
 class TinyBasicInterpreter(TinyBasicLexer):
-    def __init__(self, vm: AbstractVM, line: str):
-        super().__init__(line)
+    def __init__(self, vm: AbstractVM, line: str, tokens: list[tuple[TinyBasicToken, int]] or None = None):
+        super().__init__(line, tokens)
         self.line = line
         self.vm = vm
-        self.statements = {
-            TinyBasicStatement.DEBUG: self.stmt_debug,
-            TinyBasicStatement.TRACE: self.stmt_trace,
-            TinyBasicStatement.REM: self.stmt_rem,
-            TinyBasicStatement.LET: self.stmt_let,
-            TinyBasicStatement.DIM: self.stmt_dim,
-            TinyBasicStatement.GOTO: self.stmt_goto,
-            TinyBasicStatement.GOSUB: self.stmt_gosub,
-            TinyBasicStatement.RET: self.stmt_ret,
-            TinyBasicStatement.CLS: self.stmt_cls,
-            TinyBasicStatement.PRINT: self.stmt_print,
-            TinyBasicStatement.INPUT: self.stmt_input,
-            TinyBasicStatement.NEW: self.stmt_new,
-            TinyBasicStatement.LIST: self.stmt_list,
-            TinyBasicStatement.READ: self.stmt_read,
-            TinyBasicStatement.WRITE: self.stmt_write,
-            TinyBasicStatement.LOAD: self.stmt_load,
-            TinyBasicStatement.SAVE: self.stmt_save,
-            TinyBasicStatement.END: self.stmt_end,
-            TinyBasicStatement.QUIT: self.stmt_quit,
-            TinyBasicStatement.RUN: self.stmt_run,
-            TinyBasicStatement.RESET: self.stmt_reset,
-            TinyBasicStatement.CONT: self.stmt_cont,
-            TinyBasicStatement.IF: self.stmt_if,
-            TinyBasicStatement.ON: self.stmt_on,
-            TinyBasicStatement.FOR: self.stmt_for,
-            TinyBasicStatement.NEXT: self.stmt_next
-        }
-        self.functions = {
-            TinyBasicFunction.STR: (Variable.TYPE_STR, lambda x: str(x[0]), 1, 1, [Variable.TYPE_ANY]),
-            TinyBasicFunction.INT: (Variable.TYPE_INT, lambda x: int(x[0]), 1, 1, [Variable.TYPE_ANY]),
-            TinyBasicFunction.NUM: (Variable.TYPE_NUM, lambda x: float(x[0]), 1, 1, [Variable.TYPE_ANY]),
-            TinyBasicFunction.LEN: (Variable.TYPE_INT, lambda x: len(x[0]), 1, 1, [Variable.TYPE_STR]),
-            TinyBasicFunction.ALEN: (Variable.TYPE_INT, lambda x: x[0].dim, 1, 1, [None]),
-            TinyBasicFunction.MID: (Variable.TYPE_STR, fn_mid, 2, 3, [Variable.TYPE_STR, Variable.TYPE_INT, Variable.TYPE_INT]),
-            TinyBasicFunction.RND: (Variable.TYPE_INT, fn_rnd, 1, 2, [Variable.TYPE_INT, Variable.TYPE_INT])
-        }
+        self.statement_pos = 0
+        # Every type check of the line is proven by the type inference at RUN
+        self.proven = line in vm.text.proven_lines
 
     def interpret(self):
         self.statement()
         self.expect(TinyBasicTokenType.THE_END)
 
     def statement(self):
+        self.statement_pos = self.pos
         is_statement, statement = self.read_on_match(TinyBasicTokenType.STATEMENT)
         if is_statement:
             if statement not in self.statements:
                 raise TinyBasicException(f'Illegal statement')
             func = self.statements[statement]
-            func()
+            func(self)
         elif self.looks_like(TinyBasicTokenType.IDENTIFIER):
             name = self.expect(TinyBasicTokenType.IDENTIFIER)
             if self.looks_like(TinyBasicTokenType.COLON):
@@ -66,6 +44,8 @@ class TinyBasicInterpreter(TinyBasicLexer):
             else:
                 variable_name, index = self.variable(name)
                 self.assignment(variable_name, index)
+        elif self.match(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.ELSE):
+            self.stmt_else()
         else:
             self.fail_unexpected_token('STATEMENT')
         if self.match(TinyBasicTokenType.COLON):
@@ -90,9 +70,12 @@ class TinyBasicInterpreter(TinyBasicLexer):
 
     def stmt_run(self):
         self.vm.reset()
+        self.vm.check_types()
         self.vm.run()
 
     def stmt_cont(self):
+        # Direct commands can write any value into the variables of the stopped program
+        self.vm.text.clear_types()
         self.vm.run()
 
     def stmt_reset(self):
@@ -107,6 +90,12 @@ class TinyBasicInterpreter(TinyBasicLexer):
         raise TinyBasicQuitException()
 
     def stmt_end(self):
+        if self.match(TinyBasicTokenType.STATEMENT, TinyBasicStatement.IF):
+            self.block_line_end('END IF')
+            context = self.vm.context
+            context.get_block_target(context.ip, 'END IF WITHOUT IF')
+            return
+        self.vm.channels.close_all()
         raise TinyBasicRunStopException()
 
     def stmt_new(self):
@@ -132,37 +121,92 @@ class TinyBasicInterpreter(TinyBasicLexer):
 
     def stmt_load(self):
         file_name = self.str_expression()
-        with open(file_name) as f:
-            lines = f.readlines()
-        self.vm.text.set_text(lines)
-        self.vm.io.print_msg(f'PROGRAM LOADED: {file_name}, {len(lines)} LINES')
+        if is_program_file(file_name):
+            line_count = read_program_file(file_name, self.vm.text)
+        else:
+            line_count = load_program(file_name, self.vm.text)
+        self.vm.io.print_msg(f'PROGRAM LOADED: {file_name}, {line_count} LINES')
 
     def stmt_save(self):
         file_name = self.str_expression()
-        with open(file_name, 'wt') as f:
-            for line in self.vm.text.get_program_text():
-                f.write(line)
-                f.write('\n')
+        if self.match(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.AS):
+            self.expect(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.BINARY)
+            write_program_file(file_name, self.vm.text)
+        else:
+            with open(file_name, 'wt') as f:
+                for line in self.vm.text.get_program_text():
+                    f.write(line)
+                    f.write('\n')
         self.vm.io.print_msg(f'PROGRAM STORED INTO {file_name}')
 
+    def stmt_snapshot(self):
+        file_name = self.str_expression()
+        # A running program continues after the SNAPSHOT line
+        self.vm.snapshot(file_name, self.vm.context.ip_next)
+
+    def stmt_restore(self):
+        file_name = self.str_expression()
+        self.vm.restore(file_name)
+
     def stmt_read(self):
         variable_name = self.expect(TinyBasicTokenType.IDENTIFIER)
         self.expect(TinyBasicTokenType.COMMA)
         file_name = self.str_expression()
-        with open(file_name) as f:
-            lines = f.readlines()
-        lines = [line.rstrip() for line in lines]
-        self.vm.variables.write_str_array(variable_name, lines)
+        if self.is_str_variable_name(variable_name):
+            self.vm.variables.write_str_array(variable_name, read_array(file_name, False))
+        else:
+            self.vm.variables.write_num_array(variable_name, read_array(file_name, True))
 
     def stmt_write(self):
         variable_name = self.expect(TinyBasicTokenType.IDENTIFIER)
-        dim = self.vm.variables.get_dim(variable_name)
+        var = self.vm.variables.access_var(variable_name)
         self.expect(TinyBasicTokenType.COMMA)
         file_name = self.str_expression()
-        with open(file_name, 'w') as f:
-            for i in range(0, dim):
-                value = self.vm.variables.read_str_var(variable_name, i)
-                f.write(value)
+        if self.match(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.AS):
+            self.expect(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.BINARY)
+            if var.base_type != Variable.TYPE_NUM:
+                raise TinyBasicException(f'BINARY FORMAT NEEDS A NUMERIC ARRAY, NOT {var.name}')
+            write_binary_array(file_name, var.name, var.value)
+        else:
+            write_text_array(file_name, var.name, var.value)
+
+    def stmt_open(self):
+        file_name = self.str_expression()
+        self.expect(TinyBasicTokenType.STATEMENT, TinyBasicStatement.FOR)
+        if self.match(TinyBasicTokenType.STATEMENT, TinyBasicStatement.INPUT):
+            mode = Channel.MODE_INPUT
+        elif self.match(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.OUTPUT):
+            mode = Channel.MODE_OUTPUT
+        elif self.match(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.APPEND):
+            mode = Channel.MODE_APPEND
+        else:
+            self.fail_unexpected_token('FILE MODE')
+        self.expect(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.AS)
+        number = self.channel_number()
+        self.vm.channels.open(number, file_name, mode)
+
+    def stmt_close(self):
+        if self.looks_like(TinyBasicTokenType.THE_END) or self.looks_like(TinyBasicTokenType.COLON):
+            self.vm.channels.close_all()
+            return
+        while True:
+            self.vm.channels.close(self.channel_number())
+            if not self.match(TinyBasicTokenType.COMMA):
+                break
+
+    def stmt_line(self):
+        self.expect(TinyBasicTokenType.STATEMENT, TinyBasicStatement.INPUT)
+        self.expect(TinyBasicTokenType.HASH)
+        number = self.int_expression()
+        self.expect(TinyBasicTokenType.COMMA)
+        variable_name, index = self.variable()
+        if not self.is_str_variable_name(variable_name):
+            self.fail_unexpected_token('STRING VARIABLE')
+        self.vm.variables.write_str_var(variable_name, self.vm.channels.read_line(number), index)
+
+    def channel_number(self) -> int:
+        self.match(TinyBasicTokenType.HASH)
+        return self.int_expression()
 
     def stmt_goto(self):
         line_number = self.int_expression()
@@ -178,7 +222,8 @@ class TinyBasicInterpreter(TinyBasicLexer):
         if 0 == len(self.vm.context.stack):
             raise TinyBasicException('STACK IS EMPTY')
         line_number = self.vm.context.stack.pop()
-        if (not isinstance(line_number, int)) or (line_number < 0) or (len(self.vm.context.line_tab) <= line_number):
+        # Returning to the end of the program (IP = number of lines) ends the run, embedders use it as sentinel
+        if (not isinstance(line_number, int)) or (line_number < 0) or (len(self.vm.context.line_tab) < line_number):
             raise TinyBasicException('STACK TOP IS NOT A VALID IP')
         self.vm.context.ip_next = line_number
 
@@ -186,6 +231,10 @@ class TinyBasicInterpreter(TinyBasicLexer):
         self.vm.io.clear_screen()
 
     def stmt_print(self):
+        channel = None
+        if self.match(TinyBasicTokenType.HASH):
+            channel = self.int_expression()
+            self.expect(TinyBasicTokenType.COMMA)
         message = ""
         sep = True
         new_line = False
@@ -201,21 +250,29 @@ class TinyBasicInterpreter(TinyBasicLexer):
                 new_line = False
                 sep = not (self.looks_like(TinyBasicTokenType.COLON) or self.looks_like(TinyBasicTokenType.THE_END))
                 message += ' '
-        self.vm.io.print_msg(message, new_line)
+        if channel is None:
+            self.vm.io.print_msg(message, new_line)
+        else:
+            self.vm.channels.print_msg(channel, message, new_line)
 
     def stmt_input(self):
+        statement_pos = self.statement_pos
         message = self.str_expression()
         if self.match(TinyBasicTokenType.SEMICOLON):
             message += '?'
         else:
             self.expect(TinyBasicTokenType.COMMA)
         variable_name, index = self.variable()
-        if variable_name.endswith('$'):
-            result = self.vm.io.input_str(message)
-            self.vm.variables.write_str_var(variable_name, result, index)
-        else:
-            result = self.vm.io.input_int(message)
-            self.vm.variables.write_num_var(variable_name, result, index)
+        try:
+            if variable_name.endswith('$'):
+                result = self.vm.io.input_str(message)
+                self.vm.variables.write_str_var(variable_name, result, index)
+            else:
+                result = self.vm.io.input_int(message)
+                self.vm.variables.write_num_var(variable_name, result, index)
+        except TinyBasicInputPendingException as e:
+            e.resume_line = self.line[statement_pos:]
+            raise
 
     def stmt_let(self):
         variable_name, index = self.variable()
@@ -224,13 +281,172 @@ class TinyBasicInterpreter(TinyBasicLexer):
     def stmt_dim(self):
         while True:
             variable_name = self.expect(TinyBasicTokenType.IDENTIFIER)
-            self.expect(TinyBasicTokenType.PARENS_OPEN)
-            dim = self.expression()
-            self.expect(TinyBasicTokenType.PARENS_CLOSE)
-            self.vm.variables.dim(variable_name, dim)
+            if self.match(TinyBasicTokenType.CURLY_BRACKETS_OPEN):
+                self.expect(TinyBasicTokenType.CURLY_BRACKETS_CLOSE)
+                self.vm.variables.dim_map(variable_name)
+            else:
+                self.expect(TinyBasicTokenType.PARENS_OPEN)
+                dim = self.expression()
+                shape = None
+                if self.looks_like(TinyBasicTokenType.COMMA):
+                    # DIM g(h, w): the elements are stored flat, in row-major order
+                    shape = [self.expect_int(dim)]
+                    while self.match(TinyBasicTokenType.COMMA):
+                        shape.append(self.int_expression())
+                    shape = tuple(shape)
+                    dim = math.prod(shape)
+                self.expect(TinyBasicTokenType.PARENS_CLOSE)
+                self.vm.variables.dim(variable_name, dim, shape=shape)
             if not self.match(TinyBasicTokenType.COMMA):
                 break
 
+    def stmt_mat(self):
+        """
+        Whole array operations, computed over the element lists: MAT c = a + b, MAT c = a - b, MAT c = a,
+        MAT c = s * a, MAT a = ZER and MAT a = CON
+        """
+        target = self.expect(TinyBasicTokenType.IDENTIFIER)
+        self.expect(TinyBasicTokenType.EQ_OPERATOR)
+        if self.match(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.ZER):
+            result = [0] * self.vm.variables.get_dim(target)
+        elif self.match(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.CON):
+            result = [1] * self.vm.variables.get_dim(target)
+        else:
+            scalar = None
+            if self.looks_like(TinyBasicTokenType.IDENTIFIER):
+                name = self.expect(TinyBasicTokenType.IDENTIFIER)
+                if self.looks_like(TinyBasicTokenType.MUL_OP, '*') or self.looks_like(TinyBasicTokenType.PARENS_OPEN):
+                    variable_name, index = self.variable(name)
+                    scalar = self.vm.variables.read_num_var(variable_name, index)
+                    self.expect(TinyBasicTokenType.MUL_OP, '*')
+                    name = self.expect(TinyBasicTokenType.IDENTIFIER)
+            else:
+                scalar = self.factor()
+                if not (self.proven or isinstance(scalar, int) or isinstance(scalar, float)):
+                    self.fail_unexpected_token('NUMERIC EXPRESSION')
+                self.expect(TinyBasicTokenType.MUL_OP, '*')
+                name = self.expect(TinyBasicTokenType.IDENTIFIER)
+            values = self.vm.variables.access_var(name).read_num_array()
+            if scalar is not None:
+                result = list(map(operator.mul, repeat(scalar, len(values)), values))
+            elif self.looks_like(TinyBasicTokenType.ADD_OP):
+                operation = operator.add if self.next().value == '+' else operator.sub
+                right_name = self.expect(TinyBasicTokenType.IDENTIFIER)
+                right = self.vm.variables.access_var(right_name).read_num_array()
+                if len(values) != len(right):
+                    raise TinyBasicException(f'DIMENSIONS OF {name.upper()} AND {right_name.upper()} DO NOT MATCH')
+                result = list(map(operation, values, right))
+            else:
+                result = list(values)
+        self.vm.variables.write_num_array(target, result)
+
+    def stmt_sort(self):
+        variable_name = self.expect(TinyBasicTokenType.IDENTIFIER)
+        descending = self.match(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.DESC)
+        base_type = Variable.TYPE_STR if self.is_str_variable_name(variable_name) else Variable.TYPE_NUM
+        var = self.vm.variables.write_var(variable_name, base_type, True)
+        var.read_array().sort(reverse=descending)
+
+    def stmt_fill(self):
+        variable_name = self.expect(TinyBasicTokenType.IDENTIFIER)
+        dim = self.vm.variables.get_dim(variable_name)
+        self.expect(TinyBasicTokenType.COMMA)
+        if self.is_str_variable_name(variable_name):
+            self.vm.variables.write_str_array(variable_name, [self.str_expression()] * dim)
+        else:
+            self.vm.variables.write_num_array(variable_name, [self.num_expression()] * dim)
+
+    def stmt_copy(self):
+        source = self.vm.variables.access_var(self.expect(TinyBasicTokenType.IDENTIFIER))
+        self.expect(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.TO)
+        variable_name = self.expect(TinyBasicTokenType.IDENTIFIER)
+        if self.is_str_variable_name(variable_name):
+            self.vm.variables.write_str_array(variable_name, list(source.read_array(Variable.TYPE_STR)))
+        else:
+            self.vm.variables.write_num_array(variable_name, list(source.read_array(Variable.TYPE_NUM)))
+
+    def stmt_delete(self):
+        variable_name = self.expect(TinyBasicTokenType.IDENTIFIER)
+        self.expect(TinyBasicTokenType.COMMA)
+        self.vm.variables.delete_key(variable_name, self.key_expression())
+
+    def stmt_keys(self):
+        var = self.vm.variables.access_var(self.expect(TinyBasicTokenType.IDENTIFIER))
+        if not isinstance(var, MapVariable):
+            raise TinyBasicException(f'{var.name} IS NOT A MAP')
+        self.expect(TinyBasicTokenType.COMMA)
+        variable_name = self.expect(TinyBasicTokenType.IDENTIFIER)
+        if not self.is_str_variable_name(variable_name):
+            self.fail_unexpected_token('STRING VARIABLE')
+        self.vm.variables.write_str_array(variable_name, list(map(str, var.value)))
+
+    def stmt_split(self):
+        """
+        SPLIT a$, s$, sep$ stores the parts of a$ in the string array s$, without a separator a$ is split at white space
+        """
+        value = self.str_expression()
+        self.expect(TinyBasicTokenType.COMMA)
+        variable_name = self.expect(TinyBasicTokenType.IDENTIFIER)
+        if not self.is_str_variable_name(variable_name):
+            self.fail_unexpected_token('STRING VARIABLE')
+        separator = None
+        if self.match(TinyBasicTokenType.COMMA):
+            separator = self.str_expression()
+            if len(separator) == 0:
+                raise TinyBasicException('EMPTY SEPARATOR')
+        self.vm.variables.write_str_array(variable_name, value.split(separator))
+
+    def stmt_randomize(self):
+        """
+        RANDOMIZE seed makes the numbers of RND repeatable, without a seed the generator is seeded by the system
+        """
+        if self.looks_like(TinyBasicTokenType.THE_END) or self.looks_like(TinyBasicTokenType.COLON):
+            self.vm.random.seed()
+        else:
+            self.vm.random.seed(self.expression())
+
+    def stmt_def(self):
+        """
+        DEF FNname(parameters) = expression, with CACHED [size] at the end the results are memoized
+        """
+        name = self.expect(TinyBasicTokenType.IDENTIFIER).upper()
+        if not is_user_function_name(name):
+            self.fail_unexpected_token('FUNCTION NAME')
+        self.expect(TinyBasicTokenType.PARENS_OPEN)
+        parameters = []
+        while not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+            parameter = self.expect(TinyBasicTokenType.IDENTIFIER).upper()
+            if parameter in parameters:
+                raise TinyBasicException(f'DUPLICATE PARAMETER {parameter} OF {name}')
+            parameters.append(parameter)
+            if not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+                self.expect(TinyBasicTokenType.COMMA)
+        self.expect(TinyBasicTokenType.PARENS_CLOSE)
+        self.expect(TinyBasicTokenType.EQ_OPERATOR)
+        # The body is kept as source, like the stored program lines, and compiled on the first call
+        body = []
+        while not (self.looks_like(TinyBasicTokenType.COLON) or self.looks_like(TinyBasicTokenType.THE_END) or
+                   self.looks_like(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.CACHED)):
+            body.append(self.next().to_src())
+        if not body:
+            self.fail_unexpected_token('EXPRESSION')
+        cache_size = 0
+        if self.match(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.CACHED):
+            cache_size = FUNCTION_CACHE_SIZE
+            if self.looks_like(TinyBasicTokenType.LITERAL):
+                cache_size = self.expect_int(self.next().value)
+                if cache_size <= 0:
+                    raise TinyBasicException(f'CACHE SIZE MUST BE POSITIVE, NOT {cache_size}')
+        self.vm.user_functions[name] = UserFunction(name, parameters, ' '.join(body), cache_size)
+
+    def function_body(self):
+        """
+        Evaluate the body of a user function, it is the whole line
+        """
+        result = self.expression()
+        self.expect(TinyBasicTokenType.THE_END)
+        return result
+
     def assignment(self, variable_name: str, index: int = 0):
         self.expect(TinyBasicTokenType.EQ_OPERATOR)
         if self.is_str_variable_name(variable_name):
@@ -258,9 +474,13 @@ class TinyBasicInterpreter(TinyBasicLexer):
     def do_loop(self, variable_name, index, init, max_value, step):
         value = init
         while value <= max_value:
+            self.vm.context.count_step()
             self.vm.variables.write_num_var(variable_name, value, index)
             sub_interpreter = TinyBasicInterpreter(self.vm, self.line[self.pos:])
-            sub_interpreter.interpret()
+            try:
+                sub_interpreter.interpret()
+            except TinyBasicInputPendingException:
+                raise TinyBasicException('INPUT CAN NOT WAIT INSIDE A SINGLE LINE FOR LOOP')
             value += step
 
     def stmt_next(self):
@@ -290,32 +510,101 @@ class TinyBasicInterpreter(TinyBasicLexer):
             self.vm.context.ip_next = loop_start
             self.vm.context.stack.append(loop)
 
+    def stmt_while(self):
+        """
+        WHILE cond ... WEND repeats the lines between while the condition holds. The loop statements are lines of
+        their own, they jump to the targets matched once per program, no frame is pushed on the stack.
+        """
+        context = self.vm.context
+        target = context.get_block_target(context.ip, 'WHILE WITHOUT WEND')
+        condition = self.bool_expression()
+        self.block_line_end('WHILE')
+        if not condition:
+            context.ip_next = target
+
+    def stmt_wend(self):
+        self.block_line_end('WEND')
+        context = self.vm.context
+        context.ip_next = context.get_block_target(context.ip, 'WEND WITHOUT WHILE')
+
+    def block_line_end(self, statement: str):
+        """
+        The statements after a block statement would run before its jump, they are rejected
+        """
+        if not self.looks_like(TinyBasicTokenType.THE_END):
+            raise TinyBasicException(f'{statement} MUST END ITS LINE')
+
+    def stmt_repeat(self):
+        """
+        REPEAT ... UNTIL cond repeats the lines between until the condition holds, at least once
+        """
+        self.block_line_end('REPEAT')
+        context = self.vm.context
+        context.get_block_target(context.ip, 'REPEAT WITHOUT UNTIL')
+
+    def stmt_until(self):
+        context = self.vm.context
+        target = context.get_block_target(context.ip, 'UNTIL WITHOUT REPEAT')
+        condition = self.bool_expression()
+        self.block_line_end('UNTIL')
+        if not condition:
+            context.ip_next = target
+
     def stmt_if(self):
+        """
+        IF cond THEN at the end of a line starts a block, closed by END IF on a line of its own and optionally
+        split by ELSE on a line of its own. The branches jump to the targets matched once per program.
+        """
         if self.bool_expression():
             if self.match(TinyBasicTokenType.STATEMENT, TinyBasicStatement.GOTO) or \
                     self.looks_like(TinyBasicTokenType.LITERAL):
                 self.stmt_goto()
             else:
                 self.expect(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.THEN)
-                self.statement()
+                if self.looks_like(TinyBasicTokenType.THE_END):
+                    context = self.vm.context
+                    context.get_block_target(context.ip, 'IF WITHOUT END IF')
+                else:
+                    self.statement()
         else:
+            last = None
             while not self.looks_like(TinyBasicTokenType.THE_END):
-                self.next()
+                last = self.next()
+            if last is not None and last.type == TinyBasicTokenType.KEYWORD and last.value == TinyBasicKeyword.THEN:
+                context = self.vm.context
+                context.ip_next = context.get_block_target(context.ip, 'IF WITHOUT END IF')
+
+    def stmt_else(self):
+        self.block_line_end('ELSE')
+        context = self.vm.context
+        context.ip_next = context.get_block_target(context.ip, 'ELSE WITHOUT IF')
 
     def stmt_on(self):
-        condition = self.expression()
-        self.expect(TinyBasicTokenType.GOTO)
-        if self.expr_to_bool(condition):
-            line_number = self.int_expression()
+        """
+        ON x GOTO l1, l2, ... jumps to the x-th line, ON x GOSUB l1, l2, ... calls it.
+        Only the selected target is evaluated, out of range selectors continue with the next statement.
+        """
+        selector = self.int_expression()
+        is_gosub = self.match(TinyBasicTokenType.STATEMENT, TinyBasicStatement.GOSUB)
+        if not is_gosub:
+            self.expect(TinyBasicTokenType.STATEMENT, TinyBasicStatement.GOTO)
+        line_number = None
+        count = 0
+        while True:
+            count += 1
+            if count == selector:
+                line_number = self.int_expression()
+            else:
+                self.skip_argument()
+            if not self.match(TinyBasicTokenType.COMMA):
+                break
+        if line_number is not None:
+            if is_gosub:
+                self.vm.context.stack.append(self.vm.context.ip_next)
             self.jump_to(line_number)
-        pass
 
     def jump_to(self, line_number: int):
-        ip = self.vm.context.line_tab.index(line_number)
-        if 0 <= ip:
-            self.vm.context.ip_next = ip
-        else:
-            raise TinyBasicException(f'Line number not found: {line_number}')
+        self.vm.context.ip_next = self.vm.context.get_ip(line_number)
 
     def variable(self, variable_name: str or None = None) -> tuple[str, int]:
         if variable_name is None:
@@ -335,15 +624,29 @@ class TinyBasicInterpreter(TinyBasicLexer):
     def is_int_variable_name(self, variable_name: str) -> bool:
         return not self.is_str_variable_name(variable_name)
 
-    def indexer(self) -> int:
+    def indexer(self) -> int or str:
         if not self.match(TinyBasicTokenType.PARENS_OPEN):
             return 0
-        index = self.int_expression()
+        index = self.key_expression()
+        if self.looks_like(TinyBasicTokenType.COMMA):
+            index = [index]
+            while self.match(TinyBasicTokenType.COMMA):
+                index.append(self.int_expression())
+            index = tuple(index)
         self.expect(TinyBasicTokenType.PARENS_CLOSE)
         return index
 
+    def key_expression(self) -> int or str:
+        """
+        Array index or map key
+        """
+        result = self.expression()
+        if not (self.proven or isinstance(result, int) or isinstance(result, str)):
+            self.fail_unexpected_token('INTEGER EXPRESSION')
+        return result
+
     def expect_int(self, value) -> int:
-        if not isinstance(value, int):
+        if not (self.proven or isinstance(value, int)):
             self.fail_unexpected_token('INTEGER EXPRESSION')
         return value
 
@@ -355,13 +658,13 @@ class TinyBasicInterpreter(TinyBasicLexer):
 
     def num_expression(self) -> int or float:
         result = self.expression()
-        if not (isinstance(result, int) or isinstance(result, float)):
+        if not (self.proven or isinstance(result, int) or isinstance(result, float)):
             self.fail_unexpected_token('NUMERIC EXPRESSION')
         return result
 
     def str_expression(self) -> str:
         result = self.expression()
-        if not isinstance(result, str):
+        if not (self.proven or isinstance(result, str)):
             self.fail_unexpected_token('STRING EXPRESSION')
         return result
 
@@ -423,32 +726,30 @@ class TinyBasicInterpreter(TinyBasicLexer):
 
     def arithmetic_expression(self):
         left = self.term()
-        while self.looks_like(TinyBasicTokenType.ADD_OP):
-            if self.match(TinyBasicTokenType.ADD_OP, '+'):
-                right = self.term()
+        while self.look.type == TinyBasicTokenType.ADD_OP:
+            operation = self.next().value
+            right = self.term()
+            if operation == '+':
                 left += right
-            if self.match(TinyBasicTokenType.ADD_OP, '-'):
-                right = self.term()
+            elif operation == '-':
                 left -= right
         return left
 
     def term(self):
         left = self.factor()
-        while self.looks_like(TinyBasicTokenType.MUL_OP):
-            if self.match(TinyBasicTokenType.MUL_OP, '*'):
-                right = self.factor()
+        while self.look.type == TinyBasicTokenType.MUL_OP:
+            operation = self.next().value
+            right = self.factor()
+            if operation == '*':
                 left *= right
-            if self.match(TinyBasicTokenType.MUL_OP, '/'):
-                right = self.factor()
+            elif operation == '/':
                 if isinstance(left, int) and isinstance(right, int):
                     left //= right
                 else:
                     left /= right
-            if self.match(TinyBasicTokenType.MUL_OP, 'DIV'):
-                right = self.factor()
+            elif operation == 'DIV':
                 left //= right
-            if self.match(TinyBasicTokenType.MUL_OP, 'MOD'):
-                right = self.factor()
+            elif operation == 'MOD':
                 left %= right
         return left
 
@@ -465,8 +766,17 @@ class TinyBasicInterpreter(TinyBasicLexer):
         elif self.looks_like(TinyBasicTokenType.LITERAL) or self.looks_like(TinyBasicTokenType.STRING_LITERAL):
             result = self.next().value
         elif self.looks_like(TinyBasicTokenType.IDENTIFIER):
-            variable_name, index = self.variable()
-            result = self.vm.variables.read_var(variable_name, index)
+            variable_name = self.expect(TinyBasicTokenType.IDENTIFIER)
+            if is_user_function_name(variable_name) and variable_name.upper() in self.vm.user_functions and \
+                    self.looks_like(TinyBasicTokenType.PARENS_OPEN):
+                result = self.user_function(variable_name)
+            elif variable_name in self.vm.functions and self.looks_like(TinyBasicTokenType.PARENS_OPEN):
+                result = self.native_function(variable_name)
+            else:
+                variable_name, index = self.variable(variable_name)
+                result = self.vm.variables.read_var(variable_name, index)
+        elif self.looks_like(TinyBasicTokenType.FUNCTION, TinyBasicFunction.IIF):
+            result = self.iif()
         elif self.looks_like(TinyBasicTokenType.FUNCTION):
             result = self.function()
         else:
@@ -475,36 +785,172 @@ class TinyBasicInterpreter(TinyBasicLexer):
             result = -result
         return result
 
+    def user_function(self, function_name: str):
+        self.expect(TinyBasicTokenType.PARENS_OPEN)
+        args = []
+        while not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+            args.append(self.expression())
+            if not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+                self.expect(TinyBasicTokenType.COMMA)
+        self.expect(TinyBasicTokenType.PARENS_CLOSE)
+        return self.vm.call_function(function_name, args)
+
+    def iif(self):
+        """
+        IIF(condition, a, b) evaluates a when the condition is true and b otherwise, the other one is skipped
+        """
+        self.expect(TinyBasicTokenType.FUNCTION, TinyBasicFunction.IIF)
+        self.expect(TinyBasicTokenType.PARENS_OPEN)
+        condition = self.bool_expression()
+        self.expect(TinyBasicTokenType.COMMA)
+        if condition:
+            result = self.expression()
+            self.expect(TinyBasicTokenType.COMMA)
+            self.skip_argument()
+        else:
+            self.skip_argument()
+            self.expect(TinyBasicTokenType.COMMA)
+            result = self.expression()
+        self.expect(TinyBasicTokenType.PARENS_CLOSE)
+        return result
+
+    def skip_argument(self):
+        """
+        Skip an expression without evaluating it, up to the next comma, closing parenthesis or statement end
+        """
+        depth = 0
+        while depth or not (self.looks_like(TinyBasicTokenType.COMMA) or
+                            self.looks_like(TinyBasicTokenType.PARENS_CLOSE) or
+                            self.looks_like(TinyBasicTokenType.COLON)):
+            if self.looks_like(TinyBasicTokenType.THE_END):
+                break
+            if self.looks_like(TinyBasicTokenType.PARENS_OPEN):
+                depth += 1
+            elif self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+                depth -= 1
+            self.next()
+
     def function(self):
         function_name = self.expect(TinyBasicTokenType.FUNCTION)
-        if function_name not in self.functions:
+        function = self.builtin_functions.get(function_name.value)
+        if function is None:
             raise TinyBasicException(f'UNKNOWN FUNCTION: {function_name}')
-        function_def = self.functions[function_name]
-        ret, fn, min_args, max_args, arg_types = function_def
+        parsers = function.parsers
+        if parsers is None:
+            parsers = function.parsers = [self.argument_parsers[arg_type] for arg_type in function.arg_types]
         self.expect(TinyBasicTokenType.PARENS_OPEN)
         args = []
         while not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
-            index = len(args)
-            if arg_types[index] == Variable.TYPE_STR:
-                args.append(self.str_expression())
-            elif arg_types[index] == Variable.TYPE_INT:
-                args.append(self.int_expression())
-            elif arg_types[index] == Variable.TYPE_NUM:
-                args.append(self.num_expression())
-            elif arg_types[index] == Variable.TYPE_ANY:
-                args.append(self.expression())
-            elif arg_types[index] is None:
-                variable_name = self.expect(TinyBasicTokenType.IDENTIFIER)
-                var = self.vm.variables.access_var(variable_name)
-                args.append(var)
-            else:
-                raise TinyBasicException(f'UNKNOWN ARGUMENT')
+            if len(parsers) <= len(args):
+                raise TinyBasicException(f'TOO MUCH ARGUMENTS FOR {function_name}')
+            args.append(parsers[len(args)](self))
             if not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
                 self.expect(TinyBasicTokenType.COMMA)
-        if max_args is not None and max_args < len(args):
+        if function.max_args is not None and function.max_args < len(args):
             raise TinyBasicException(f'TOO MUCH ARGUMENTS FOR {function_name}')
-        if len(args) < min_args:
+        if len(args) < function.min_args:
             raise TinyBasicException(f'TOO FEW ARGUMENTS FOR {function_name}')
-        result = fn(args)
+        result = function.fn(self.vm, args) if function.with_vm else function.fn(args)
         self.expect(TinyBasicTokenType.PARENS_CLOSE)
         return result
+
+    def native_function(self, function_name: str):
+        """
+        Call of a function registered by the host, its arguments are checked by the compiled signature
+        """
+        self.expect(TinyBasicTokenType.PARENS_OPEN)
+        args = []
+        while not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+            args.append(self.expression())
+            if not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+                self.expect(TinyBasicTokenType.COMMA)
+        self.expect(TinyBasicTokenType.PARENS_CLOSE)
+        return self.vm.functions.call(function_name, args)
+
+    def channel_argument(self) -> Channel:
+        return self.vm.channels.access_channel(self.int_expression())
+
+    def variable_argument(self) -> Variable:
+        return self.vm.variables.access_var(self.expect(TinyBasicTokenType.IDENTIFIER))
+
+    argument_parsers = {
+        Variable.TYPE_STR: str_expression,
+        Variable.TYPE_INT: int_expression,
+        Variable.TYPE_NUM: num_expression,
+        Variable.TYPE_ANY: expression,
+        Channel: channel_argument,
+        None: variable_argument
+    }
+
+    statements = {
+        TinyBasicStatement.DEBUG: stmt_debug,
+        TinyBasicStatement.TRACE: stmt_trace,
+        TinyBasicStatement.REM: stmt_rem,
+        TinyBasicStatement.LET: stmt_let,
+        TinyBasicStatement.DIM: stmt_dim,
+        TinyBasicStatement.GOTO: stmt_goto,
+        TinyBasicStatement.GOSUB: stmt_gosub,
+        TinyBasicStatement.RET: stmt_ret,
+        TinyBasicStatement.CLS: stmt_cls,
+        TinyBasicStatement.PRINT: stmt_print,
+        TinyBasicStatement.INPUT: stmt_input,
+        TinyBasicStatement.NEW: stmt_new,
+        TinyBasicStatement.LIST: stmt_list,
+        TinyBasicStatement.READ: stmt_read,
+        TinyBasicStatement.WRITE: stmt_write,
+        TinyBasicStatement.LOAD: stmt_load,
+        TinyBasicStatement.SAVE: stmt_save,
+        TinyBasicStatement.END: stmt_end,
+        TinyBasicStatement.QUIT: stmt_quit,
+        TinyBasicStatement.RUN: stmt_run,
+        TinyBasicStatement.RESET: stmt_reset,
+        TinyBasicStatement.CONT: stmt_cont,
+        TinyBasicStatement.IF: stmt_if,
+        TinyBasicStatement.ON: stmt_on,
+        TinyBasicStatement.FOR: stmt_for,
+        TinyBasicStatement.NEXT: stmt_next,
+        TinyBasicStatement.WHILE: stmt_while,
+        TinyBasicStatement.WEND: stmt_wend,
+        TinyBasicStatement.REPEAT: stmt_repeat,
+        TinyBasicStatement.UNTIL: stmt_until,
+        TinyBasicStatement.OPEN: stmt_open,
+        TinyBasicStatement.CLOSE: stmt_close,
+        TinyBasicStatement.LINE: stmt_line,
+        TinyBasicStatement.SNAPSHOT: stmt_snapshot,
+        TinyBasicStatement.RESTORE: stmt_restore,
+        TinyBasicStatement.MAT: stmt_mat,
+        TinyBasicStatement.SORT: stmt_sort,
+        TinyBasicStatement.FILL: stmt_fill,
+        TinyBasicStatement.COPY: stmt_copy,
+        TinyBasicStatement.DELETE: stmt_delete,
+        TinyBasicStatement.KEYS: stmt_keys,
+        TinyBasicStatement.SPLIT: stmt_split,
+        TinyBasicStatement.DEF: stmt_def,
+        TinyBasicStatement.RANDOMIZE: stmt_randomize
+    }
+
+    # Builtin functions by their tokens, the registry of every VM is layered over it
+    builtin_functions = FunctionRegistry({
+        TinyBasicFunction.STR: (Variable.TYPE_STR, lambda x: str(x[0]), 1, 1, [Variable.TYPE_ANY]),
+        TinyBasicFunction.INT: (Variable.TYPE_INT, lambda x: int(x[0]), 1, 1, [Variable.TYPE_ANY]),
+        TinyBasicFunction.NUM: (Variable.TYPE_NUM, lambda x: float(x[0]), 1, 1, [Variable.TYPE_ANY]),
+        TinyBasicFunction.LEN: (Variable.TYPE_INT, lambda x: len(x[0]), 1, 1, [Variable.TYPE_STR]),
+        TinyBasicFunction.ALEN: (Variable.TYPE_INT, fn_alen, 1, 2, [None, Variable.TYPE_INT]),
+        TinyBasicFunction.MID: (Variable.TYPE_STR, fn_mid, 2, 3, [Variable.TYPE_STR, Variable.TYPE_INT, Variable.TYPE_INT]),
+        TinyBasicFunction.RND: (Variable.TYPE_INT, fn_rnd, 1, 2, [Variable.TYPE_INT, Variable.TYPE_INT], True),
+        TinyBasicFunction.EOF: (Variable.TYPE_INT, lambda x: int(x[0].eof()), 1, 1, [Channel]),
+        TinyBasicFunction.SUM: (Variable.TYPE_NUM, fn_sum, 1, 1, [None]),
+        TinyBasicFunction.DOT: (Variable.TYPE_NUM, fn_dot, 2, 2, [None, None]),
+        TinyBasicFunction.FIND: (Variable.TYPE_INT, fn_find, 2, 2, [None, Variable.TYPE_ANY]),
+        TinyBasicFunction.INSTR: (Variable.TYPE_INT, fn_instr, 2, 3,
+                                  [Variable.TYPE_STR, Variable.TYPE_STR, Variable.TYPE_INT]),
+        TinyBasicFunction.LEFT: (Variable.TYPE_STR, lambda x: x[0][:max(x[1], 0)], 2, 2,
+                                 [Variable.TYPE_STR, Variable.TYPE_INT]),
+        TinyBasicFunction.RIGHT: (Variable.TYPE_STR, fn_right, 2, 2, [Variable.TYPE_STR, Variable.TYPE_INT]),
+        TinyBasicFunction.UCASE: (Variable.TYPE_STR, lambda x: x[0].upper(), 1, 1, [Variable.TYPE_STR]),
+        TinyBasicFunction.LCASE: (Variable.TYPE_STR, lambda x: x[0].lower(), 1, 1, [Variable.TYPE_STR]),
+        TinyBasicFunction.REPLACE: (Variable.TYPE_STR, lambda x: x[0].replace(x[1], x[2]), 3, 3,
+                                    [Variable.TYPE_STR, Variable.TYPE_STR, Variable.TYPE_STR]),
+        TinyBasicFunction.JOIN: (Variable.TYPE_STR, fn_join, 1, 2, [None, Variable.TYPE_STR]),
+        TinyBasicFunction.HASKEY: (Variable.TYPE_INT, fn_haskey, 2, 2, [None, Variable.TYPE_ANY])
+    })
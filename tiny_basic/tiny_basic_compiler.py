@@ -0,0 +1,714 @@
+import operator
+
+from .errors import TinyBasicException, TinyBasicRunStopException
+from .lexer import TinyBasicLexer, TinyBasicToken, TinyBasicStatement, TinyBasicTokenType, TinyBasicBoolOperator, \
+    TinyBasicKeyword
+from .lexer.functions import TinyBasicFunction
+from .lexer.syntax_error import TinyBasicSyntaxError
+from .tiny_basic import TinyBasicInterpreter
+from .vm import AbstractVM, Variable, VariableStorage, Channel, is_user_function_name
+
+
+class _NotCompilable(Exception):
+    """
+    The line uses a construct without compiled form, it stays interpreted
+    """
+
+
+class _SourcePosition:
+    def __init__(self, line: int, pos: int):
+        self.line = line
+        self.pos = pos
+
+
+def _divide(left, right):
+    if isinstance(left, int) and isinstance(right, int):
+        return left // right
+    return left / right
+
+
+def _sequence(first, second):
+    def run():
+        first()
+        second()
+    return run
+
+
+# Closure factories of the binary operators, for two operand closures and for a constant right operand
+_OPERATIONS = {
+    '+': (lambda x, y: lambda: x() + y(), lambda x, c: lambda: x() + c),
+    '-': (lambda x, y: lambda: x() - y(), lambda x, c: lambda: x() - c),
+    '*': (lambda x, y: lambda: x() * y(), lambda x, c: lambda: x() * c),
+    '/': (lambda x, y: lambda: _divide(x(), y()), lambda x, c: lambda: _divide(x(), c)),
+    'DIV': (lambda x, y: lambda: x() // y(), lambda x, c: lambda: x() // c),
+    'MOD': (lambda x, y: lambda: x() % y(), lambda x, c: lambda: x() % c),
+    '=': (lambda x, y: lambda: x() == y(), lambda x, c: lambda: x() == c),
+    '<>': (lambda x, y: lambda: x() != y(), lambda x, c: lambda: x() != c),
+    '<': (lambda x, y: lambda: x() < y(), lambda x, c: lambda: x() < c),
+    '<=': (lambda x, y: lambda: x() <= y(), lambda x, c: lambda: x() <= c),
+    '>': (lambda x, y: lambda: x() > y(), lambda x, c: lambda: x() > c),
+    '>=': (lambda x, y: lambda: x() >= y(), lambda x, c: lambda: x() >= c)
+}
+_ADD_OPS = ['+', '-']
+_MUL_OPS = ['*', '/', 'DIV', 'MOD']
+_COMPARISON_OPS = ['<>', '<', '<=', '>', '>=']
+
+
+class TinyBasicCompiler(TinyBasicLexer):
+    """
+    Compiles a program line into a Python closure with the semantics of TinyBasicInterpreter.
+    The line is parsed once, the closure evaluates its expressions, variable accesses and jumps directly.
+    Type checks raise the same syntax errors, at the same positions, as the interpreter.
+    Expressions of integers, known from literals and the inferred integer variables, use integer operations
+    without float promotion, other expressions keep the general operations.
+    Lines with statements that have no compiled form are left to the interpreter.
+    """
+    def __init__(self, vm: AbstractVM, line: str, tokens: list[tuple[TinyBasicToken, int]] or None = None):
+        super().__init__(line, tokens)
+        self.vm = vm
+        self.runtime_checks = vm.text.get_runtime_checks(line)
+        self.int_variables = vm.text.int_variables
+        # Static types and literal values of the compiled expressions, by closure
+        self.value_types = {}
+        self.constants = {}
+
+    def compile(self):
+        """
+        :return: closure executing the line, None when the line must be interpreted
+        """
+        try:
+            code = self.statement()
+            if not self.looks_like(TinyBasicTokenType.THE_END):
+                raise _NotCompilable()
+        except (_NotCompilable, TinyBasicException):
+            return None
+        return code
+
+    def compile_expression(self):
+        """
+        :return: closure evaluating the line as an expression, the body of a user function, None when it must be
+            interpreted
+        """
+        try:
+            code = self.expression()
+            if not self.looks_like(TinyBasicTokenType.THE_END):
+                raise _NotCompilable()
+        except (_NotCompilable, TinyBasicException):
+            return None
+        return code
+
+    def fail_on_run(self, expected_token: str):
+        """
+        :return: function raising the syntax error the interpreter reports at the current position
+        """
+        src = _SourcePosition(self.tokenizer.src.line, self.tokenizer.src.pos)
+        message = f'{expected_token} expected, but {self.look.type} found'
+
+        def fail():
+            raise TinyBasicSyntaxError(src, message)
+        return fail
+
+    def statement(self):
+        is_statement, statement = self.read_on_match(TinyBasicTokenType.STATEMENT)
+        if is_statement:
+            if statement not in self.statements:
+                raise _NotCompilable()
+            code = self.statements[statement](self)
+        elif self.looks_like(TinyBasicTokenType.IDENTIFIER):
+            name = self.expect(TinyBasicTokenType.IDENTIFIER)
+            if self.looks_like(TinyBasicTokenType.COLON):
+                code = self.label(name)
+            else:
+                code = self.assignment(*self.variable(name))
+        elif self.match(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.ELSE):
+            code = self.block_exit('ELSE WITHOUT IF')
+        else:
+            raise _NotCompilable()
+        if self.match(TinyBasicTokenType.COLON):
+            code = _sequence(code, self.statement())
+        return code
+
+    def label(self, label_name: str):
+        self.match(TinyBasicTokenType.COLON)
+        if not self.has_line_number:
+            return lambda: None
+        vm = self.vm
+        line_number = self.line_number
+        return lambda: vm.variables.write_num_var(label_name, line_number)
+
+    def stmt_rem(self):
+        comment = self.expect(TinyBasicTokenType.COMMENT)
+        vm = self.vm
+
+        def run():
+            if vm.context.trace:
+                vm.io.print_msg(f'COMMENT: "{comment}"')
+        return run
+
+    def stmt_end(self):
+        if self.match(TinyBasicTokenType.STATEMENT, TinyBasicStatement.IF):
+            return self.block_check('END IF WITHOUT IF')
+        vm = self.vm
+
+        def run():
+            vm.channels.close_all()
+            raise TinyBasicRunStopException()
+        return run
+
+    def stmt_let(self):
+        return self.assignment(*self.variable())
+
+    def assignment(self, variable_name: str, index):
+        self.expect(TinyBasicTokenType.EQ_OPERATOR)
+        vm = self.vm
+        if variable_name.endswith('$'):
+            value = self.str_expression()
+            write = VariableStorage.write_str_var
+        else:
+            value = self.num_expression()
+            write = VariableStorage.write_num_var
+        if index is None:
+            return lambda: write(vm.variables, variable_name, value())
+
+        def run():
+            # The index is evaluated before the value, like in the interpreter
+            i = index()
+            write(vm.variables, variable_name, value(), i)
+        return run
+
+    def jump(self, target):
+        """
+        :param target: closure evaluating the line number
+        :return: closure returning the IP of the line, cached for the current line table
+        """
+        vm = self.vm
+        cache = {}
+        cached_table = [None]
+
+        def resolve() -> int:
+            context = vm.context
+            line_number = target()
+            if cached_table[0] is not context.line_tab:
+                cache.clear()
+                cached_table[0] = context.line_tab
+            ip = cache.get(line_number)
+            if ip is None:
+                ip = context.get_ip(line_number)
+                cache[line_number] = ip
+            return ip
+        return resolve
+
+    def stmt_goto(self):
+        resolve = self.jump(self.int_expression())
+        vm = self.vm
+
+        def run():
+            vm.context.ip_next = resolve()
+        return run
+
+    def stmt_gosub(self):
+        resolve = self.jump(self.int_expression())
+        vm = self.vm
+
+        def run():
+            context = vm.context
+            context.stack.append(context.ip_next)
+            context.ip_next = resolve()
+        return run
+
+    def stmt_on(self):
+        selector = self.int_expression()
+        is_gosub = self.match(TinyBasicTokenType.STATEMENT, TinyBasicStatement.GOSUB)
+        if not is_gosub:
+            self.expect(TinyBasicTokenType.STATEMENT, TinyBasicStatement.GOTO)
+        targets = [self.int_expression()]
+        while self.match(TinyBasicTokenType.COMMA):
+            targets.append(self.int_expression())
+        # Jump table, every target resolves its IP once per line table
+        table = [self.jump(target) for target in targets]
+        count = len(table)
+        vm = self.vm
+
+        def run():
+            i = selector()
+            if 1 <= i <= count:
+                context = vm.context
+                if is_gosub:
+                    context.stack.append(context.ip_next)
+                context.ip_next = table[i - 1]()
+        return run
+
+    def stmt_ret(self):
+        vm = self.vm
+
+        def run():
+            context = vm.context
+            if 0 == len(context.stack):
+                raise TinyBasicException('STACK IS EMPTY')
+            line_number = context.stack.pop()
+            if (not isinstance(line_number, int)) or (line_number < 0) or (len(context.line_tab) < line_number):
+                raise TinyBasicException('STACK TOP IS NOT A VALID IP')
+            context.ip_next = line_number
+        return run
+
+    def stmt_print(self):
+        if self.looks_like(TinyBasicTokenType.HASH):
+            raise _NotCompilable()
+        parts = []
+        sep = True
+        new_line = False
+        while sep:
+            new_line = True
+            sep = False
+            part = self.expression()
+            suffix = ''
+            if self.match(TinyBasicTokenType.COMMA):
+                new_line = False
+                sep = not (self.looks_like(TinyBasicTokenType.COLON) or self.looks_like(TinyBasicTokenType.THE_END))
+            elif self.match(TinyBasicTokenType.SEMICOLON):
+                new_line = False
+                sep = not (self.looks_like(TinyBasicTokenType.COLON) or self.looks_like(TinyBasicTokenType.THE_END))
+                suffix = ' '
+            parts.append((part, suffix))
+        vm = self.vm
+
+        def run():
+            message = ''.join([str(part()) + suffix for part, suffix in parts])
+            vm.io.print_msg(message, new_line)
+        return run
+
+    def stmt_if(self):
+        condition = self.bool_expression()
+        if self.match(TinyBasicTokenType.STATEMENT, TinyBasicStatement.GOTO) or \
+                self.looks_like(TinyBasicTokenType.LITERAL):
+            then = self.stmt_goto()
+            # The rest of the line belongs to the IF, it is skipped with the GOTO when the condition is false
+            if self.match(TinyBasicTokenType.COLON):
+                then = _sequence(then, self.statement())
+        else:
+            self.expect(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.THEN)
+            if self.looks_like(TinyBasicTokenType.THE_END):
+                return self.block_jump(condition, 'IF WITHOUT END IF')
+            then = self.statement()
+
+        def run():
+            if condition():
+                then()
+        return run
+
+    def stmt_while(self):
+        return self.block_jump(self.bool_expression(), 'WHILE WITHOUT WEND')
+
+    def stmt_until(self):
+        return self.block_jump(self.bool_expression(), 'UNTIL WITHOUT REPEAT')
+
+    def block_line_end(self):
+        # The interpreter rejects statements after a block statement
+        if not self.looks_like(TinyBasicTokenType.THE_END):
+            raise _NotCompilable()
+
+    def block_jump(self, condition, unmatched: str):
+        """
+        :return: closure jumping to the target of the block statement when the condition is false
+        """
+        self.block_line_end()
+        vm = self.vm
+
+        def run():
+            context = vm.context
+            target = context.get_block_target(context.ip, unmatched)
+            if not condition():
+                context.ip_next = target
+        return run
+
+    def stmt_wend(self):
+        return self.block_exit('WEND WITHOUT WHILE')
+
+    def stmt_repeat(self):
+        return self.block_check('REPEAT WITHOUT UNTIL')
+
+    def block_exit(self, unmatched: str):
+        """
+        :return: closure jumping to the target of the block statement
+        """
+        self.block_line_end()
+        vm = self.vm
+
+        def run():
+            context = vm.context
+            context.ip_next = context.get_block_target(context.ip, unmatched)
+        return run
+
+    def block_check(self, unmatched: str):
+        """
+        :return: closure checking that the block statement has a partner, it does not jump
+        """
+        self.block_line_end()
+        vm = self.vm
+
+        def run():
+            context = vm.context
+            context.get_block_target(context.ip, unmatched)
+        return run
+
+    def stmt_for(self):
+        variable_name, index = self.variable()
+        if variable_name.endswith('$'):
+            raise _NotCompilable()
+        self.expect(TinyBasicTokenType.EQ_OPERATOR)
+        init_value = self.int_expression()
+        self.expect(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.TO)
+        max_value = self.int_expression()
+        if self.match(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.STEP):
+            step = self.int_expression()
+        else:
+            step = lambda: 1
+        if self.looks_like(TinyBasicTokenType.COLON):
+            # Single line loops re-interpret the rest of the line, they stay interpreted
+            raise _NotCompilable()
+        if index is None:
+            index = lambda: 0
+        vm = self.vm
+
+        def run():
+            i = index()
+            init = init_value()
+            loop = (variable_name, vm.context.ip_next, max_value(), step(), i)
+            vm.context.stack.append(loop)
+            vm.variables.write_num_var(variable_name, init, i)
+        return run
+
+    def stmt_next(self):
+        has_variable, loop_variable = self.read_on_match(TinyBasicTokenType.IDENTIFIER)
+        fail_not_int = self.fail_on_run('INTEGER VARIABLE')
+        vm = self.vm
+
+        def run():
+            stack = vm.context.stack
+            if 0 == len(stack):
+                raise TinyBasicException('Stack is empty, can\'t next')
+            while True:
+                if 0 == len(stack):
+                    if loop_variable is not None:
+                        raise TinyBasicException(f'Stack underflow while looking for {loop_variable}')
+                    raise TinyBasicException(f'Stack underflow')
+                loop = stack.pop()
+                if 5 != len(loop):
+                    raise TinyBasicException('Stack error')
+                variable_name = loop[0]
+                if variable_name.endswith('$'):
+                    fail_not_int()
+                if loop_variable is None or variable_name == loop_variable:
+                    break
+            variable_name, loop_start, limit, step, index = loop
+            value = vm.variables.read_num_var(variable_name, index) + step
+            if value <= limit:
+                vm.variables.write_num_var(variable_name, value, index)
+                vm.context.ip_next = loop_start
+                stack.append(loop)
+        return run
+
+    def variable(self, variable_name: str or None = None) -> tuple:
+        """
+        :return: the variable name and the index closure, None for index 0
+        """
+        if variable_name is None:
+            variable_name = self.expect(TinyBasicTokenType.IDENTIFIER)
+        if not self.match(TinyBasicTokenType.PARENS_OPEN):
+            return variable_name, None
+        index = self.checked(self.expression(), lambda x: isinstance(x, int) or isinstance(x, str),
+                             'INTEGER EXPRESSION', Variable.TYPE_ANY)
+        if self.looks_like(TinyBasicTokenType.COMMA):
+            indexes = [index]
+            while self.match(TinyBasicTokenType.COMMA):
+                indexes.append(self.int_expression())
+            index = lambda: tuple(i() for i in indexes)
+        self.expect(TinyBasicTokenType.PARENS_CLOSE)
+        return variable_name, index
+
+    def is_proven(self) -> bool:
+        """
+        :return: True when the type inference proved the type check at the current position
+        """
+        return self.runtime_checks is not None and self.tokenizer.pos not in self.runtime_checks
+
+    def typed(self, code, value_type: str):
+        self.value_types[code] = value_type
+        return code
+
+    def is_int(self, code) -> bool:
+        return self.value_types.get(code) == Variable.TYPE_INT
+
+    def checked(self, value, check, expected_token: str, value_type: str):
+        if self.is_proven():
+            return value
+        fail = self.fail_on_run(expected_token)
+
+        def run():
+            result = value()
+            if not check(result):
+                fail()
+            return result
+        return self.typed(run, value_type)
+
+    def int_expression(self):
+        return self.checked(self.expression(), lambda x: isinstance(x, int), 'INTEGER EXPRESSION', Variable.TYPE_INT)
+
+    def num_expression(self):
+        return self.checked(self.expression(), lambda x: isinstance(x, int) or isinstance(x, float),
+                            'NUMERIC EXPRESSION', Variable.TYPE_NUM)
+
+    def str_expression(self):
+        return self.checked(self.expression(), lambda x: isinstance(x, str), 'STRING EXPRESSION', Variable.TYPE_STR)
+
+    def bool_expression(self):
+        value = self.expression()
+        if self.is_proven():
+            return lambda: value() != 0
+        fail = self.fail_on_run('INTEGER EXPRESSION')
+
+        def run():
+            result = value()
+            if not isinstance(result, int):
+                fail()
+            return result != 0
+        return run
+
+    def expression(self):
+        return self.or_expression()
+
+    def bool_operation(self, left, right, operation):
+        # The interpreter checks the left operand after evaluating the right one
+        if self.is_proven():
+            return lambda: operation(left() != 0, right())
+        fail = self.fail_on_run('INTEGER EXPRESSION')
+
+        def run():
+            left_value = left()
+            right_value = right()
+            if not isinstance(left_value, int):
+                fail()
+            return operation(left_value != 0, right_value)
+        return run
+
+    def or_expression(self):
+        left = self.and_expression()
+        while self.match(TinyBasicTokenType.BOOL_OPERATOR, TinyBasicBoolOperator.OR):
+            left = self.bool_operation(left, self.and_expression(), lambda x, y: x or y)
+        return left
+
+    def and_expression(self):
+        left = self.xor_expression()
+        while self.match(TinyBasicTokenType.BOOL_OPERATOR, TinyBasicBoolOperator.AND):
+            left = self.bool_operation(left, self.xor_expression(), lambda x, y: x and y)
+        return left
+
+    def xor_expression(self):
+        left = self.bool_term()
+        while self.match(TinyBasicTokenType.BOOL_OPERATOR, TinyBasicBoolOperator.XOR):
+            left = self.bool_operation(left, self.bool_term(), operator.xor)
+        return left
+
+    def bool_term(self):
+        if self.match(TinyBasicTokenType.BOOL_OPERATOR, TinyBasicBoolOperator.NOT):
+            value = self.bool_expression()
+            return self.typed(lambda: not value(), Variable.TYPE_INT)
+        return self.comparison()
+
+    def comparison(self):
+        left = self.arithmetic_expression()
+        is_eq, eq_op = self.read_on_match(TinyBasicTokenType.EQ_OPERATOR)
+        if is_eq:
+            if eq_op != '=':
+                raise _NotCompilable()
+            return self.typed(self.binary_operation(left, self.arithmetic_expression(), eq_op), Variable.TYPE_INT)
+        is_cmp, cmp_op = self.read_on_match(TinyBasicTokenType.COMPARISON_OPERATOR)
+        if is_cmp:
+            if cmp_op not in _COMPARISON_OPS:
+                raise _NotCompilable()
+            return self.typed(self.binary_operation(left, self.arithmetic_expression(), cmp_op), Variable.TYPE_INT)
+        return left
+
+    def binary_operation(self, left, right, operation: str):
+        is_int = self.is_int(left) and self.is_int(right)
+        if is_int and operation == '/':
+            # Integer division without checking the operand types
+            operation = 'DIV'
+        by_closures, by_constant = _OPERATIONS[operation]
+        if right in self.constants:
+            code = by_constant(left, self.constants[right])
+        else:
+            code = by_closures(left, right)
+        if is_int:
+            self.typed(code, Variable.TYPE_INT)
+        return code
+
+    def arithmetic_expression(self):
+        left = self.term()
+        while self.looks_like(TinyBasicTokenType.ADD_OP):
+            operation = self.next().value
+            if operation not in _ADD_OPS:
+                raise _NotCompilable()
+            left = self.binary_operation(left, self.term(), operation)
+        return left
+
+    def term(self):
+        left = self.factor()
+        while self.looks_like(TinyBasicTokenType.MUL_OP):
+            operation = self.next().value
+            if operation not in _MUL_OPS:
+                raise _NotCompilable()
+            left = self.binary_operation(left, self.factor(), operation)
+        return left
+
+    def factor(self):
+        if self.match(TinyBasicTokenType.PARENS_OPEN):
+            result = self.expression()
+            self.expect(TinyBasicTokenType.PARENS_CLOSE)
+            return result
+        if self.looks_like(TinyBasicTokenType.LITERAL) or self.looks_like(TinyBasicTokenType.STRING_LITERAL):
+            value = self.next().value
+
+            def constant():
+                return value
+            self.constants[constant] = value
+            return self.typed(constant, Variable.TYPE_INT if isinstance(value, int) else Variable.TYPE_ANY)
+        if self.looks_like(TinyBasicTokenType.IDENTIFIER):
+            name = self.expect(TinyBasicTokenType.IDENTIFIER)
+            if is_user_function_name(name) and self.looks_like(TinyBasicTokenType.PARENS_OPEN):
+                if name.upper() not in self.vm.user_functions:
+                    # An array until DEF defines the function, the interpreter decides on every execution
+                    raise _NotCompilable()
+                return self.user_function(name)
+            if name in self.vm.functions and self.looks_like(TinyBasicTokenType.PARENS_OPEN):
+                return self.native_function(name)
+            return self.read_variable(*self.variable(name))
+        if self.looks_like(TinyBasicTokenType.FUNCTION, TinyBasicFunction.IIF):
+            return self.iif()
+        if self.looks_like(TinyBasicTokenType.FUNCTION):
+            return self.function()
+        # Unary operators and syntax errors are left to the interpreter
+        raise _NotCompilable()
+
+    def read_variable(self, variable_name: str, index):
+        vm = self.vm
+        name = variable_name.upper()
+        if index is not None:
+            code = lambda: vm.variables.read_var(variable_name, index())
+        else:
+            code = self.read_scalar(name)
+        if name in self.int_variables:
+            self.typed(code, Variable.TYPE_INT)
+        return code
+
+    def read_scalar(self, name: str):
+        vm = self.vm
+
+        def run():
+            # Direct access to the value, the storage reports undefined or unassigned variables
+            try:
+                value = vm.variables.variables[name].value[0]
+            except (KeyError, IndexError, TypeError):
+                value = None
+            if value is None:
+                return vm.variables.read_var(name)
+            return value
+        return run
+
+    def user_function(self, function_name: str):
+        self.expect(TinyBasicTokenType.PARENS_OPEN)
+        args = []
+        while not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+            args.append(self.expression())
+            if not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+                self.expect(TinyBasicTokenType.COMMA)
+        self.expect(TinyBasicTokenType.PARENS_CLOSE)
+        vm = self.vm
+        call = AbstractVM.call_function
+        code = lambda: call(vm, function_name, [arg() for arg in args])
+        return self.typed(code, Variable.TYPE_STR if function_name.endswith('$') else Variable.TYPE_NUM)
+
+    def native_function(self, function_name: str):
+        self.expect(TinyBasicTokenType.PARENS_OPEN)
+        args = []
+        while not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+            args.append(self.expression())
+            if not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+                self.expect(TinyBasicTokenType.COMMA)
+        self.expect(TinyBasicTokenType.PARENS_CLOSE)
+        functions = self.vm.functions
+        ret_type = functions.get(function_name).ret_type
+        # The function is looked up by name on every call, the host may register it again
+        code = lambda: functions.call(function_name, [arg() for arg in args])
+        return self.typed(code, ret_type)
+
+    def iif(self):
+        self.expect(TinyBasicTokenType.FUNCTION, TinyBasicFunction.IIF)
+        self.expect(TinyBasicTokenType.PARENS_OPEN)
+        condition = self.bool_expression()
+        self.expect(TinyBasicTokenType.COMMA)
+        when_true = self.expression()
+        self.expect(TinyBasicTokenType.COMMA)
+        when_false = self.expression()
+        self.expect(TinyBasicTokenType.PARENS_CLOSE)
+        code = lambda: when_true() if condition() else when_false()
+        if self.is_int(when_true) and self.is_int(when_false):
+            self.typed(code, Variable.TYPE_INT)
+        return code
+
+    def function(self):
+        function_name = self.expect(TinyBasicTokenType.FUNCTION)
+        function = TinyBasicInterpreter.builtin_functions.get(function_name.value)
+        if function is None:
+            raise _NotCompilable()
+        arg_types = function.arg_types
+        self.expect(TinyBasicTokenType.PARENS_OPEN)
+        vm = self.vm
+        args = []
+        while not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+            index = len(args)
+            if len(arg_types) <= index:
+                raise _NotCompilable()
+            if arg_types[index] == Variable.TYPE_STR:
+                args.append(self.str_expression())
+            elif arg_types[index] == Variable.TYPE_INT:
+                args.append(self.int_expression())
+            elif arg_types[index] == Variable.TYPE_NUM:
+                args.append(self.num_expression())
+            elif arg_types[index] == Variable.TYPE_ANY:
+                args.append(self.expression())
+            elif arg_types[index] is Channel:
+                number = self.int_expression()
+                args.append(lambda: vm.channels.access_channel(number()))
+            elif arg_types[index] is None:
+                variable_name = self.expect(TinyBasicTokenType.IDENTIFIER)
+                args.append(lambda: vm.variables.access_var(variable_name))
+            else:
+                raise _NotCompilable()
+            if not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+                self.expect(TinyBasicTokenType.COMMA)
+        if (function.max_args is not None and function.max_args < len(args)) or len(args) < function.min_args:
+            raise _NotCompilable()
+        self.expect(TinyBasicTokenType.PARENS_CLOSE)
+        fn = function.fn
+        if function.with_vm:
+            return self.typed(lambda: fn(vm, [arg() for arg in args]), function.ret_type)
+        return self.typed(lambda: fn([arg() for arg in args]), function.ret_type)
+
+    statements = {
+        TinyBasicStatement.REM: stmt_rem,
+        TinyBasicStatement.LET: stmt_let,
+        TinyBasicStatement.GOTO: stmt_goto,
+        TinyBasicStatement.GOSUB: stmt_gosub,
+        TinyBasicStatement.ON: stmt_on,
+        TinyBasicStatement.RET: stmt_ret,
+        TinyBasicStatement.PRINT: stmt_print,
+        TinyBasicStatement.END: stmt_end,
+        TinyBasicStatement.IF: stmt_if,
+        TinyBasicStatement.FOR: stmt_for,
+        TinyBasicStatement.NEXT: stmt_next,
+        TinyBasicStatement.WHILE: stmt_while,
+        TinyBasicStatement.WEND: stmt_wend,
+        TinyBasicStatement.REPEAT: stmt_repeat,
+        TinyBasicStatement.UNTIL: stmt_until
+    }
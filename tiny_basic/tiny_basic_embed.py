@@ -0,0 +1,71 @@
+from .errors import TinyBasicException, TinyBasicRunStopException
+from .interpreter_vm import TinyInterpreterVM
+from .vm import AbstractIo, ExecutionLimits
+
+
+class TinyBasicProgram:
+    """
+    Embedding API: load a program once, then call its labelled subroutines from Python.
+    The VM, the tokenized lines and the resolved entry points are reused by every call.
+    Variables are global and keep their values between calls.
+    """
+    def __init__(self, lines: list[str], io: AbstractIo or None = None, limits: ExecutionLimits or None = None):
+        self.vm = TinyInterpreterVM(AbstractIo() if io is None else io, limits)
+        self.vm.text.set_text(lines)
+        self.vm.reset()
+        self.entry_points: dict[str, int] = {}
+
+    @staticmethod
+    def from_file(file_name: str, io: AbstractIo or None = None,
+                  limits: ExecutionLimits or None = None) -> 'TinyBasicProgram':
+        with open(file_name) as f:
+            return TinyBasicProgram(f.readlines(), io, limits)
+
+    def entry_point(self, label: str) -> int:
+        """
+        :param label: label of the subroutine
+        :return: IP of the label line
+        """
+        label = label.upper()
+        if label not in self.entry_points:
+            labels = {name.upper(): line_number for name, line_number in self.vm.text.get_labels().items()}
+            if label not in labels:
+                raise TinyBasicException(f'UNKNOWN LABEL: {label}')
+            self.entry_points[label] = self.vm.context.line_tab.index(labels[label])
+        return self.entry_points[label]
+
+    def call(self, label: str, inputs: dict[str, int or float or str] or None = None,
+             outputs: list[str] or None = None) -> list:
+        """
+        Run a subroutine like GOSUB label, until its RETURN
+        :param label: label of the subroutine
+        :param inputs: variables to set before the call, string variable names end with $
+        :param outputs: variables to read after the call
+        :return: the values of the output variables
+        """
+        variables = self.vm.variables
+        if inputs is not None:
+            # The inferred variable types do not cover values from the host
+            self.vm.text.clear_types()
+            for name, value in inputs.items():
+                if name.endswith('$'):
+                    variables.write_str_var(name, value)
+                else:
+                    variables.write_num_var(name, value)
+        context = self.vm.context
+        context.ip = self.entry_point(label)
+        context.resume = None
+        # The sentinel return address is the end of the program, so the RETURN of the subroutine ends the run
+        context.stack = [len(context.line_tab)]
+        if self.vm.limits is not None:
+            self.vm.limits.start()
+        execute = self.vm.execute
+        compile_line = self.vm.compile
+        try:
+            while context.step(execute, compile_line):
+                pass
+        except TinyBasicRunStopException:
+            pass
+        if outputs is None:
+            return []
+        return [variables.read_var(name) for name in outputs]
@@ -0,0 +1,51 @@
+import argparse
+import os
+import tempfile
+import time
+
+from .vm import SourceText
+from .vm.program_loader import load_program
+
+
+def write_generated_program(file_name: str, lines: int):
+    with open(file_name, 'wt') as f:
+        for line_number in range(1, lines + 1):
+            f.write(f'{line_number * 10} v{line_number} = v{line_number - 1} + {line_number} * 2 : '
+                    f'PRINT "LINE"; v{line_number}\n')
+
+
+def time_load(lines: int, workers: int = 0) -> float:
+    """
+    Load a generated program
+    :return: seconds per line
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_name = os.path.join(tmp_dir, 'generated.bas')
+        write_generated_program(file_name, lines)
+        text = SourceText()
+        start = time.perf_counter()
+        load_program(file_name, text, workers)
+        elapsed = time.perf_counter() - start
+    if len(text.text) != lines:
+        raise RuntimeError(f'LOADED {len(text.text)} OF {lines} LINES')
+    return elapsed / lines
+
+
+def load_benchmark(sizes: list[int], workers: int = 0) -> dict[int, float]:
+    """
+    :return: load time per line in microseconds by program size, it stays flat when loading is linear
+    """
+    return {lines: time_load(lines, workers) * 1e6 for lines in sizes}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TinyBasic program load benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 40000, 160000])
+    parser.add_argument('--workers', type=int, default=0, help='process pool size, 0 loads in this process')
+    args = parser.parse_args()
+    for lines, per_line in load_benchmark(args.sizes, args.workers).items():
+        print(f'{lines} lines: {per_line:.1f}us per line, {lines * per_line / 1e6:.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+import argparse
+import asyncio
+import statistics
+import time
+
+from .tiny_basic_server import SERVER_READY, start_tiny_basic_server
+
+LOAD_TEST_COMMANDS = [
+    '10 s = 0',
+    '20 FOR i = 1 TO 100',
+    '30 s = s + i',
+    '40 NEXT',
+    '50 PRINT s',
+    'RUN',
+    'PRINT s * 2',
+]
+
+
+async def read_until_ready(reader: asyncio.StreamReader) -> list[str]:
+    lines = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionResetError('SERVER DISCONNECTED')
+        line = line.decode().rstrip('\r\n')
+        if line == SERVER_READY:
+            return lines
+        lines.append(line)
+
+
+async def load_session(host: str, port: int, commands: list[str], latencies: list[float]):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        await read_until_ready(reader)
+        for command in commands:
+            start = time.perf_counter()
+            writer.write(f'{command}\n'.encode())
+            await writer.drain()
+            await read_until_ready(reader)
+            latencies.append(time.perf_counter() - start)
+        writer.write(b'QUIT\n')
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def load_test(host: str, port: int, sessions: int = 500, commands: list[str] or None = None) -> dict:
+    """
+    Open concurrent sessions, run the same commands in each and measure the command latencies
+    :return: statistics of the run, latencies in milliseconds
+    """
+    if commands is None:
+        commands = LOAD_TEST_COMMANDS
+    latencies = []
+    start = time.perf_counter()
+    results = await asyncio.gather(
+        *[load_session(host, port, commands, latencies) for _ in range(sessions)], return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    errors = [result for result in results if isinstance(result, BaseException)]
+    percentiles = statistics.quantiles(latencies, n=100) if 2 <= len(latencies) else [0.0] * 99
+    return {
+        'sessions': sessions,
+        'commands': len(latencies),
+        'errors': len(errors),
+        'elapsed': elapsed,
+        'p50': percentiles[49] * 1000,
+        'p99': percentiles[98] * 1000
+    }
+
+
+async def run_load_test(host: str or None, port: int, sessions: int, yield_steps: int) -> dict:
+    if host is not None:
+        return await load_test(host, port, sessions)
+    server = await start_tiny_basic_server('127.0.0.1', 0, yield_steps, backlog=sessions)
+    async with server:
+        port = server.sockets[0].getsockname()[1]
+        return await load_test('127.0.0.1', port, sessions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='TinyBasic server load test')
+    parser.add_argument('--host', default=None, help='server to test, an in-process server is started when omitted')
+    parser.add_argument('--port', type=int, default=6502)
+    parser.add_argument('--sessions', type=int, default=500)
+    parser.add_argument('--yield-steps', type=int, default=100)
+    args = parser.parse_args()
+    result = asyncio.run(run_load_test(args.host, args.port, args.sessions, args.yield_steps))
+    print(f'{result["sessions"]} sessions, {result["commands"]} commands, {result["errors"]} errors '
+          f'in {result["elapsed"]:.2f}s')
+    print(f'p50: {result["p50"]:.2f}ms, p99: {result["p99"]:.2f}ms')
+
+
+if __name__ == '__main__':
+    main()
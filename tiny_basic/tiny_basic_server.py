@@ -0,0 +1,145 @@
+import asyncio
+
+from .errors import TinyBasicInputPendingException, TinyBasicQuitException, TinyBasicRunStopException
+from .interpreter_vm import TinyInterpreterVM
+from .tiny_basic_terminal import exec_line, report_error
+from .vm import QueuedIo
+
+SERVER_READY = 'READY'
+
+
+class TinyAsyncIo(QueuedIo):
+    """
+    Socket backed IO: output is buffered and flushed to the client, INPUT awaits the next line from the client
+    """
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        super().__init__()
+        self.reader = reader
+        self.writer = writer
+
+    async def flush(self):
+        output = self.take_output()
+        if output:
+            self.writer.write(output.encode())
+        await self.writer.drain()
+
+    def is_disconnected(self) -> bool:
+        return self.writer.is_closing() or self.reader.at_eof()
+
+    async def wait_input(self):
+        await self.flush()
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionResetError('CLIENT DISCONNECTED')
+        self.feed(line.decode().rstrip('\r\n'))
+
+
+class TinySessionVM(TinyInterpreterVM):
+    """
+    VM of a server session: RUN and CONT only request the run, the session executes the program asynchronously
+    """
+    def __init__(self, io: TinyAsyncIo):
+        super().__init__(io)
+        self.run_pending = False
+
+    def run(self):
+        self.run_pending = True
+
+
+class TinyBasicSession:
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, yield_steps: int):
+        self.io = TinyAsyncIo(reader, writer)
+        self.vm = TinySessionVM(self.io)
+        self.yield_steps = yield_steps
+
+    async def execute(self, command: str):
+        while True:
+            try:
+                exec_line(self.vm, command)
+                break
+            except TinyBasicInputPendingException as e:
+                if e.resume_line is not None:
+                    command = e.resume_line
+                await self.io.wait_input()
+        while self.vm.run_pending:
+            self.vm.run_pending = False
+            await self.run_program()
+
+    async def run_program(self):
+        context = self.vm.context
+        steps = 0
+        try:
+            while True:
+                try:
+                    if not context.step(self.vm.execute, self.vm.compile):
+                        break
+                except TinyBasicInputPendingException:
+                    await self.io.wait_input()
+                    continue
+                except TinyBasicRunStopException:
+                    break
+                if context.trace:
+                    return
+                steps += 1
+                if 0 == steps % self.yield_steps:
+                    # Let the other sessions run, and stream the output of long programs
+                    if self.io.is_disconnected():
+                        raise ConnectionResetError('CLIENT DISCONNECTED')
+                    await self.io.flush()
+                    await asyncio.sleep(0)
+        finally:
+            self.vm.finish_run()
+        self.io.print_msg("DONE.")
+
+    async def serve(self):
+        self.io.print_msg('TinyBasic Interpreter v1.00')
+        self.io.print_msg(SERVER_READY)
+        try:
+            await self.io.flush()
+            while True:
+                line = await self.io.reader.readline()
+                if not line:
+                    break
+                try:
+                    await self.execute(line.decode().rstrip('\r\n'))
+                except TinyBasicQuitException:
+                    self.io.print_msg('GOOD BYE!')
+                    await self.io.flush()
+                    break
+                except ConnectionError:
+                    raise
+                except Exception as e:
+                    report_error(self.vm, self.io, e)
+                self.io.print_msg(SERVER_READY)
+                await self.io.flush()
+        except ConnectionError:
+            pass
+        finally:
+            self.vm.channels.close_all()
+            self.io.writer.close()
+
+
+async def start_tiny_basic_server(host: str = '127.0.0.1', port: int = 6502, yield_steps: int = 100,
+                                  backlog: int = 512) -> asyncio.AbstractServer:
+    """
+    Start a line protocol server, every connection is a separate TinyBasic REPL session.
+    The server sends READY after each command, INPUT prompts are sent without READY.
+    :param host: address to listen on
+    :param port: TCP port, 0 to pick a free one
+    :param yield_steps: number of program lines executed before a running program yields to the event loop
+    :param backlog: listen queue size
+    :return: the running asyncio server
+    """
+    async def handle_client(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        await TinyBasicSession(reader, writer, yield_steps).serve()
+
+    return await asyncio.start_server(handle_client, host, port, backlog=backlog)
+
+
+def run_tiny_basic_server(host: str = '127.0.0.1', port: int = 6502, yield_steps: int = 100):
+    async def serve():
+        server = await start_tiny_basic_server(host, port, yield_steps)
+        async with server:
+            await server.serve_forever()
+
+    asyncio.run(serve())
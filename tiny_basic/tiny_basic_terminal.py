@@ -3,6 +3,7 @@ from .interpreter_vm import TinyInterpreterVM
 from .tiny_basic import TinyBasicInterpreter
 from .lexer.syntax_error import TinyBasicSyntaxError
 from .tiny_basic_io import TinyConsoleIo
+from .vm import AbstractIo
 
 
 def exec_line(vm: TinyInterpreterVM, line: str):
@@ -15,6 +16,17 @@ def exec_line(vm: TinyInterpreterVM, line: str):
         interpreter.interpret()
 
 
+def report_error(vm: TinyInterpreterVM, io: AbstractIo, e: Exception):
+    if isinstance(e, TinyBasicSyntaxError):
+        io.print_msg(f'SYNTAX ERROR: {e.msg}@{e.pos}')
+    elif isinstance(e, TinyBasicException):
+        io.print_msg(f'BASIC ERROR: {e.msg}@{vm.context.ip}')
+        vm.dump_line_info()
+    else:
+        io.print_msg(f'FATAL ERROR: {e}')
+        vm.dump_line_info()
+
+
 def run_tiny_basic_program(filename: str, io = TinyConsoleIo()):
     vm = TinyInterpreterVM(io)
     vm.execute(f'LOAD "{filename}"')
@@ -36,11 +48,5 @@ def run_tiny_basic(io = TinyConsoleIo()):
         except TinyBasicQuitException:
             io.print_msg('GOOD BYE!')
             break
-        except TinyBasicSyntaxError as e:
-            io.print_msg(f'SYNTAX ERROR: {e.msg}@{e.pos}')
-        except TinyBasicException as e:
-            io.print_msg(f'BASIC ERROR: {e.msg}@{vm.context.ip}')
-            vm.dump_line_info()
         except Exception as e:
-            io.print_msg(f'FATAL ERROR: {e}')
-            vm.dump_line_info()
+            report_error(vm, io, e)
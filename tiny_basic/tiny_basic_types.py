@@ -0,0 +1,551 @@
+from .errors import TinyBasicException, TinyBasicTypeException
+from .lexer import TinyBasicLexer, TinyBasicToken, TinyBasicStatement, TinyBasicTokenType, TinyBasicBoolOperator, \
+    TinyBasicKeyword
+from .lexer.functions import TinyBasicFunction
+from .function_registry import FunctionRegistry
+from .tiny_basic import TinyBasicInterpreter
+from .vm import SourceText, Variable, Channel, is_user_function_name
+
+_TYPE_NAMES = {
+    Variable.TYPE_INT: 'INTEGER',
+    Variable.TYPE_NUM: 'NUMERIC',
+    Variable.TYPE_STR: 'STRING'
+}
+
+
+class _AllVariables:
+    def __contains__(self, item) -> bool:
+        return True
+
+
+_ALL_VARIABLES = _AllVariables()
+
+
+class _Opaque(Exception):
+    """
+    The statement is not analyzed, its line keeps every runtime check
+    """
+
+
+def is_numeric(value_type: str) -> bool:
+    return value_type == Variable.TYPE_INT or value_type == Variable.TYPE_NUM
+
+
+def join_types(left: str, right: str) -> str:
+    if left == right:
+        return left
+    if is_numeric(left) and is_numeric(right):
+        return Variable.TYPE_NUM
+    return Variable.TYPE_ANY
+
+
+class TinyBasicTypeChecker(TinyBasicLexer):
+    """
+    Infers the types of the expressions of a program line, following the grammar of TinyBasicInterpreter.
+    A $ suffix makes a variable a string, other variables are numbers, integers when listed in int_variables.
+    Records the type errors that fail for sure, the positions of the runtime checks that can not be proven,
+    the numeric variables read, and the types written into numeric variables.
+    Functions called by identifier are looked up in the registry of the VM running the program.
+    """
+    def __init__(self, line: str, tokens: list[tuple[TinyBasicToken, int]] or None, int_variables: set[str],
+                 functions: FunctionRegistry):
+        super().__init__(line, tokens)
+        self.int_variables = int_variables
+        self.functions = functions
+        self.errors: list[str] = []
+        self.runtime_checks: set[int] = set()
+        self.reads: set[str] = set()
+        self.writes: list[tuple[str, str]] = []
+        self.opaque = False
+        self.restores = False
+
+    def check(self, line: str, tokens: list[tuple[TinyBasicToken, int]] or None):
+        try:
+            self.statement()
+            self.expect(TinyBasicTokenType.THE_END)
+        except (_Opaque, TinyBasicException):
+            self.opaque = True
+            self.write_identifiers(line, tokens)
+
+    def write_identifiers(self, line: str, tokens: list[tuple[TinyBasicToken, int]] or None):
+        # Statements without analysis may read and write any numeric variable of the line
+        try:
+            lexer = TinyBasicLexer(line, tokens)
+            while not lexer.looks_like(TinyBasicTokenType.THE_END):
+                token = lexer.next()
+                if token.type == TinyBasicTokenType.IDENTIFIER:
+                    self.variable_type(token.value)
+                    self.write(token.value, Variable.TYPE_NUM)
+        except TinyBasicException:
+            pass
+
+    def write(self, variable_name: str, value_type: str):
+        if not variable_name.endswith('$'):
+            self.writes.append((variable_name.upper(), value_type))
+
+    def require(self, value_type: str, expected_type: str):
+        """
+        Type check of the interpreter at the current position
+        """
+        if expected_type == Variable.TYPE_INT:
+            proven = value_type == Variable.TYPE_INT
+            fails = value_type == Variable.TYPE_STR
+        elif expected_type == Variable.TYPE_NUM:
+            proven = is_numeric(value_type)
+            fails = value_type == Variable.TYPE_STR
+        else:
+            proven = value_type == Variable.TYPE_STR
+            fails = is_numeric(value_type)
+        if fails:
+            self.errors.append(f'{_TYPE_NAMES[expected_type]} EXPRESSION EXPECTED')
+        if not proven:
+            self.runtime_checks.add(self.tokenizer.pos)
+
+    def fail_operation(self, operation: str, left: str, right: str) -> str:
+        self.errors.append(f'CAN NOT APPLY {operation} TO {left} AND {right}')
+        return Variable.TYPE_ANY
+
+    def statement(self):
+        is_statement, statement = self.read_on_match(TinyBasicTokenType.STATEMENT)
+        if is_statement:
+            if statement == TinyBasicStatement.RESTORE:
+                self.restores = True
+            if statement not in self.statements:
+                raise _Opaque()
+            self.statements[statement](self)
+        elif self.looks_like(TinyBasicTokenType.IDENTIFIER):
+            name = self.expect(TinyBasicTokenType.IDENTIFIER)
+            if self.looks_like(TinyBasicTokenType.COLON):
+                self.match(TinyBasicTokenType.COLON)
+                self.write(name, Variable.TYPE_INT)
+            else:
+                self.assignment(self.variable(name))
+        elif self.match(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.ELSE):
+            self.block_line_end('ELSE')
+        else:
+            raise _Opaque()
+        if self.match(TinyBasicTokenType.COLON):
+            self.statement()
+
+    def stmt_none(self):
+        pass
+
+    def stmt_end(self):
+        if self.match(TinyBasicTokenType.STATEMENT, TinyBasicStatement.IF):
+            self.block_line_end('END IF')
+
+    def stmt_rem(self):
+        self.expect(TinyBasicTokenType.COMMENT)
+
+    def stmt_while(self):
+        self.bool_expression()
+        self.block_line_end('WHILE')
+
+    def stmt_wend(self):
+        self.block_line_end('WEND')
+
+    def stmt_repeat(self):
+        self.block_line_end('REPEAT')
+
+    def stmt_until(self):
+        self.bool_expression()
+        self.block_line_end('UNTIL')
+
+    def block_line_end(self, statement: str):
+        # The interpreter fails on the statements after a block statement, the program is rejected at RUN
+        if not self.looks_like(TinyBasicTokenType.THE_END):
+            self.errors.append(f'{statement} MUST END ITS LINE')
+
+    def stmt_let(self):
+        self.assignment(self.variable())
+
+    def assignment(self, variable_name: str):
+        self.expect(TinyBasicTokenType.EQ_OPERATOR)
+        value_type = self.expression()
+        if variable_name.endswith('$'):
+            self.require(value_type, Variable.TYPE_STR)
+        else:
+            self.require(value_type, Variable.TYPE_NUM)
+            self.write(variable_name, value_type)
+
+    def stmt_dim(self):
+        while True:
+            self.expect(TinyBasicTokenType.IDENTIFIER)
+            self.expect(TinyBasicTokenType.PARENS_OPEN)
+            dim_type = self.expression()
+            if self.looks_like(TinyBasicTokenType.COMMA):
+                self.require(dim_type, Variable.TYPE_INT)
+                while self.match(TinyBasicTokenType.COMMA):
+                    self.int_expression()
+            self.expect(TinyBasicTokenType.PARENS_CLOSE)
+            if not self.match(TinyBasicTokenType.COMMA):
+                break
+
+    def stmt_randomize(self):
+        if not (self.looks_like(TinyBasicTokenType.THE_END) or self.looks_like(TinyBasicTokenType.COLON)):
+            self.expression()
+
+    def stmt_goto(self):
+        self.int_expression()
+
+    def stmt_on(self):
+        self.int_expression()
+        if not self.match(TinyBasicTokenType.STATEMENT, TinyBasicStatement.GOSUB):
+            self.expect(TinyBasicTokenType.STATEMENT, TinyBasicStatement.GOTO)
+        self.int_expression()
+        while self.match(TinyBasicTokenType.COMMA):
+            self.int_expression()
+
+    def stmt_print(self):
+        if self.match(TinyBasicTokenType.HASH):
+            self.int_expression()
+            self.expect(TinyBasicTokenType.COMMA)
+        sep = True
+        while sep:
+            sep = False
+            self.expression()
+            if self.match(TinyBasicTokenType.COMMA) or self.match(TinyBasicTokenType.SEMICOLON):
+                sep = not (self.looks_like(TinyBasicTokenType.COLON) or self.looks_like(TinyBasicTokenType.THE_END))
+
+    def stmt_input(self):
+        self.str_expression()
+        if not self.match(TinyBasicTokenType.SEMICOLON):
+            self.expect(TinyBasicTokenType.COMMA)
+        # Numbers are read with input_int
+        self.write(self.variable(), Variable.TYPE_INT)
+
+    def stmt_if(self):
+        self.bool_expression()
+        if self.match(TinyBasicTokenType.STATEMENT, TinyBasicStatement.GOTO) or \
+                self.looks_like(TinyBasicTokenType.LITERAL):
+            self.stmt_goto()
+        else:
+            self.expect(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.THEN)
+            if not self.looks_like(TinyBasicTokenType.THE_END):
+                self.statement()
+
+    def stmt_for(self):
+        variable_name = self.variable()
+        if variable_name.endswith('$'):
+            self.errors.append('INTEGER VARIABLE EXPECTED')
+        self.expect(TinyBasicTokenType.EQ_OPERATOR)
+        self.int_expression()
+        self.expect(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.TO)
+        self.int_expression()
+        if self.match(TinyBasicTokenType.KEYWORD, TinyBasicKeyword.STEP):
+            self.int_expression()
+        self.write(variable_name, Variable.TYPE_INT)
+
+    def stmt_next(self):
+        # The loop variable is incremented with the integer step
+        self.match(TinyBasicTokenType.IDENTIFIER)
+
+    def variable(self, variable_name: str or None = None) -> str:
+        if variable_name is None:
+            variable_name = self.expect(TinyBasicTokenType.IDENTIFIER)
+        if self.match(TinyBasicTokenType.PARENS_OPEN):
+            self.key_expression()
+            while self.match(TinyBasicTokenType.COMMA):
+                self.int_expression()
+            self.expect(TinyBasicTokenType.PARENS_CLOSE)
+        return variable_name
+
+    def key_expression(self):
+        # String keys index maps, the checker does not know which variables are maps
+        key_type = self.expression()
+        if key_type == Variable.TYPE_STR:
+            self.runtime_checks.add(self.tokenizer.pos)
+        else:
+            self.require(key_type, Variable.TYPE_INT)
+
+    def variable_type(self, variable_name: str) -> str:
+        if variable_name.endswith('$'):
+            return Variable.TYPE_STR
+        self.reads.add(variable_name.upper())
+        if variable_name.upper() in self.int_variables:
+            return Variable.TYPE_INT
+        return Variable.TYPE_NUM
+
+    def int_expression(self):
+        self.require(self.expression(), Variable.TYPE_INT)
+
+    def num_expression(self):
+        self.require(self.expression(), Variable.TYPE_NUM)
+
+    def str_expression(self):
+        self.require(self.expression(), Variable.TYPE_STR)
+
+    def bool_expression(self):
+        self.require(self.expression(), Variable.TYPE_INT)
+
+    def expression(self) -> str:
+        return self.or_expression()
+
+    def bool_operation(self, left: str, right: str) -> str:
+        # The interpreter converts the left operand to bool after reading the right one
+        self.require(left, Variable.TYPE_INT)
+        return join_types(Variable.TYPE_INT, right)
+
+    def or_expression(self) -> str:
+        left = self.and_expression()
+        while self.match(TinyBasicTokenType.BOOL_OPERATOR, TinyBasicBoolOperator.OR):
+            left = self.bool_operation(left, self.and_expression())
+        return left
+
+    def and_expression(self) -> str:
+        left = self.xor_expression()
+        while self.match(TinyBasicTokenType.BOOL_OPERATOR, TinyBasicBoolOperator.AND):
+            left = self.bool_operation(left, self.xor_expression())
+        return left
+
+    def xor_expression(self) -> str:
+        left = self.bool_term()
+        while self.match(TinyBasicTokenType.BOOL_OPERATOR, TinyBasicBoolOperator.XOR):
+            right = self.bool_term()
+            self.require(left, Variable.TYPE_INT)
+            if right == Variable.TYPE_STR:
+                left = self.fail_operation('XOR', Variable.TYPE_INT, right)
+            else:
+                left = Variable.TYPE_INT
+        return left
+
+    def bool_term(self) -> str:
+        if self.match(TinyBasicTokenType.BOOL_OPERATOR, TinyBasicBoolOperator.NOT):
+            self.bool_expression()
+            return Variable.TYPE_INT
+        return self.comparison()
+
+    def comparison(self) -> str:
+        left = self.arithmetic_expression()
+        if self.match(TinyBasicTokenType.EQ_OPERATOR):
+            self.arithmetic_expression()
+            return Variable.TYPE_INT
+        is_cmp, cmp_op = self.read_on_match(TinyBasicTokenType.COMPARISON_OPERATOR)
+        if is_cmp:
+            right = self.arithmetic_expression()
+            if cmp_op != '<>' and Variable.TYPE_STR in (left, right) and (is_numeric(left) or is_numeric(right)):
+                self.fail_operation(cmp_op, left, right)
+            return Variable.TYPE_INT
+        return left
+
+    def arithmetic_expression(self) -> str:
+        left = self.term()
+        while self.looks_like(TinyBasicTokenType.ADD_OP):
+            operation = self.next().value
+            right = self.term()
+            if is_numeric(left) and is_numeric(right):
+                left = join_types(left, right)
+            elif Variable.TYPE_ANY in (left, right):
+                left = Variable.TYPE_ANY
+            elif operation == '+' and left == Variable.TYPE_STR and right == Variable.TYPE_STR:
+                left = Variable.TYPE_STR
+            else:
+                left = self.fail_operation(operation, left, right)
+        return left
+
+    def term(self) -> str:
+        left = self.factor()
+        while self.looks_like(TinyBasicTokenType.MUL_OP):
+            operation = self.next().value
+            right = self.factor()
+            if is_numeric(left) and is_numeric(right):
+                left = join_types(left, right)
+            elif Variable.TYPE_ANY in (left, right):
+                left = Variable.TYPE_ANY
+            elif operation == '*' and {left, right} == {Variable.TYPE_STR, Variable.TYPE_INT}:
+                # Repeating a string
+                left = Variable.TYPE_STR
+            elif operation == '*' and {left, right} == {Variable.TYPE_STR, Variable.TYPE_NUM}:
+                left = Variable.TYPE_ANY
+            elif operation == 'MOD' and left == Variable.TYPE_STR:
+                # Python string formatting, the result depends on the values
+                left = Variable.TYPE_ANY
+            else:
+                left = self.fail_operation(operation, left, right)
+        return left
+
+    def factor(self) -> str:
+        if self.match(TinyBasicTokenType.PARENS_OPEN):
+            result = self.expression()
+            self.expect(TinyBasicTokenType.PARENS_CLOSE)
+            return result
+        if self.looks_like(TinyBasicTokenType.LITERAL):
+            value = self.next().value
+            return Variable.TYPE_INT if isinstance(value, int) else Variable.TYPE_NUM
+        if self.looks_like(TinyBasicTokenType.STRING_LITERAL):
+            self.next()
+            return Variable.TYPE_STR
+        if self.looks_like(TinyBasicTokenType.IDENTIFIER):
+            name = self.expect(TinyBasicTokenType.IDENTIFIER)
+            if is_user_function_name(name) and self.looks_like(TinyBasicTokenType.PARENS_OPEN):
+                return self.user_function(name)
+            if name in self.functions and self.looks_like(TinyBasicTokenType.PARENS_OPEN):
+                return self.native_function(name)
+            return self.variable_type(self.variable(name))
+        if self.looks_like(TinyBasicTokenType.FUNCTION, TinyBasicFunction.IIF):
+            return self.iif()
+        if self.looks_like(TinyBasicTokenType.FUNCTION):
+            return self.function()
+        raise _Opaque()
+
+    def user_function(self, function_name: str) -> str:
+        # The arguments are bound at runtime, the call checks that the result matches the name.
+        # Without a DEF the name reads an array, indexes that are not integers keep their runtime check.
+        self.expect(TinyBasicTokenType.PARENS_OPEN)
+        while not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+            if self.expression() != Variable.TYPE_INT:
+                self.runtime_checks.add(self.tokenizer.pos)
+            if not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+                self.expect(TinyBasicTokenType.COMMA)
+        self.expect(TinyBasicTokenType.PARENS_CLOSE)
+        return Variable.TYPE_STR if function_name.endswith('$') else Variable.TYPE_NUM
+
+    def native_function(self, function_name: str) -> str:
+        # The call checks the arguments and the result against the signature
+        function = self.functions.get(function_name)
+        self.expect(TinyBasicTokenType.PARENS_OPEN)
+        count = 0
+        while not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+            arg_type = self.expression()
+            if count < len(function.arg_types) and function.arg_types[count] != Variable.TYPE_ANY:
+                self.require(arg_type, function.arg_types[count])
+            count += 1
+            if not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+                self.expect(TinyBasicTokenType.COMMA)
+        self.expect(TinyBasicTokenType.PARENS_CLOSE)
+        return function.ret_type
+
+    def iif(self) -> str:
+        self.expect(TinyBasicTokenType.FUNCTION, TinyBasicFunction.IIF)
+        self.expect(TinyBasicTokenType.PARENS_OPEN)
+        self.bool_expression()
+        self.expect(TinyBasicTokenType.COMMA)
+        when_true = self.expression()
+        self.expect(TinyBasicTokenType.COMMA)
+        when_false = self.expression()
+        self.expect(TinyBasicTokenType.PARENS_CLOSE)
+        return join_types(when_true, when_false)
+
+    def function(self) -> str:
+        function_name = self.expect(TinyBasicTokenType.FUNCTION)
+        function = TinyBasicInterpreter.builtin_functions.get(function_name.value)
+        if function is None:
+            raise _Opaque()
+        ret, arg_types = function.ret_type, function.arg_types
+        self.expect(TinyBasicTokenType.PARENS_OPEN)
+        count = 0
+        while not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+            if len(arg_types) <= count:
+                raise _Opaque()
+            arg_type = arg_types[count]
+            if arg_type is None:
+                self.expect(TinyBasicTokenType.IDENTIFIER)
+            elif arg_type is Channel:
+                self.int_expression()
+            elif arg_type == Variable.TYPE_ANY:
+                self.expression()
+            else:
+                self.require(self.expression(), arg_type)
+            count += 1
+            if not self.looks_like(TinyBasicTokenType.PARENS_CLOSE):
+                self.expect(TinyBasicTokenType.COMMA)
+        self.expect(TinyBasicTokenType.PARENS_CLOSE)
+        return ret
+
+    statements = {
+        TinyBasicStatement.DEBUG: stmt_none,
+        TinyBasicStatement.CLS: stmt_none,
+        TinyBasicStatement.RET: stmt_none,
+        TinyBasicStatement.END: stmt_end,
+        TinyBasicStatement.REM: stmt_rem,
+        TinyBasicStatement.LET: stmt_let,
+        TinyBasicStatement.DIM: stmt_dim,
+        TinyBasicStatement.GOTO: stmt_goto,
+        TinyBasicStatement.GOSUB: stmt_goto,
+        TinyBasicStatement.ON: stmt_on,
+        TinyBasicStatement.PRINT: stmt_print,
+        TinyBasicStatement.INPUT: stmt_input,
+        TinyBasicStatement.IF: stmt_if,
+        TinyBasicStatement.FOR: stmt_for,
+        TinyBasicStatement.NEXT: stmt_next,
+        TinyBasicStatement.WHILE: stmt_while,
+        TinyBasicStatement.WEND: stmt_wend,
+        TinyBasicStatement.REPEAT: stmt_repeat,
+        TinyBasicStatement.UNTIL: stmt_until,
+        TinyBasicStatement.RANDOMIZE: stmt_randomize
+    }
+
+
+def check_line_types(text: SourceText, line: str, int_variables,
+                     functions: FunctionRegistry) -> TinyBasicTypeChecker:
+    """
+    Check a line, or reuse the result for the same line text when the integer variables it reads are the same.
+    The cache is valid for one set of functions, registering a function drops it, see SourceText.reset_types.
+    """
+    cached = text.type_cache.get(line)
+    if cached is not None:
+        reads, checkers = cached
+        checker = checkers.get(frozenset(name for name in reads if name in int_variables))
+        if checker is not None:
+            return checker
+    tokens = text.get_tokens(line)
+    checker = TinyBasicTypeChecker(line, tokens, int_variables, functions)
+    checker.check(line, tokens)
+    # The variables read depend on the line text only
+    reads, checkers = text.type_cache.setdefault(line, (frozenset(checker.reads), {}))
+    checkers[frozenset(name for name in reads if name in int_variables)] = checker
+    return checker
+
+
+def check_program_types(text: SourceText, functions: FunctionRegistry):
+    """
+    Infer the types of the program and store the results into the source text, see SourceText.set_types.
+    Numeric variables are integers when only integers are written into them. The inference starts with every
+    numeric variable as integer. A variable written with another type is demoted, and only the lines reading it
+    are checked again, until no more variables are demoted. A line is checked again at most once per variable
+    it reads, so a chain of assignments is inferred in linear time.
+    The results of the lines are cached, a RUN after an edit only checks the edited line and its dependents again.
+    A RUN without edits keeps the types of the previous one, edits keep them valid, see SourceText.invalidate_types.
+    :raise TinyBasicTypeException: with every certain type error and its line number
+    """
+    if text.runtime_checks is not None and text.types_version == text.version:
+        return
+    line_numbers = text.get_line_table()
+    checkers = {}
+    readers: dict[str, list[int]] = {}
+    for line_number in line_numbers:
+        checker = check_line_types(text, text.text[line_number], _ALL_VARIABLES, functions)
+        checkers[line_number] = checker
+        for name in checker.reads:
+            readers.setdefault(name, []).append(line_number)
+    if any(checker.restores for checker in checkers.values()):
+        # RESTORE can replace every variable
+        int_variables = set()
+        pending = set(line_numbers)
+    else:
+        writes = [(label.upper(), Variable.TYPE_INT) for label in text.get_labels()]
+        for checker in checkers.values():
+            writes.extend(checker.writes)
+        int_variables = {name for name, _ in writes} - \
+            {name for name, value_type in writes if value_type != Variable.TYPE_INT}
+        pending = {line_number for line_number, checker in checkers.items()
+                   if not checker.reads <= int_variables}
+    while pending:
+        line_number = pending.pop()
+        checker = check_line_types(text, text.text[line_number], int_variables, functions)
+        checkers[line_number] = checker
+        for name, value_type in checker.writes:
+            if value_type != Variable.TYPE_INT and name in int_variables:
+                int_variables.remove(name)
+                pending.update(readers.get(name, ()))
+    checkers = [(line_number, text.text[line_number], checkers[line_number]) for line_number in line_numbers]
+    errors = [(line_number, error) for line_number, line, checker in checkers for error in checker.errors]
+    if errors:
+        raise TinyBasicTypeException(errors)
+    runtime_checks = {line: frozenset(checker.runtime_checks)
+                      for line_number, line, checker in checkers if not checker.opaque}
+    line_reads = {line_number: frozenset(checker.reads) for line_number, line, checker in checkers}
+    line_writes = {line_number: frozenset(name for name, _ in checker.writes)
+                   for line_number, line, checker in checkers}
+    text.set_types(runtime_checks, frozenset(int_variables), line_reads, line_writes)
+    text.types_version = text.version
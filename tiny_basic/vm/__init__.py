@@ -1,6 +1,14 @@
 from .io import AbstractIo
 from .text import SourceText
-from .variable import Variable
+from .limits import ExecutionLimits
+from .variable import Variable, MapVariable
 from .variable_stg import VariableStorage
+from .random_source import RandomSource, RANDOM_BLOCK_SIZE
+from .user_function import UserFunction, FUNCTION_CACHE_SIZE, is_user_function_name
+from .channel import Channel
+from .channel_stg import ChannelStorage
 from .context import Context
-from .abstract_vm import AbstractVM
\ No newline at end of file
+from .abstract_vm import AbstractVM
+from .vm_pool import VMPool
+from .queued_io import QueuedIo
+from .scheduler import Scheduler, ScheduledTask
\ No newline at end of file
@@ -1,33 +1,124 @@
+import copy
 from typing import Optional, Tuple, Any
 
 from ..errors import TinyBasicException
-from . import Context, AbstractIo, SourceText, VariableStorage
+from . import Context, AbstractIo, SourceText, VariableStorage, ChannelStorage, ExecutionLimits, UserFunction, \
+    RandomSource
+from .snapshot import write_snapshot, read_snapshot
 
 class AbstractVM:
-    def __init__(self, io: AbstractIo):
+    def __init__(self, io: AbstractIo, limits: ExecutionLimits or None = None):
         self.text = SourceText()
-        self.variables = VariableStorage()
-        self.context = Context(self.text)
+        self.limits = limits
+        self.variables = VariableStorage(limits)
+        self.context = Context(self.text, limits)
+        self.channels = ChannelStorage()
+        # Functions defined by DEF FN, by upper case name
+        self.user_functions: dict[str, UserFunction] = {}
+        # RUN keeps the state of the generator, RANDOMIZE seeds it
+        self.random = RandomSource()
         self.io = io
 
     def reset(self):
+        if self.limits is not None:
+            self.limits.start()
         self.variables.reset()
+        self.channels.reset()
+        self.user_functions.clear()
         labels = self.text.get_labels()
         for label in labels:
             self.variables.write_num_var(label, labels[label])
         self.context.reset(self.text.get_line_table())
 
+    def clone(self, io: AbstractIo or None = None) -> 'AbstractVM':
+        """
+        Copy the VM for another run of the same program. The program text, the derived line table and labels
+        are shared, variables are copied on their first write. Open file channels are not cloned.
+        :param io: IO of the clone, the IO of this VM when None
+        :return: VM of the same class in the same state
+        """
+        result = copy.copy(self)
+        result.io = self.io if io is None else io
+        result.limits = copy.copy(self.limits)
+        result.text = self.text.clone()
+        result.variables = self.variables.clone(result.limits)
+        result.context = self.context.clone(result.text, result.limits)
+        result.channels = ChannelStorage()
+        result.user_functions = {name: function.copy() for name, function in self.user_functions.items()}
+        result.random = self.random.clone()
+        return result
+
     def execute(self, line: str) -> int or None:
         raise TinyBasicException("Abstract VM has no function to execute instructions")
 
+    def check_types(self):
+        """
+        Static analysis of the program before RUN, it may let the evaluator skip runtime type checks
+        """
+        pass
+
+    def compile(self, line: str):
+        """
+        Compile a hot line into a closure without arguments, executing it like execute(line)
+        :return: None when the line can only be interpreted
+        """
+        return None
+
+    def compile_function(self, source: str):
+        """
+        Compile the body of a user function into a closure without arguments evaluating it
+        """
+        raise TinyBasicException("Abstract VM has no function to evaluate expressions")
+
+    def call_function(self, name: str, args: list):
+        function = self.user_functions.get(name.upper())
+        if function is None:
+            raise TinyBasicException(f'UNKNOWN FUNCTION: {name.upper()}')
+        return function.call(self, args)
+
     def step(self):
-        if not self.context.step(self.execute):
+        if not self.context.step(self.execute, self.compile):
+            self.finish_run()
             self.io.print_msg(f'PROGRAM TERMINATED')
 
     def run(self):
-        self.context.run(self.execute)
+        try:
+            self.context.run(self.execute, self.compile)
+        finally:
+            self.finish_run()
         self.io.print_msg("DONE.")
 
+    def finish_run(self):
+        """
+        Called when the program stops running. At the end of the program the file channels are closed,
+        a stopped or failed program keeps them open for CONT, with their output flushed.
+        """
+        if self.context.get_max_ip() <= self.context.ip:
+            self.channels.close_all()
+        else:
+            self.channels.flush_all()
+
+    def snapshot(self, file_name: str, ip: int or None = None):
+        """
+        Checkpoint the VM into a file, open file channels are not stored
+        :param file_name: snapshot file
+        :param ip: the line to continue with after restore, the current line when None
+        """
+        write_snapshot(self, file_name, self.context.ip if ip is None else ip)
+
+    def restore(self, file_name: str):
+        """
+        Restore a checkpoint, CONT continues the program where the snapshot was taken
+        :param file_name: snapshot file
+        """
+        self.channels.reset()
+        read_snapshot(self, file_name)
+        if self.limits is not None:
+            self.limits.start()
+            for var in self.variables.variables.values():
+                self.limits.array_elements += var.dim
+                self.limits.string_bytes += VariableStorage.string_size(var.value)
+
     def get_line_for_ip(self, ip: int) -> tuple[int or None, str or None]:
         if 0 <= ip < self.context.get_max_ip():
             line_number = self.context.line_tab[ip]
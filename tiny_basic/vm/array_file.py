@@ -0,0 +1,109 @@
+import struct
+from array import array
+
+from tiny_basic.errors import TinyBasicException
+from .binary_io import to_little_endian
+
+# Binary array file: magic, format version, array typecode, number of elements, then the raw little endian items
+ARRAY_FILE_MAGIC = b'TBAR'
+ARRAY_FILE_VERSION = 1
+ARRAY_FILE_HEADER = struct.Struct('<4sBcQ')
+TYPECODE_INT = 'q'
+TYPECODE_NUM = 'd'
+
+
+def _check_assigned(name: str, values: list):
+    if None in values:
+        raise TinyBasicException(f'{name}[{values.index(None)}] IS NOT YET ASSIGNED')
+
+
+def write_text_array(file_name: str, name: str, values: list):
+    """
+    Write an array as text, one element per line
+    :param file_name: output file
+    :param name: variable name for error reporting
+    :param values: string or numeric elements
+    """
+    _check_assigned(name, values)
+    with open(file_name, 'wt') as f:
+        f.writelines(f'{value}\n' for value in values)
+
+
+def write_binary_array(file_name: str, name: str, values: list):
+    """
+    Write a numeric array in the binary array file format.
+    Integer only arrays are stored as 64 bit integers, anything else as doubles,
+    so the integer elements of a mixed array are read back as floats (1 becomes 1.0).
+    :param file_name: output file
+    :param name: variable name for error reporting
+    :param values: numeric elements
+    """
+    _check_assigned(name, values)
+    typecode = TYPECODE_INT if all(isinstance(value, int) for value in values) else TYPECODE_NUM
+    try:
+        data = array(typecode, values)
+    except OverflowError:
+        raise TinyBasicException(f'{name} HAS ELEMENTS TOO LARGE FOR BINARY FORMAT')
+    except TypeError:
+        raise TinyBasicException(f'{name} IS NOT A NUMERIC ARRAY')
+    to_little_endian(data)
+    with open(file_name, 'wb') as f:
+        f.write(ARRAY_FILE_HEADER.pack(ARRAY_FILE_MAGIC, ARRAY_FILE_VERSION, typecode.encode(), len(data)))
+        f.write(data)
+
+
+def _parse_number(text: str) -> int or float:
+    try:
+        return int(text)
+    except ValueError:
+        pass
+    try:
+        return float(text)
+    except ValueError:
+        raise TinyBasicException(f'{text} IS NOT A NUMBER')
+
+
+def _read_binary_header(f) -> tuple[str, int] or None:
+    """
+    Read the binary array file header
+    :return: typecode and number of elements, None when the file is not a binary array file
+    """
+    try:
+        magic, version, typecode, dim = ARRAY_FILE_HEADER.unpack(f.read(ARRAY_FILE_HEADER.size))
+    except struct.error:
+        return None
+    typecode = typecode.decode('latin-1')
+    if magic != ARRAY_FILE_MAGIC or version != ARRAY_FILE_VERSION or typecode not in (TYPECODE_INT, TYPECODE_NUM):
+        return None
+    return typecode, dim
+
+
+def _read_binary_array(f, file_name: str, typecode: str, dim: int) -> list:
+    try:
+        data = array(typecode, [0]) * dim
+    except (OverflowError, MemoryError):
+        raise TinyBasicException(f'INVALID ARRAY SIZE IN {file_name}: {dim}')
+    if f.readinto(memoryview(data).cast('B')) != dim * data.itemsize:
+        raise TinyBasicException(f'TRUNCATED ARRAY FILE: {file_name}')
+    return to_little_endian(data).tolist()
+
+
+def read_array(file_name: str, numeric: bool) -> list:
+    """
+    Read an array written by write_text_array or write_binary_array, the format is detected from the header
+    :param file_name: input file
+    :param numeric: True to read numbers, False to read strings
+    :return: list of elements
+    """
+    with open(file_name, 'rb') as f:
+        header = _read_binary_header(f)
+        if header is not None:
+            if not numeric:
+                raise TinyBasicException(f'{file_name} CONTAINS A NUMERIC ARRAY')
+            typecode, dim = header
+            return _read_binary_array(f, file_name, typecode, dim)
+    with open(file_name) as f:
+        lines = [line.rstrip() for line in f]
+    if numeric:
+        return [_parse_number(line) for line in lines]
+    return lines
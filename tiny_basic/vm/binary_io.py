@@ -0,0 +1,12 @@
+import sys
+from array import array
+
+
+def to_little_endian(data: array) -> array:
+    """
+    Convert an array between the native byte order and the little endian order of the binary files, in place
+    :return: the array
+    """
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data
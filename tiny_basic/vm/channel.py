@@ -0,0 +1,56 @@
+from tiny_basic.errors import TinyBasicException
+
+
+class Channel:
+    MODE_INPUT = 'INPUT'
+    MODE_OUTPUT = 'OUTPUT'
+    MODE_APPEND = 'APPEND'
+
+    def __init__(self, number: int, file_name: str, mode: str):
+        self.number = number
+        self.file_name = file_name
+        self.mode = mode
+        self.pending = ''
+        file_modes = {
+            Channel.MODE_INPUT: 'rt',
+            Channel.MODE_OUTPUT: 'wt',
+            Channel.MODE_APPEND: 'at'
+        }
+        if mode not in file_modes:
+            raise TinyBasicException(f'INVALID FILE MODE: {mode}')
+        try:
+            self.file = open(file_name, file_modes[mode])
+        except OSError as e:
+            raise TinyBasicException(f'CANNOT OPEN {file_name}: {e.strerror}')
+        if self.is_input():
+            # One line of look-ahead, so EOF is known before the program tries to read past the end
+            self.pending = self.file.readline()
+
+    def is_input(self) -> bool:
+        return self.mode == Channel.MODE_INPUT
+
+    def eof(self) -> bool:
+        if not self.is_input():
+            raise TinyBasicException(f'FILE #{self.number} IS NOT OPEN FOR INPUT')
+        return '' == self.pending
+
+    def read_line(self) -> str:
+        if self.eof():
+            raise TinyBasicException(f'END OF FILE #{self.number}')
+        result = self.pending
+        self.pending = self.file.readline()
+        return result.rstrip('\r\n')
+
+    def print_msg(self, message: str, new_line: bool = True):
+        if self.is_input():
+            raise TinyBasicException(f'FILE #{self.number} IS NOT OPEN FOR OUTPUT')
+        self.file.write(message)
+        if new_line:
+            self.file.write('\n')
+
+    def flush(self):
+        if not self.is_input():
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,42 @@
+from tiny_basic.errors import TinyBasicException
+from .channel import Channel
+
+
+class ChannelStorage:
+    def __init__(self):
+        self.channels: dict[int, Channel] = {}
+
+    def reset(self):
+        self.close_all()
+
+    def open(self, number: int, file_name: str, mode: str):
+        if number in self.channels:
+            raise TinyBasicException(f'FILE #{number} IS ALREADY OPEN')
+        self.channels[number] = Channel(number, file_name, mode)
+
+    def access_channel(self, number: int) -> Channel:
+        if number not in self.channels:
+            raise TinyBasicException(f'FILE #{number} IS NOT OPEN')
+        return self.channels[number]
+
+    def close(self, number: int):
+        self.access_channel(number).close()
+        self.channels.pop(number)
+
+    def close_all(self):
+        for channel in self.channels.values():
+            channel.close()
+        self.channels.clear()
+
+    def flush_all(self):
+        for channel in self.channels.values():
+            channel.flush()
+
+    def eof(self, number: int) -> bool:
+        return self.access_channel(number).eof()
+
+    def read_line(self, number: int) -> str:
+        return self.access_channel(number).read_line()
+
+    def print_msg(self, number: int, message: str, new_line: bool = True):
+        self.access_channel(number).print_msg(message, new_line)
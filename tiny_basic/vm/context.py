@@ -1,39 +1,132 @@
-from tiny_basic.errors import TinyBasicRunStopException
+from tiny_basic.errors import TinyBasicException, TinyBasicRunStopException, TinyBasicInputPendingException
 from . import SourceText
+from .limits import ExecutionLimits
 
 
 class Context:
-    def __init__(self, text: SourceText):
+    # Executions of a line before it is compiled
+    HOT_THRESHOLD = 100
+
+    def __init__(self, text: SourceText, limits: ExecutionLimits or None = None):
         self.text = text
+        self.limits = limits
         self.ip = 0
         self.ip_next = 1
         self.stack = []
         self.line_tab = []
         self.trace = False
+        self.resume = None
+        self.hot_threshold = Context.HOT_THRESHOLD
+        # Executions of the interpreted lines by line number
+        self.hits: dict[int, int] = {}
+        # IPs by line number, derived once from the line table they belong to
+        self.ips: dict[int, int] = {}
+        self.ips_line_tab = None
+        # Jump targets of the block statements by IP, derived once from the line table and the program version
+        self.blocks: dict[int, int] = {}
+        self.blocks_line_tab = None
+        self.blocks_version = None
 
     def reset(self, line_tab: list):
         self.line_tab = line_tab
         self.ip = 0
+        self.ip_next = 0
         self.stack = []
+        self.resume = None
+        self.hits = {}
+
+    def clone(self, text: SourceText, limits: ExecutionLimits or None) -> 'Context':
+        result = Context(text, limits)
+        result.ip = self.ip
+        result.ip_next = self.ip_next
+        result.stack = list(self.stack)
+        result.line_tab = self.line_tab
+        result.ips = self.ips
+        result.ips_line_tab = self.ips_line_tab
+        result.blocks = self.blocks
+        result.blocks_line_tab = self.blocks_line_tab
+        result.blocks_version = self.blocks_version
+        result.trace = self.trace
+        result.resume = self.resume
+        result.hot_threshold = self.hot_threshold
+        return result
+
+    def get_ip(self, line_number: int) -> int:
+        """
+        :return: IP of a line, looked up in a map built once per line table
+        """
+        if self.ips_line_tab is not self.line_tab:
+            self.ips = {number: ip for ip, number in enumerate(self.line_tab)}
+            self.ips_line_tab = self.line_tab
+        ip = self.ips.get(line_number)
+        if ip is None:
+            raise TinyBasicException(f'Line number not found: {line_number}')
+        return ip
+
+    def get_block_target(self, ip: int, unmatched: str) -> int:
+        """
+        :param unmatched: error message when the block statement at ip has no partner
+        :return: jump target of the block statement at ip, see SourceText.find_blocks
+        """
+        if self.blocks_line_tab is not self.line_tab or self.blocks_version != self.text.version:
+            self.blocks = self.text.find_blocks(self.line_tab)
+            self.blocks_line_tab = self.line_tab
+            self.blocks_version = self.text.version
+        target = self.blocks.get(ip)
+        if target is None:
+            raise TinyBasicException(unmatched)
+        return target
 
     def get_max_ip(self):
         return len(self.line_tab)
 
-    def step(self, fn_execute) -> bool:
+    def count_step(self):
+        if self.limits is not None:
+            self.limits.count_step()
+
+    def step(self, fn_execute, fn_compile=None) -> bool:
+        """
+        Execute the line at IP. Lines executed more than hot_threshold times are compiled with fn_compile,
+        their compiled form is called instead of fn_execute from then on.
+        :param fn_execute: interprets a line
+        :param fn_compile: compiles a line into a closure without arguments, None when it can not be compiled
+        :return: False at the end of the program
+        """
         if 0 <= self.ip < len(self.line_tab):
-            line_number = self.line_tab[self.ip]
-            line = self.text.text[line_number]
-            self.ip_next = self.ip + 1
-            fn_execute(line)
+            self.count_step()
+            if self.resume is None:
+                line_number = self.line_tab[self.ip]
+                self.ip_next = self.ip + 1
+                code = self.text.compiled.get(line_number)
+                if code is None and fn_compile is not None and self.hot_threshold is not None:
+                    hits = self.hits.get(line_number, 0) + 1
+                    self.hits[line_number] = hits
+                    if self.hot_threshold <= hits:
+                        code = self.text.compile_line(line_number, fn_compile)
+                if code:
+                    code()
+                    self.ip = self.ip_next
+                    return True
+                line = self.text.text[line_number]
+            else:
+                line, self.ip_next = self.resume
+                self.resume = None
+            try:
+                fn_execute(line)
+            except TinyBasicInputPendingException as e:
+                # The line is not committed: the next step continues it from the pending INPUT statement
+                if e.resume_line is not None:
+                    self.resume = (e.resume_line, self.ip_next)
+                raise
             self.ip = self.ip_next
             return True
         else:
             return False
 
-    def run(self, fn_execute):
+    def run(self, fn_execute, fn_compile=None):
         while self.ip < len(self.line_tab):
             try:
-                self.step(fn_execute)
+                self.step(fn_execute, fn_compile)
                 if self.trace:
                     return
             except TinyBasicRunStopException:
@@ -1,4 +1,7 @@
 class AbstractIo:
+    def has_input(self) -> bool:
+        return True
+
     def input_int(self, message: str) -> int:
         return int(self.input_str(message))
 
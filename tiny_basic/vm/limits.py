@@ -0,0 +1,59 @@
+import time
+
+from tiny_basic.errors import TinyBasicLimitException
+
+
+class ExecutionLimits:
+    """
+    Per-VM execution budget. Every limit is optional, None means unlimited.
+    Usage is counted from the last start(), which is called when the program is reset (RUN, RESET).
+    """
+    LIMIT_STEPS = 'STEPS'
+    LIMIT_TIME = 'TIME'
+    LIMIT_ARRAY_ELEMENTS = 'ARRAY ELEMENTS'
+    LIMIT_STRING_BYTES = 'STRING BYTES'
+
+    # The clock is only read every DEADLINE_CHECK_STEPS steps, counting is cheaper than reading the time
+    DEADLINE_CHECK_STEPS = 256
+
+    def __init__(self, max_steps: int or None = None, max_time: float or None = None,
+                 max_array_elements: int or None = None, max_string_bytes: int or None = None):
+        """
+        :param max_steps: maximum number of executed lines (and single line FOR loop iterations)
+        :param max_time: wall-clock seconds
+        :param max_array_elements: total number of elements in all variables
+        :param max_string_bytes: total length of all strings stored in variables
+        """
+        self.max_steps = max_steps
+        self.max_time = max_time
+        self.max_array_elements = max_array_elements
+        self.max_string_bytes = max_string_bytes
+        self.steps = 0
+        self.deadline = None
+        self.array_elements = 0
+        self.string_bytes = 0
+        self.start()
+
+    def start(self):
+        self.steps = 0
+        self.deadline = None if self.max_time is None else time.monotonic() + self.max_time
+        self.array_elements = 0
+        self.string_bytes = 0
+
+    def count_step(self):
+        self.steps += 1
+        if self.max_steps is not None and self.max_steps < self.steps:
+            raise TinyBasicLimitException(ExecutionLimits.LIMIT_STEPS, self.max_steps)
+        if self.deadline is not None and 0 == self.steps % ExecutionLimits.DEADLINE_CHECK_STEPS \
+                and self.deadline < time.monotonic():
+            raise TinyBasicLimitException(ExecutionLimits.LIMIT_TIME, self.max_time)
+
+    def allocate_elements(self, count: int):
+        if self.max_array_elements is not None and self.max_array_elements < self.array_elements + count:
+            raise TinyBasicLimitException(ExecutionLimits.LIMIT_ARRAY_ELEMENTS, self.max_array_elements)
+        self.array_elements += count
+
+    def allocate_string(self, size: int):
+        if self.max_string_bytes is not None and self.max_string_bytes < self.string_bytes + size:
+            raise TinyBasicLimitException(ExecutionLimits.LIMIT_STRING_BYTES, self.max_string_bytes)
+        self.string_bytes += size
@@ -0,0 +1,121 @@
+from array import array
+
+from tiny_basic.errors import TinyBasicException
+from tiny_basic.lexer import TinyBasicToken, TinyBasicTokenType, TinyBasicStatement, TinyBasicKeyword, \
+    TinyBasicBoolOperator
+from tiny_basic.lexer.functions import TinyBasicFunction
+from .binary_io import to_little_endian
+from .snapshot import SnapshotReader, SnapshotWriter
+from .text import SourceText
+
+# Tokenized program file: magic and format version, the distinct tokens of the program, then the lines.
+# Every line has its source text for LIST and its tokens as indexes into the token table, with their positions.
+# Lines with a syntax error have no tokens, they are lexed when executed.
+PROGRAM_FILE_MAGIC = b'TBPG'
+PROGRAM_FILE_VERSION = 1
+
+_TOKEN_TYPES = list(TinyBasicTokenType)
+# Token values stored by the name of their enum member
+_ENUM_VALUES = {
+    TinyBasicTokenType.STATEMENT: TinyBasicStatement,
+    TinyBasicTokenType.KEYWORD: TinyBasicKeyword,
+    TinyBasicTokenType.FUNCTION: TinyBasicFunction,
+    TinyBasicTokenType.BOOL_OPERATOR: TinyBasicBoolOperator
+}
+
+
+def is_program_file(file_name: str) -> bool:
+    with open(file_name, 'rb') as f:
+        return f.read(len(PROGRAM_FILE_MAGIC)) == PROGRAM_FILE_MAGIC
+
+
+def write_program_file(file_name: str, text: SourceText):
+    """
+    Store the program in the tokenized format, the lines are tokenized once when they are not yet cached
+    :param file_name: output file
+    :param text: program to store
+    """
+    token_table: dict[tuple, int] = {}
+    lines = []
+    token_counts = array('Q')
+    token_indexes = array('Q')
+    positions = array('Q')
+    for line_number in text.get_line_table():
+        line = text.text[line_number]
+        tokens = text.get_tokens(line) or []
+        lines.append((line_number, line))
+        token_counts.append(len(tokens))
+        for token, pos in tokens:
+            key = (token.type, token.value)
+            index = token_table.get(key)
+            if index is None:
+                index = len(token_table)
+                token_table[key] = index
+            token_indexes.append(index)
+            positions.append(pos)
+    with open(file_name, 'wb') as f:
+        writer = SnapshotWriter(f)
+        f.write(PROGRAM_FILE_MAGIC)
+        writer.write_u8(PROGRAM_FILE_VERSION)
+        writer.write_u64(len(token_table))
+        for token_type, value in token_table:
+            writer.write_u8(_TOKEN_TYPES.index(token_type))
+            writer.write_value(value.name if token_type in _ENUM_VALUES else value)
+        writer.write_u64(len(lines))
+        for line_number, line in lines:
+            writer.write_value(line_number)
+            writer.write_str(line)
+        f.write(to_little_endian(token_counts))
+        writer.write_u64(len(token_indexes))
+        f.write(to_little_endian(token_indexes))
+        f.write(to_little_endian(positions))
+
+
+def read_program_file(file_name: str, text: SourceText) -> int:
+    """
+    Replace the program with a tokenized program file, the tokens go into the token cache without lexing
+    :param file_name: program file
+    :param text: program to replace
+    :return: number of lines
+    """
+    with open(file_name, 'rb') as f:
+        reader = SnapshotReader(f, file_name)
+        if reader.read(len(PROGRAM_FILE_MAGIC)) != PROGRAM_FILE_MAGIC:
+            raise TinyBasicException(f'NOT A PROGRAM FILE: {file_name}')
+        version = reader.read_u8()
+        if version != PROGRAM_FILE_VERSION:
+            raise TinyBasicException(f'UNSUPPORTED PROGRAM FILE VERSION {version}: {file_name}')
+        token_table = []
+        for _ in range(reader.read_u64()):
+            token_type = reader.read_u8()
+            if len(_TOKEN_TYPES) <= token_type:
+                raise TinyBasicException(f'CORRUPT PROGRAM FILE: {file_name}')
+            token_type = _TOKEN_TYPES[token_type]
+            value = reader.read_value()
+            if token_type in _ENUM_VALUES:
+                if value not in _ENUM_VALUES[token_type].__members__:
+                    raise TinyBasicException(f'CORRUPT PROGRAM FILE: {file_name}')
+                value = _ENUM_VALUES[token_type][value]
+            token_table.append(TinyBasicToken(token_type, value))
+        lines = []
+        for _ in range(reader.read_u64()):
+            line_number = reader.read_value()
+            lines.append((line_number, reader.read_str()))
+        token_counts = reader.read_raw_array('Q', len(lines))
+        token_count = reader.read_u64()
+        token_indexes = reader.read_raw_array('Q', token_count)
+        positions = reader.read_raw_array('Q', token_count)
+    # The tokens are shared between the lines, like the tokens of the same line text are shared between runs
+    try:
+        tokens = list(zip(map(token_table.__getitem__, token_indexes), positions))
+    except IndexError:
+        raise TinyBasicException(f'CORRUPT PROGRAM FILE: {file_name}')
+    program = {}
+    start = 0
+    for (line_number, line), count in zip(lines, token_counts):
+        program[line_number] = line
+        if count:
+            text.tokens.setdefault(line, tokens[start:start + count])
+        start += count
+    text.replace_text(program)
+    return len(lines)
@@ -0,0 +1,77 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from tiny_basic.lexer import tokenize_source_line
+from .text import SourceText
+
+# Source lines tokenized together, by the loader or by one task of the process pool
+LOAD_CHUNK_LINES = 4096
+# Files from this size on are tokenized by a process pool when the number of workers is not given
+PARALLEL_LOAD_BYTES = 16 * 1024 * 1024
+
+
+def tokenize_chunk(lines: list[str]) -> list[tuple]:
+    """
+    :return: the results of tokenize_source_line for the lines that are not blank
+    """
+    return [tokenize_source_line(line) for line in lines if len(line.strip()) != 0]
+
+
+def read_chunks(f, chunk_lines: int, counter: list[int]):
+    """
+    Stream a source file in chunks of lines
+    :param counter: the number of lines read is added to its first element
+    """
+    while True:
+        chunk = list(islice(f, chunk_lines))
+        if not chunk:
+            return
+        counter[0] += len(chunk)
+        yield chunk
+
+
+def tokenize_chunks_in_pool(chunks, workers: int):
+    """
+    Tokenize the chunks in a process pool, in order.
+    At most two chunks per worker are in flight, so the memory used does not grow with the file.
+    """
+    with ProcessPoolExecutor(workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append((chunk, pool.submit(tokenize_chunk, chunk)))
+            if 2 * workers <= len(pending):
+                yield chunk_result(*pending.popleft())
+        while pending:
+            yield chunk_result(*pending.popleft())
+
+
+def chunk_result(chunk: list[str], future) -> list[tuple]:
+    try:
+        return future.result()
+    except Exception:
+        # Syntax errors do not survive the trip back from the worker, the chunk is tokenized again for the error
+        return tokenize_chunk(chunk)
+
+
+def load_program(file_name: str, text: SourceText, workers: int or None = None,
+                 chunk_lines: int = LOAD_CHUNK_LINES) -> int:
+    """
+    Replace the program with a source file. The file is streamed and every line is lexed once, into its stored
+    form and its tokens, so the load time grows linearly with the size of the file.
+    :param file_name: source file
+    :param text: program to replace
+    :param workers: size of the process pool tokenizing the chunks, 0 tokenizes in this process, None decides by
+        the file size
+    :param chunk_lines: number of lines tokenized together
+    :return: number of lines read
+    """
+    if workers is None:
+        workers = (os.cpu_count() or 1) if PARALLEL_LOAD_BYTES <= os.path.getsize(file_name) else 0
+    counter = [0]
+    with open(file_name) as f:
+        chunks = read_chunks(f, chunk_lines, counter)
+        tokenized = tokenize_chunks_in_pool(chunks, workers) if 1 < workers else map(tokenize_chunk, chunks)
+        text.set_lines(line for chunk in tokenized for line in chunk)
+    return counter[0]
@@ -0,0 +1,41 @@
+from collections import deque
+
+from tiny_basic.errors import TinyBasicInputPendingException
+from .io import AbstractIo
+
+
+class QueuedIo(AbstractIo):
+    """
+    Non-blocking IO: input lines are fed by the host, output is collected until the host takes it.
+    Reading without queued input raises TinyBasicInputPendingException, so a scheduled VM can be parked.
+    """
+    def __init__(self):
+        self.inputs = deque()
+        self.output = []
+        self.prompted = False
+
+    def feed(self, line: str):
+        self.inputs.append(line)
+
+    def take_output(self) -> str:
+        result = ''.join(self.output)
+        self.output = []
+        return result
+
+    def has_input(self) -> bool:
+        return 0 < len(self.inputs)
+
+    def input_str(self, message: str or None = None) -> str:
+        # The prompt is shown once, before waiting, and not again when the INPUT is resumed
+        if message is not None and not self.prompted:
+            self.output.append(message)
+        if not self.inputs:
+            self.prompted = True
+            raise TinyBasicInputPendingException()
+        self.prompted = False
+        return self.inputs.popleft()
+
+    def print_msg(self, message: str, new_line: bool = True):
+        self.output.append(message)
+        if new_line:
+            self.output.append('\n')
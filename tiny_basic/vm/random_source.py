@@ -0,0 +1,63 @@
+import copy
+import random
+
+from tiny_basic.errors import TinyBasicException
+
+# Values drawn from the generator at once by RND
+RANDOM_BLOCK_SIZE = 256
+# Larger ranges are drawn one by one, a float does not spread over them evenly
+_BLOCK_RANGE_LIMIT = 1 << 32
+
+
+class RandomSource:
+    """
+    Random number generator of a VM, VMs do not share their state.
+    RND takes its numbers from a block of values drawn from the generator at once, the block is refilled when it is
+    used up. The same seed gives the same numbers.
+    """
+    def __init__(self, seed=None):
+        self.random = random.Random(seed)
+        self.block: list[float] = []
+        self.seeded = seed is not None
+
+    def seed(self, seed=None):
+        """
+        :param seed: int, float or str, None seeds from the system
+        """
+        self.random.seed(seed)
+        self.block.clear()
+        self.seeded = seed is not None
+
+    def clone(self) -> 'RandomSource':
+        """
+        :return: a copy continuing with the same numbers when seeded, an independent generator otherwise
+        """
+        if not self.seeded:
+            return RandomSource()
+        return copy.deepcopy(self)
+
+    def get_state(self) -> tuple:
+        """
+        :return: the state of the generator, the values left in the block and the seeded flag, see set_state
+        """
+        return self.random.getstate(), list(self.block), self.seeded
+
+    def set_state(self, state: tuple, block: list[float], seeded: bool):
+        """
+        Continue with the numbers of a stored state
+        :raise TypeError, ValueError: when the state is not a state of the generator
+        """
+        self.random.setstate(state)
+        self.block = block
+        self.seeded = seeded
+
+    def randrange(self, begin: int, end: int) -> int:
+        if end <= begin:
+            raise TinyBasicException(f'EMPTY RANGE FOR RND: {begin}..{end}')
+        if _BLOCK_RANGE_LIMIT < end - begin:
+            return self.random.randrange(begin, end)
+        block = self.block
+        if not block:
+            draw = self.random.random
+            block.extend([draw() for _ in range(RANDOM_BLOCK_SIZE)])
+        return begin + int(block.pop() * (end - begin))
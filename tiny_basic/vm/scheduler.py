@@ -0,0 +1,160 @@
+import time
+from collections import deque
+
+from tiny_basic.errors import TinyBasicException, TinyBasicInputPendingException, TinyBasicRunStopException
+from .abstract_vm import AbstractVM
+
+
+class ScheduledTask:
+    STATE_READY = 'READY'
+    STATE_WAITING = 'WAITING FOR INPUT'
+    STATE_DONE = 'DONE'
+    STATE_FAILED = 'FAILED'
+
+    def __init__(self, vm: AbstractVM, quantum: int):
+        self.vm = vm
+        self.quantum = quantum
+        self.state = ScheduledTask.STATE_READY
+        self.error: Exception or None = None
+        self.steps = 0
+        self.slices = 0
+        self.busy_time = 0.0
+        self.max_slice_time = 0.0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.ready_since = time.perf_counter()
+
+    def is_finished(self) -> bool:
+        return self.state == ScheduledTask.STATE_DONE or self.state == ScheduledTask.STATE_FAILED
+
+    def run_slice(self) -> int:
+        """
+        Execute at most quantum lines of the program, update the state and the statistics
+        :return: number of lines executed
+        """
+        start = time.perf_counter()
+        wait = start - self.ready_since
+        self.wait_time += wait
+        self.max_wait_time = max(self.max_wait_time, wait)
+        steps = 0
+        context = self.vm.context
+        try:
+            while steps < self.quantum:
+                if not context.step(self.vm.execute, self.vm.compile):
+                    self.finish()
+                    break
+                steps += 1
+        except TinyBasicInputPendingException:
+            # context.step keeps the rest of the line, it continues at the INPUT statement once input arrives
+            self.state = ScheduledTask.STATE_WAITING
+        except TinyBasicRunStopException:
+            self.finish()
+        except Exception as e:
+            # A failing program only stops its own VM, never the scheduler
+            self.state = ScheduledTask.STATE_FAILED
+            self.error = e
+            self.vm.finish_run()
+        end = time.perf_counter()
+        self.steps += steps
+        self.slices += 1
+        self.busy_time += end - start
+        self.max_slice_time = max(self.max_slice_time, end - start)
+        self.ready_since = end
+        return steps
+
+    def finish(self):
+        self.state = ScheduledTask.STATE_DONE
+        self.vm.finish_run()
+        self.vm.io.print_msg("DONE.")
+
+    def stats(self) -> dict:
+        return {
+            'state': self.state,
+            'steps': self.steps,
+            'slices': self.slices,
+            'busy_time': self.busy_time,
+            'max_slice_time': self.max_slice_time,
+            'avg_wait_time': self.wait_time / self.slices if 0 < self.slices else 0.0,
+            'max_wait_time': self.max_wait_time
+        }
+
+
+class Scheduler:
+    """
+    Cooperative round-robin scheduler: every ready VM executes a quantum of program lines in turn.
+    VMs waiting for input are parked until their io reports available input.
+    """
+    def __init__(self, quantum: int = 100):
+        if quantum < 1:
+            raise TinyBasicException(f'QUANTUM MUST BE POSITIVE, NOT {quantum}')
+        self.quantum = quantum
+        self.tasks: list[ScheduledTask] = []
+        self.ready: deque[ScheduledTask] = deque()
+        self.parked: list[ScheduledTask] = []
+
+    def add(self, vm: AbstractVM, quantum: int or None = None, reset: bool = True) -> ScheduledTask:
+        """
+        Schedule the program loaded into the VM
+        :param vm: VM with the program text
+        :param quantum: lines executed per turn, the scheduler default when None
+        :param reset: start the program from the beginning, like RUN
+        :return: the task tracking the VM
+        """
+        if reset:
+            vm.reset()
+        task = ScheduledTask(vm, self.quantum if quantum is None else quantum)
+        self.tasks.append(task)
+        self.ready.append(task)
+        return task
+
+    def remove(self, task: ScheduledTask):
+        self.tasks.remove(task)
+        if task in self.ready:
+            self.ready.remove(task)
+        if task in self.parked:
+            self.parked.remove(task)
+
+    def wake_up(self):
+        still_parked = []
+        for task in self.parked:
+            if task.vm.io.has_input():
+                task.state = ScheduledTask.STATE_READY
+                task.ready_since = time.perf_counter()
+                self.ready.append(task)
+            else:
+                still_parked.append(task)
+        self.parked = still_parked
+
+    def run_round(self) -> int:
+        """
+        Give one turn to each VM that is ready at the start of the round
+        :return: number of lines executed in the round
+        """
+        self.wake_up()
+        steps = 0
+        for _ in range(len(self.ready)):
+            task = self.ready.popleft()
+            steps += task.run_slice()
+            if task.state == ScheduledTask.STATE_READY:
+                self.ready.append(task)
+            elif task.state == ScheduledTask.STATE_WAITING:
+                self.parked.append(task)
+        return steps
+
+    def run(self, max_rounds: int or None = None) -> int:
+        """
+        Run rounds until every VM is finished or parked
+        :param max_rounds: stop after this many rounds when not None
+        :return: number of lines executed
+        """
+        steps = 0
+        rounds = 0
+        while max_rounds is None or rounds < max_rounds:
+            steps += self.run_round()
+            rounds += 1
+            if not self.ready:
+                break
+        return steps
+
+    def stats(self) -> list[dict]:
+        return [task.stats() for task in self.tasks]
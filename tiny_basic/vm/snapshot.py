@@ -0,0 +1,263 @@
+import marshal
+import math
+import struct
+from array import array
+
+from tiny_basic.errors import TinyBasicException
+from .binary_io import to_little_endian
+from .variable import Variable, MapVariable
+from .random_source import RandomSource
+from .user_function import UserFunction
+
+# VM snapshot file: magic and format version, then the program text, the context, the variables, the user
+# functions and the random generator. Array contents are stored with marshal, the other values as tagged values.
+SNAPSHOT_MAGIC = b'TBVM'
+SNAPSHOT_VERSION = 1
+
+_U8 = struct.Struct('<B')
+_U64 = struct.Struct('<Q')
+_I64 = struct.Struct('<q')
+_F64 = struct.Struct('<d')
+
+_TAG_NONE = b'n'
+_TAG_INT = b'i'
+_TAG_BIG_INT = b'I'
+_TAG_FLOAT = b'f'
+_TAG_STR = b's'
+_TAG_BOOL = b'b'
+_TAG_TUPLE = b't'
+
+# Kind of a stored variable
+_VARIABLE_ARRAY = b'A'
+_VARIABLE_MAP = b'M'
+_VARIABLE_SHAPED_ARRAY = b'D'
+
+
+class SnapshotWriter:
+    def __init__(self, f):
+        self.f = f
+
+    def write_u8(self, value: int):
+        self.f.write(_U8.pack(value))
+
+    def write_u64(self, value: int):
+        self.f.write(_U64.pack(value))
+
+    def write_str(self, value: str):
+        data = value.encode()
+        self.write_u64(len(data))
+        self.f.write(data)
+
+    def write_value(self, value):
+        # bool is tested first, it is a subclass of int
+        if value is None:
+            self.f.write(_TAG_NONE)
+        elif isinstance(value, bool):
+            self.f.write(_TAG_BOOL)
+            self.write_u8(int(value))
+        elif isinstance(value, int):
+            if -2 ** 63 <= value < 2 ** 63:
+                self.f.write(_TAG_INT)
+                self.f.write(_I64.pack(value))
+            else:
+                self.f.write(_TAG_BIG_INT)
+                self.write_str(str(value))
+        elif isinstance(value, float):
+            self.f.write(_TAG_FLOAT)
+            self.f.write(_F64.pack(value))
+        elif isinstance(value, str):
+            self.f.write(_TAG_STR)
+            self.write_str(value)
+        elif isinstance(value, tuple):
+            self.f.write(_TAG_TUPLE)
+            self.write_u64(len(value))
+            for item in value:
+                self.write_value(item)
+        else:
+            raise TinyBasicException(f'CAN NOT SNAPSHOT VALUE: {value}')
+
+    def write_array(self, values: list):
+        # marshal stores the elements with their exact types, bool and big integers included, in one pass in C
+        try:
+            data = marshal.dumps(values)
+        except ValueError:
+            raise TinyBasicException('CAN NOT SNAPSHOT ARRAY')
+        self.write_u64(len(data))
+        self.f.write(data)
+
+
+class SnapshotReader:
+    def __init__(self, f, file_name: str):
+        self.f = f
+        self.file_name = file_name
+
+    def read(self, size: int) -> bytes:
+        data = self.f.read(size)
+        if len(data) != size:
+            raise TinyBasicException(f'TRUNCATED SNAPSHOT: {self.file_name}')
+        return data
+
+    def read_u8(self) -> int:
+        return _U8.unpack(self.read(_U8.size))[0]
+
+    def read_u64(self) -> int:
+        return _U64.unpack(self.read(_U64.size))[0]
+
+    def read_str(self) -> str:
+        return self.read(self.read_u64()).decode()
+
+    def read_value(self):
+        tag = self.read(1)
+        if tag == _TAG_NONE:
+            return None
+        if tag == _TAG_BOOL:
+            return bool(self.read_u8())
+        if tag == _TAG_INT:
+            return _I64.unpack(self.read(_I64.size))[0]
+        if tag == _TAG_BIG_INT:
+            return int(self.read_str())
+        if tag == _TAG_FLOAT:
+            return _F64.unpack(self.read(_F64.size))[0]
+        if tag == _TAG_STR:
+            return self.read_str()
+        if tag == _TAG_TUPLE:
+            return tuple(self.read_value() for _ in range(self.read_u64()))
+        raise TinyBasicException(f'CORRUPT SNAPSHOT: {self.file_name}')
+
+    def read_raw_array(self, typecode: str, dim: int) -> array:
+        data = array(typecode, [0]) * dim
+        if self.f.readinto(memoryview(data).cast('B')) != dim * data.itemsize:
+            raise TinyBasicException(f'TRUNCATED SNAPSHOT: {self.file_name}')
+        return to_little_endian(data)
+
+    def read_array(self, dim: int) -> list:
+        try:
+            values = marshal.loads(self.read(self.read_u64()))
+        except (ValueError, EOFError, TypeError):
+            values = None
+        if not (isinstance(values, list) and len(values) == dim):
+            raise TinyBasicException(f'CORRUPT SNAPSHOT: {self.file_name}')
+        return values
+
+
+def write_snapshot(vm, file_name: str, ip: int):
+    """
+    Store the program text, the execution context and the variables of a VM.
+    Open file channels are not part of the snapshot.
+    :param vm: AbstractVM to store
+    :param file_name: output file
+    :param ip: the line to continue with after restore
+    """
+    with open(file_name, 'wb') as f:
+        writer = SnapshotWriter(f)
+        f.write(SNAPSHOT_MAGIC)
+        writer.write_u8(SNAPSHOT_VERSION)
+        writer.write_u64(len(vm.text.text))
+        for line_number, line in vm.text.text.items():
+            writer.write_value(line_number)
+            writer.write_str(line)
+        context = vm.context
+        writer.write_value(ip)
+        writer.write_value(context.trace)
+        writer.write_value(context.resume)
+        writer.write_value(tuple(context.stack))
+        writer.write_u64(len(vm.variables.variables))
+        for var in vm.variables.variables.values():
+            writer.write_str(var.name)
+            writer.write_str(var.base_type)
+            if isinstance(var, MapVariable):
+                f.write(_VARIABLE_MAP)
+                writer.write_u64(var.dim)
+                writer.write_array(list(var.value.keys()))
+                writer.write_array(list(var.value.values()))
+            elif var.shape is not None:
+                f.write(_VARIABLE_SHAPED_ARRAY)
+                writer.write_u64(var.dim)
+                writer.write_value(var.shape)
+                writer.write_array(var.value)
+            else:
+                f.write(_VARIABLE_ARRAY)
+                writer.write_u64(var.dim)
+                writer.write_array(var.value)
+        # User functions by their source, they are compiled again after restore
+        writer.write_u64(len(vm.user_functions))
+        for function in vm.user_functions.values():
+            writer.write_str(function.name)
+            writer.write_value(tuple(function.parameters))
+            writer.write_str(function.source)
+            writer.write_u64(function.cache_size)
+        # RND continues with the same numbers after restore
+        state, block, seeded = vm.random.get_state()
+        writer.write_value(state)
+        writer.write_u64(len(block))
+        writer.write_array(block)
+        writer.write_value(seeded)
+
+
+def read_snapshot(vm, file_name: str):
+    """
+    Replace the program text, the execution context and the variables of a VM with a stored snapshot
+    :param vm: AbstractVM to restore into
+    :param file_name: snapshot file
+    """
+    with open(file_name, 'rb') as f:
+        reader = SnapshotReader(f, file_name)
+        if reader.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise TinyBasicException(f'NOT A SNAPSHOT: {file_name}')
+        version = reader.read_u8()
+        if version != SNAPSHOT_VERSION:
+            raise TinyBasicException(f'UNSUPPORTED SNAPSHOT VERSION {version}: {file_name}')
+        text = {}
+        for _ in range(reader.read_u64()):
+            line_number = reader.read_value()
+            text[line_number] = reader.read_str()
+        ip = reader.read_value()
+        trace = reader.read_value()
+        resume = reader.read_value()
+        stack = list(reader.read_value())
+        variables = {}
+        for _ in range(reader.read_u64()):
+            name = reader.read_str()
+            base_type = reader.read_str()
+            kind = reader.read(1)
+            dim = reader.read_u64()
+            if kind == _VARIABLE_MAP:
+                keys = reader.read_array(dim)
+                variables[name] = MapVariable(name, base_type, dict(zip(keys, reader.read_array(dim))))
+            elif kind == _VARIABLE_ARRAY:
+                variables[name] = Variable(name, base_type, dim, reader.read_array(dim))
+            elif kind == _VARIABLE_SHAPED_ARRAY:
+                shape = reader.read_value()
+                if not (isinstance(shape, tuple) and all(isinstance(extent, int) for extent in shape)
+                        and math.prod(shape) == dim):
+                    raise TinyBasicException(f'CORRUPT SNAPSHOT: {file_name}')
+                variables[name] = Variable(name, base_type, dim, reader.read_array(dim), shape)
+            else:
+                raise TinyBasicException(f'CORRUPT SNAPSHOT: {file_name}')
+        user_functions = {}
+        for _ in range(reader.read_u64()):
+            name = reader.read_str()
+            parameters = reader.read_value()
+            if not (isinstance(parameters, tuple) and all(isinstance(parameter, str) for parameter in parameters)):
+                raise TinyBasicException(f'CORRUPT SNAPSHOT: {file_name}')
+            user_functions[name] = UserFunction(name, list(parameters), reader.read_str(), reader.read_u64())
+        random_source = RandomSource()
+        state = reader.read_value()
+        block = reader.read_array(reader.read_u64())
+        seeded = reader.read_value()
+        if not (all(isinstance(value, float) for value in block) and isinstance(seeded, bool)):
+            raise TinyBasicException(f'CORRUPT SNAPSHOT: {file_name}')
+        try:
+            random_source.set_state(state, block, seeded)
+        except (TypeError, ValueError):
+            raise TinyBasicException(f'CORRUPT SNAPSHOT: {file_name}')
+    vm.text.replace_text(text)
+    vm.context.reset(vm.text.get_line_table())
+    vm.context.ip = ip
+    vm.context.ip_next = ip
+    vm.context.trace = trace
+    vm.context.resume = resume
+    vm.context.stack = stack
+    vm.variables.variables = variables
+    vm.user_functions = user_functions
+    vm.random = random_source
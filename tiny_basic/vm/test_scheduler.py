@@ -0,0 +1,84 @@
+import unittest
+
+from ..interpreter_vm import TinyInterpreterVM
+from ..tiny_basic_terminal import exec_line
+from . import QueuedIo, Scheduler, ScheduledTask
+
+
+def load_vm(lines: list[str]) -> TinyInterpreterVM:
+    vm = TinyInterpreterVM(QueuedIo())
+    for line in lines:
+        exec_line(vm, line)
+    return vm
+
+
+class SchedulerTest(unittest.TestCase):
+    def test_round_robin(self):
+        scheduler = Scheduler(quantum=3)
+        busy = scheduler.add(load_vm(['10 GOTO 10']))
+        short = scheduler.add(load_vm(['10 a = 1', '20 a = a + 1', '30 PRINT a']))
+        self.assertEqual(6, scheduler.run_round())
+        self.assertEqual(ScheduledTask.STATE_READY, short.state)
+        scheduler.run(max_rounds=10)
+        self.assertEqual(ScheduledTask.STATE_DONE, short.state)
+        self.assertEqual('2\nDONE.\n', short.vm.io.take_output())
+        self.assertEqual(ScheduledTask.STATE_READY, busy.state)
+        self.assertEqual(33, busy.steps)
+        self.assertEqual(3, short.steps)
+
+    def test_input_parks_vm(self):
+        scheduler = Scheduler()
+        task = scheduler.add(load_vm(['10 INPUT "NAME"; n$', '20 PRINT "HELLO"; n$']))
+        scheduler.run()
+        self.assertEqual(ScheduledTask.STATE_WAITING, task.state)
+        self.assertEqual([task], scheduler.parked)
+        self.assertEqual(0, scheduler.run())
+        task.vm.io.feed('BOB')
+        scheduler.run()
+        self.assertEqual(ScheduledTask.STATE_DONE, task.state)
+        self.assertEqual('NAME?HELLO BOB\nDONE.\n', task.vm.io.take_output())
+        self.assertEqual(2, scheduler.stats()[0]['steps'])
+
+    def test_error_fails_task(self):
+        scheduler = Scheduler()
+        task = scheduler.add(load_vm(['10 RETURN']))
+        scheduler.run()
+        self.assertEqual(ScheduledTask.STATE_FAILED, task.state)
+        self.assertEqual('STACK IS EMPTY', task.error.msg)
+
+
+class SchedulerResumeTest(unittest.TestCase):
+    def test_input_resumes_at_statement(self):
+        scheduler = Scheduler()
+        task = scheduler.add(load_vm(['10 n = 0', '20 n = n + 1: PRINT "HI": INPUT "X"; a$: PRINT a$']))
+        scheduler.run()
+        task.vm.io.feed('YO')
+        scheduler.run()
+        self.assertEqual(ScheduledTask.STATE_DONE, task.state)
+        self.assertEqual('HI\nX?YO\nDONE.\n', task.vm.io.take_output())
+        self.assertEqual(1, task.vm.variables.read_num_var('n'))
+
+    def test_input_resume_keeps_jump(self):
+        scheduler = Scheduler()
+        task = scheduler.add(load_vm(['10 GOTO 30: INPUT "X"; a$', '20 PRINT "NO"', '30 PRINT a$']))
+        scheduler.run()
+        task.vm.io.feed('YES')
+        scheduler.run()
+        self.assertEqual('X?YES\nDONE.\n', task.vm.io.take_output())
+
+    def test_python_error_fails_only_its_task(self):
+        scheduler = Scheduler()
+        broken = scheduler.add(load_vm(['10 a = 1 / 0']))
+        bad_input = scheduler.add(load_vm(['10 INPUT "N"; n']))
+        healthy = scheduler.add(load_vm(['10 PRINT 1']))
+        bad_input.vm.io.feed('abc')
+        scheduler.run()
+        self.assertEqual(ScheduledTask.STATE_FAILED, broken.state)
+        self.assertIsInstance(broken.error, ZeroDivisionError)
+        self.assertEqual(ScheduledTask.STATE_FAILED, bad_input.state)
+        self.assertIsInstance(bad_input.error, ValueError)
+        self.assertEqual(ScheduledTask.STATE_DONE, healthy.state)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,98 @@
-from tiny_basic.lexer import TinyBasicLexer, TinyBasicTokenType
+import bisect
+
+from tiny_basic.lexer import TinyBasicLexer, TinyBasicTokenType, TinyBasicToken, TinyBasicStatement, tokenize_line, \
+    tokenize_source_line, TinyBasicKeyword
+from tiny_basic.lexer.syntax_error import TinyBasicSyntaxError
 from tiny_basic.errors import TinyBasicException
 
+# Statements opening a block, by the statement closing it, END stands for END IF
+_BLOCK_OPENERS = {
+    TinyBasicStatement.WEND: TinyBasicStatement.WHILE,
+    TinyBasicStatement.UNTIL: TinyBasicStatement.REPEAT,
+    TinyBasicStatement.END: TinyBasicStatement.IF
+}
+
 
 class SourceText:
     def __init__(self):
         self.text = {}
+        # Clones share the text and the derived data until one of them edits the program
+        self.shared = False
+        # Edits update the derived data of the edited line only, the line table and labels are kept up to date
+        self.version = 0
+        self.line_table = None
+        self.labels = None
+        self.line_labels: dict[int, str] or None = None
+        # Tokenized lines by line text, the key makes it safe to share between clones and across edits
+        self.tokens: dict[str, list[tuple[TinyBasicToken, int]]] = {}
+        # Compiled lines by line number, False for lines that can not be compiled.
+        # The closures belong to the VM that compiled them, clones compile their own.
+        self.compiled: dict[int, any] = {}
+        self.parked = None
+        # Results of the type inference at RUN, see set_types
+        self.runtime_checks: dict[str, frozenset[int]] or None = None
+        self.proven_lines: frozenset[str] = frozenset()
+        self.int_variables: frozenset[str] = frozenset()
+        # Dependency map of the inferred types: numeric variables read and written by each line,
+        # and the lines reading each variable
+        self.line_reads: dict[int, frozenset[str]] = {}
+        self.line_writes: dict[int, frozenset[str]] = {}
+        self.readers: dict[str, frozenset[int]] = {}
+        # Type checker results by line text, shared like the tokens
+        self.type_cache: dict[str, any] = {}
+        # Version of the program the types were inferred for, see check_program_types
+        self.types_version = None
+
+    def clone(self) -> 'SourceText':
+        result = SourceText()
+        result.text = self.text
+        result.version = self.version
+        result.line_table = self.line_table
+        result.labels = self.labels
+        result.line_labels = self.line_labels
+        result.tokens = self.tokens
+        result.runtime_checks = self.runtime_checks
+        result.proven_lines = self.proven_lines
+        result.int_variables = self.int_variables
+        result.line_reads = self.line_reads
+        result.line_writes = self.line_writes
+        result.readers = self.readers
+        result.type_cache = self.type_cache
+        result.types_version = self.types_version
+        result.shared = True
+        self.shared = True
+        return result
+
+    def modify(self):
+        """
+        Prepare for changing the program: take a private copy of shared text
+        """
+        if self.shared:
+            self.text = dict(self.text)
+            if self.line_labels is not None:
+                self.line_labels = dict(self.line_labels)
+            self.shared = False
 
     def reset(self):
-        self.text = {}
+        self.replace_text({})
+
+    def replace_text(self, text: dict[int, str]):
+        if self.text:
+            kept = set(text.values())
+            self.evict_lines(line for line in self.text.values() if line not in kept)
+        self.text = text
+        self.version += 1
+        self.compiled = {}
+        self.set_types(None, frozenset(), {}, {})
+        self.parked = None
+        self.shared = False
+        self.line_table = None
+        self.labels = None
+        self.line_labels = None
 
     def delete_text(self, line_number: int):
         if line_number in self.text:
-            self.text.pop(line_number)
+            self.update_line(line_number, None)
         else:
             raise TinyBasicException(f'Line number not defined: {line_number}')
 
@@ -25,37 +106,314 @@ class SourceText:
             while not lexer.looks_like(TinyBasicTokenType.THE_END):
                 token = lexer.next().to_src()
                 line.append(token)
-            text = " ".join(line)
-            self.text[line_number] = text
+            self.update_line(line_number, " ".join(line))
+
+    def update_line(self, line_number: int, line: str or None):
+        """
+        Replace or delete (line is None) a line, and invalidate the data derived from it and its dependents
+        """
+        self.modify()
+        is_new = line_number not in self.text
+        if not is_new and self.text[line_number] != line:
+            self.evict_lines([self.text[line_number]])
+        if line is None:
+            self.text.pop(line_number)
+        else:
+            self.text[line_number] = line
+        self.version += 1
+        self.compiled.pop(line_number, None)
+        if self.parked is not None:
+            self.parked[0].pop(line_number, None)
+        if self.line_table is not None and (is_new or line is None):
+            line_table = list(self.line_table)
+            if line is None:
+                line_table.remove(line_number)
+            else:
+                bisect.insort(line_table, line_number)
+            self.line_table = line_table
+        if self.line_labels is not None:
+            label = None if line is None else self.find_label(line)
+            if label != self.line_labels.get(line_number):
+                self.line_labels.pop(line_number, None)
+                if label is not None:
+                    self.line_labels[line_number] = label
+                self.labels = None
+        self.invalidate_types(line_number, line)
+
+    def invalidate_types(self, line_number: int, line: str or None):
+        """
+        Keep the inferred types valid after an edit. The variables the line wrote or may write now are no longer
+        known integers, neither are the variables written by the lines reading them, transitively.
+        The lines reading a demoted variable lose their proven checks and their compiled form.
+        """
+        if self.runtime_checks is None:
+            return
+        affected = set(self.line_writes.get(line_number, ()))
+        names = frozenset()
+        if line is not None:
+            tokens = self.get_tokens(line)
+            if tokens is None or any(token.type == TinyBasicTokenType.STATEMENT and
+                                     token.value == TinyBasicStatement.RESTORE for token, _ in tokens):
+                self.clear_types()
+                return
+            names = frozenset(token.value.upper() for token, _ in tokens
+                              if token.type == TinyBasicTokenType.IDENTIFIER and not token.value.endswith('$'))
+            affected.update(names)
+        demoted = set()
+        dependents = set()
+        pending = list(affected)
+        while pending:
+            name = pending.pop()
+            if name in demoted or name not in self.int_variables:
+                continue
+            demoted.add(name)
+            for reader in self.readers.get(name, ()):
+                if reader not in dependents:
+                    dependents.add(reader)
+                    pending.extend(self.line_writes.get(reader, ()))
+        runtime_checks = dict(self.runtime_checks)
+        for dependent in dependents:
+            self.compiled.pop(dependent, None)
+            if dependent in self.text:
+                runtime_checks.pop(self.text[dependent], None)
+        line_reads = dict(self.line_reads)
+        line_writes = dict(self.line_writes)
+        line_reads[line_number] = names
+        line_writes[line_number] = names
+        self.set_types(runtime_checks, self.int_variables - demoted, line_reads, line_writes, keep_compiled=True)
 
     def set_text(self, lines: list[str]):
+        self.set_lines(tokenize_source_line(line) for line in lines if len(line.strip()) != 0)
+
+    def set_lines(self, lines):
+        """
+        Replace the program with tokenized source lines, their tokens go into the token cache
+        :param lines: iterable of the results of tokenize_source_line, lines without number follow the previous by 10
+        """
+        text = {}
         line_number = 0
-        self.text = {}
+        for source_line_number, line, tokens in lines:
+            line_number = line_number + 10 if source_line_number is None else source_line_number
+            if line is None:
+                if line_number not in text:
+                    raise TinyBasicException(f'Line number not defined: {line_number}')
+                del text[line_number]
+            else:
+                text[line_number] = line
+                self.tokens.setdefault(line, tokens)
+        self.replace_text(text)
+
+    def evict_lines(self, lines):
+        """
+        Drop the cached data of replaced line texts, the caches are keyed by text and would grow with every edit.
+        A line with the same text elsewhere in the program is lexed again on its next use.
+        """
         for line in lines:
-            if len(line.strip()) == 0:
-                continue
-            lexer = TinyBasicLexer(line)
-            if not lexer.has_line_number:
-                line_number = line_number + 10
+            self.tokens.pop(line, None)
+            self.type_cache.pop(line, None)
+
+    def get_tokens(self, line: str) -> list[tuple[TinyBasicToken, int]] or None:
+        """
+        :return: the tokenized line, None when it has a syntax error, then it is lexed during execution
+        """
+        tokens = self.tokens.get(line)
+        if tokens is None:
+            try:
+                tokens = tokenize_line(line)
+            except TinyBasicSyntaxError:
+                return None
+            self.tokens[line] = tokens
+        return tokens
+
+    def set_types(self, runtime_checks: dict[str, frozenset[int]] or None, int_variables: frozenset[str],
+                  line_reads: dict[int, frozenset[str]], line_writes: dict[int, frozenset[str]],
+                  keep_compiled: bool = False):
+        """
+        Store the results of the type inference.
+        Compiled lines are kept when their checks and the integer variables they read did not change.
+        :param runtime_checks: positions of the type checks the evaluator still has to do, by line text.
+            The lines not in it, and every line when it is None, keep all their checks.
+        :param int_variables: numeric variables that only hold integers
+        :param line_reads: numeric variables read by each line
+        :param line_writes: numeric variables written by each line
+        :param keep_compiled: the caller already dropped the compiled lines affected by the change
+        """
+        if not keep_compiled:
+            if runtime_checks is None and self.runtime_checks is not None:
+                # Direct commands clear the types before RUN infers them again, the compiled lines are parked
+                # and taken back by the next inference with the same results for their line
+                self.parked = (self.compiled, self.runtime_checks, self.int_variables, self.line_reads)
+                self.compiled = {}
             else:
-                line_number = lexer.line_number
-            self.edit_text(lexer, line_number)
+                compiled, *old_types = self.parked or (self.compiled, self.runtime_checks, self.int_variables,
+                                                       self.line_reads)
+                new_types = (runtime_checks, int_variables, line_reads)
+                self.compiled = {line_number: code for line_number, code in compiled.items()
+                                 if self.same_types(line_number, old_types, new_types)}
+                self.parked = None
+        if line_reads is not self.line_reads:
+            readers = {}
+            for line_number, names in line_reads.items():
+                for name in names:
+                    readers.setdefault(name, set()).add(line_number)
+            self.readers = readers
+        self.runtime_checks = runtime_checks
+        self.proven_lines = frozenset() if runtime_checks is None else \
+            frozenset(line for line, checks in runtime_checks.items() if not checks)
+        self.int_variables = int_variables
+        self.line_reads = line_reads
+        self.line_writes = line_writes
+
+    def same_types(self, line_number: int, old_types: tuple, new_types: tuple) -> bool:
+        """
+        :param old_types: runtime checks, integer variables and variables read by line when the line was compiled
+        :param new_types: the same for the new inference results
+        :return: the compiled line is valid with the new results
+        """
+        line = self.text.get(line_number)
+        if line is None:
+            return False
+        old_checks, old_int_variables, old_reads = old_types
+        new_checks, new_int_variables, new_reads = new_types
+        if (None if old_checks is None else old_checks.get(line)) != \
+                (None if new_checks is None else new_checks.get(line)):
+            return False
+        return old_reads.get(line_number, frozenset()) & old_int_variables == \
+            new_reads.get(line_number, frozenset()) & new_int_variables
+
+    def clear_types(self):
+        """
+        Drop the inferred types when the program or its variables change outside the analyzed program
+        """
+        if self.runtime_checks is not None:
+            self.set_types(None, frozenset(), {}, {})
+
+    def reset_types(self):
+        """
+        Drop the inferred types, the cached type checker results and the compiled lines, when the native functions
+        change. Clones keep the cache they share.
+        """
+        self.clear_types()
+        self.type_cache = {}
+        self.types_version = None
+        self.compiled = {}
+        self.parked = None
+
+    def get_runtime_checks(self, line: str) -> frozenset[int] or None:
+        """
+        :return: positions of the type checks of the line, None when every check has to be done
+        """
+        if self.runtime_checks is None:
+            return None
+        return self.runtime_checks.get(line)
+
+    def compile_line(self, line_number: int, fn_compile):
+        """
+        :param fn_compile: compiles a line into a closure, None when the line has no compiled form
+        :return: the closure or False
+        """
+        code = fn_compile(self.text[line_number]) or False
+        self.compiled[line_number] = code
+        return code
 
     def get_line_table(self) -> list[int]:
-        return sorted(self.text.keys())
+        if self.line_table is None:
+            self.line_table = sorted(self.text.keys())
+        return self.line_table
 
     def get_labels(self) -> dict[str, int]:
+        if self.line_labels is None:
+            self.line_labels = self.find_labels()
+            self.labels = None
+        if self.labels is None:
+            # The last line defining a label wins
+            labels = {}
+            for line_number in self.text:
+                label = self.line_labels.get(line_number)
+                if label is not None:
+                    labels[label] = line_number
+            self.labels = labels
+        return self.labels
+
+    def find_labels(self) -> dict[int, str]:
+        """
+        :return: the labels by line number
+        """
         result = {}
         for line_number in self.text:
-            line = self.text[line_number]
-            lexer = TinyBasicLexer(line)
-            if lexer.looks_like(TinyBasicTokenType.IDENTIFIER):
-                label = lexer.expect(TinyBasicTokenType.IDENTIFIER)
-                if lexer.looks_like(TinyBasicTokenType.COLON):
-                    lexer.expect(TinyBasicTokenType.COLON)
-                    result[label] = line_number
+            label = self.find_label(self.text[line_number])
+            if label is not None:
+                result[line_number] = label
         return result
 
+    def find_label(self, line: str) -> str or None:
+        lexer = TinyBasicLexer(line, self.get_tokens(line))
+        if lexer.looks_like(TinyBasicTokenType.IDENTIFIER):
+            label = lexer.expect(TinyBasicTokenType.IDENTIFIER)
+            if lexer.looks_like(TinyBasicTokenType.COLON):
+                return label
+        return None
+
+    def block_statement(self, line_number: int) -> TinyBasicStatement or TinyBasicKeyword or None:
+        """
+        :return: the block statement starting the line: WHILE, WEND, REPEAT, UNTIL, IF for a line ending with THEN,
+            ELSE and END for END IF. None for other lines and lines with a syntax error.
+        """
+        line = self.text.get(line_number)
+        tokens = None if line is None else self.get_tokens(line)
+        if not tokens:
+            return None
+        first = tokens[0][0]
+        if first.type == TinyBasicTokenType.KEYWORD and first.value == TinyBasicKeyword.ELSE:
+            return TinyBasicKeyword.ELSE
+        if first.type != TinyBasicTokenType.STATEMENT:
+            return None
+        if first.value == TinyBasicStatement.IF:
+            last = tokens[-2][0]
+            is_block = last.type == TinyBasicTokenType.KEYWORD and last.value == TinyBasicKeyword.THEN
+            return TinyBasicStatement.IF if is_block else None
+        if first.value == TinyBasicStatement.END:
+            second = tokens[1][0]
+            is_block = second.type == TinyBasicTokenType.STATEMENT and second.value == TinyBasicStatement.IF
+            return TinyBasicStatement.END if is_block else None
+        return first.value if first.value in _BLOCK_OPENERS or first.value in _BLOCK_OPENERS.values() else None
+
+    def find_blocks(self, line_tab: list[int]) -> dict[int, int]:
+        """
+        Match the block statements in one pass over the program. They have to start their line.
+        :param line_tab: line table the IPs refer to
+        :return: jump targets by IP: after its WEND for a WHILE, its WHILE for a WEND, its UNTIL for a REPEAT,
+            after its REPEAT for an UNTIL, after its ELSE or else its END IF for an IF, after its END IF for an ELSE
+            and after itself for an END IF. Unmatched statements have no target.
+        """
+        targets = {}
+        # Statement, IP and the IP of the ELSE of the open blocks
+        open_blocks = []
+        for ip, line_number in enumerate(line_tab):
+            statement = self.block_statement(line_number)
+            if statement in _BLOCK_OPENERS.values():
+                open_blocks.append([statement, ip, None])
+            elif statement == TinyBasicKeyword.ELSE:
+                if open_blocks and open_blocks[-1][0] == TinyBasicStatement.IF and open_blocks[-1][2] is None:
+                    open_blocks[-1][2] = ip
+            elif statement in _BLOCK_OPENERS:
+                if open_blocks and open_blocks[-1][0] == _BLOCK_OPENERS[statement]:
+                    _, start, middle = open_blocks.pop()
+                    if statement == TinyBasicStatement.WEND:
+                        targets[start] = ip + 1
+                        targets[ip] = start
+                    elif statement == TinyBasicStatement.UNTIL:
+                        targets[start] = ip
+                        targets[ip] = start + 1
+                    else:
+                        targets[ip] = ip + 1
+                        if middle is None:
+                            targets[start] = ip + 1
+                        else:
+                            targets[start] = middle + 1
+                            targets[middle] = ip + 1
+        return targets
+
     def get_program_text(self, start: int or None = None, end: int or None = None) -> list[str]:
         line_tab = self.get_line_table()
         result = []
@@ -0,0 +1,74 @@
+from collections import OrderedDict
+
+from tiny_basic.errors import TinyBasicException
+
+# Results kept by a CACHED function without a cache size
+FUNCTION_CACHE_SIZE = 1024
+
+
+def is_user_function_name(name: str) -> bool:
+    """
+    Identifiers starting with FN followed by arguments call a user function
+    """
+    return name.upper().startswith('FN')
+
+
+class UserFunction:
+    """
+    Function defined by DEF FNname(parameters) = expression. The body is compiled once, on the first call.
+    The parameters are bound like local variables, the variables they replace are put back after the call, so
+    a function may call itself.
+    A cached function keeps its results in a LRU cache keyed by the arguments, its body must read its parameters only.
+    """
+    def __init__(self, name: str, parameters: list[str], source: str, cache_size: int = 0):
+        """
+        :param name: upper case name, FN...
+        :param parameters: upper case parameter names
+        :param source: body expression
+        :param cache_size: number of results kept, 0 without cache
+        """
+        self.name = name
+        self.parameters = parameters
+        self.source = source
+        self.cache_size = cache_size
+        self.cache: OrderedDict or None = OrderedDict() if cache_size else None
+        self.body = None
+
+    def copy(self) -> 'UserFunction':
+        # The compiled body belongs to a VM, the copy compiles it again
+        return UserFunction(self.name, self.parameters, self.source, self.cache_size)
+
+    def call(self, vm, args: list):
+        """
+        :param vm: AbstractVM compiling the body and holding the variables
+        :param args: values of the parameters
+        """
+        if len(args) != len(self.parameters):
+            raise TinyBasicException(f'{self.name} EXPECTS {len(self.parameters)} ARGUMENTS, NOT {len(args)}')
+        key = None
+        if self.cache is not None:
+            # 1 and 1.0 are equal keys, their types keep the integer and float results apart
+            key = tuple((type(arg), arg) for arg in args)
+            result = self.cache.get(key)
+            if result is not None:
+                self.cache.move_to_end(key)
+                return result
+        if self.body is None:
+            self.body = vm.compile_function(self.source)
+        saved = vm.variables.bind(self.parameters, args)
+        try:
+            result = self.body()
+        except RecursionError:
+            raise TinyBasicException(f'RECURSION TOO DEEP IN {self.name}')
+        finally:
+            vm.variables.unbind(saved)
+        if self.name.endswith('$'):
+            if not isinstance(result, str):
+                raise TinyBasicException(f'{result} IS NOT A STRING')
+        elif not (isinstance(result, int) or isinstance(result, float)):
+            raise TinyBasicException(f'{result} IS NOT A NUMBER')
+        if key is not None:
+            self.cache[key] = result
+            if self.cache_size < len(self.cache):
+                self.cache.popitem(last=False)
+        return result
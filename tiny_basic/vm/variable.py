@@ -7,47 +7,88 @@ class Variable:
     TYPE_INT = 'INT'
     TYPE_ANY = ''
 
-    def __init__(self, name: str, base_type: str, dim: int = 1, value = None):
+    def __init__(self, name: str, base_type: str, dim: int = 1, value = None, shape: tuple[int, ...] or None = None):
+        """
+        :param shape: extents of a multi-dimensional array, the elements are stored flat in row-major order
+        """
         self.base_type = base_type
         self.dim = dim
         self.name = name
+        self.shape = shape
         if self.base_type == Variable.TYPE_STR and not name.endswith('$'):
             raise TinyBasicException(f'STRING VAR MUST END WITH $ {name}')
         if self.base_type == Variable.TYPE_NUM and name.endswith('$'):
             raise TinyBasicException(f'NUMERIC VAR MUST NOT END WITH $ {name}')
-        if dim < 0:
-            raise TinyBasicException(f'DIM should be a positive number, not {dim} for {name}')
+        if dim < 0 or (shape is not None and min(shape) < 0):
+            raise TinyBasicException(f'DIM should be a positive number, not {dim if shape is None else shape} for {name}')
         if value is None:
-            self.value = []
-            for i in range(0, dim):
-                self.value.append(None)
+            self.value = [None] * dim
         else:
             if len(value) != dim:
                 raise TinyBasicException(f'Wrong init value for {name}')
             self.value = value
 
+    def copy(self) -> 'Variable':
+        return Variable(self.name, self.base_type, self.dim, list(self.value), self.shape)
+
     def get_type(self):
+        if self.shape is not None:
+            return f'{self.base_type}[{", ".join(map(str, self.shape))}]'
         if self.dim == 1:
             return self.base_type
         else:
             return f'{self.base_type}[{self.dim}]'
 
-    def verify_index(self, index: int):
-        if (not 0 <= index < self.dim) or self.value is None:
+    def get_extent(self, dimension: int) -> int:
+        """
+        :param dimension: 1 for the first dimension
+        """
+        shape = (self.dim,) if self.shape is None else self.shape
+        if not 1 <= dimension <= len(shape):
+            raise TinyBasicException(f'{self.name} HAS NO DIMENSION {dimension}')
+        return shape[dimension - 1]
+
+    def verify_index(self, index: int or tuple[int, ...]) -> int:
+        """
+        :return: the position of the element in the flat element list
+        """
+        try:
+            in_bounds = 0 <= index < self.dim
+        except TypeError:
+            if isinstance(index, tuple):
+                return self.flat_index(index)
+            raise TinyBasicException(f'{self.name} IS NOT A MAP')
+        if (not in_bounds) or self.value is None:
             raise TinyBasicException(f'{index} IS OUT OF BOUNDS FOR {self.name}: 0..{self.dim}')
+        return index
+
+    def flat_index(self, index: tuple[int, ...]) -> int:
+        shape = (self.dim,) if self.shape is None else self.shape
+        if len(index) != len(shape):
+            raise TinyBasicException(f'{self.name} HAS {len(shape)} DIMENSIONS, NOT {len(index)}')
+        result = 0
+        for i, extent in zip(index, shape):
+            if not 0 <= i < extent:
+                raise TinyBasicException(f'{index} IS OUT OF BOUNDS FOR {self.name}: {self.get_type()}')
+            result = result * extent + i
+        return result
+
+    def new_elements(self, index) -> int:
+        """
+        :return: number of elements a write to the index adds
+        """
+        return 0
 
     def read(self, index: int, type: str or None = None):
         if type is not None and self.base_type != type:
             raise TinyBasicException(f'{self.name} IS NOT {type}')
-        self.verify_index(index)
-        result = self.value[index]
+        result = self.value[self.verify_index(index)]
         if result is None:
             raise TinyBasicException(f'{self.name}[{index}] IS NOT YET ASSIGNED')
         return result
 
     def write(self, index: int, value):
-        self.verify_index(index)
-        self.value[index] = value
+        self.value[self.verify_index(index)] = value
 
     def read_num(self, index: int = 0) -> int or float:
         result = self.read(index, Variable.TYPE_NUM)
@@ -71,10 +112,88 @@ class Variable:
             raise TinyBasicException(f'{value} IS NOT A STRING')
         self.write(index, value)
 
+    def read_array(self, type: str or None = None) -> list:
+        """
+        :return: the elements of an array, checked once for the whole array
+        """
+        if type is not None and self.base_type != type:
+            raise TinyBasicException(f'{self.name} IS NOT {type}')
+        if None in self.value:
+            raise TinyBasicException(f'{self.name}[{self.value.index(None)}] IS NOT YET ASSIGNED')
+        return self.value
+
+    def read_num_array(self) -> list[int or float]:
+        return self.read_array(Variable.TYPE_NUM)
+
     def write_num_array(self, value: list[int or float]):
-        self.dim = len(value)
-        self.value = value
+        self.write_array(value)
 
     def write_str_array(self, value: list[str]):
+        self.write_array(value)
+
+    def write_array(self, value: list):
+        # Whole array operations keep the shape when the number of elements does not change
+        if len(value) != self.dim:
+            self.shape = None
         self.dim = len(value)
         self.value = value
+
+
+class MapVariable(Variable):
+    """
+    Associative array, declared with DIM m{}, indexed by string or integer keys like an array.
+    The keys keep their insertion order.
+    """
+    def __init__(self, name: str, base_type: str, value: dict or None = None):
+        super().__init__(name, base_type, 0)
+        self.value = {} if value is None else value
+
+    @property
+    def dim(self) -> int:
+        return len(self.value)
+
+    @dim.setter
+    def dim(self, dim: int):
+        # Maps grow with their keys, the size given by the base class is ignored
+        pass
+
+    def copy(self) -> 'MapVariable':
+        return MapVariable(self.name, self.base_type, dict(self.value))
+
+    def get_type(self):
+        return f'{self.base_type}{{}}'
+
+    def verify_index(self, index: int or str) -> int or str:
+        if not (isinstance(index, int) or isinstance(index, str)):
+            raise TinyBasicException(f'{index} IS NOT A KEY OF {self.name}')
+        return index
+
+    def new_elements(self, index) -> int:
+        return 0 if index in self.value else 1
+
+    def read(self, index: int or str, type: str or None = None):
+        if type is not None and self.base_type != type:
+            raise TinyBasicException(f'{self.name} IS NOT {type}')
+        try:
+            return self.value[index]
+        except KeyError:
+            raise TinyBasicException(f'{index} IS NOT A KEY OF {self.name}')
+        except TypeError:
+            raise TinyBasicException(f'{index} IS NOT A KEY OF {self.name}')
+
+    def has_key(self, index: int or str) -> bool:
+        self.verify_index(index)
+        return index in self.value
+
+    def delete(self, index: int or str):
+        self.read(index)
+        del self.value[index]
+
+    def read_array(self, type: str or None = None) -> list:
+        raise TinyBasicException(f'{self.name} IS A MAP')
+
+    def write_num_array(self, value: list[int or float]):
+        raise TinyBasicException(f'{self.name} IS A MAP')
+
+    def write_str_array(self, value: list[str]):
+        raise TinyBasicException(f'{self.name} IS A MAP')
@@ -1,13 +1,55 @@
 from tiny_basic.errors import TinyBasicException
-from . import Variable
+from . import Variable, MapVariable
+from .limits import ExecutionLimits
 
 
 class VariableStorage:
-    def __init__(self):
+    def __init__(self, limits: ExecutionLimits or None = None):
         self.variables: dict[str, Variable] = {}
+        self.limits = limits
+        # Names of variables shared with clones, they are copied before the first write
+        self.shared: set[str] = set()
+
+    def clone(self, limits: ExecutionLimits or None = None) -> 'VariableStorage':
+        result = VariableStorage(limits)
+        result.variables = dict(self.variables)
+        result.shared = set(self.variables)
+        self.shared.update(self.variables)
+        return result
 
     def reset(self):
         self.variables.clear()
+        self.shared.clear()
+
+    def bind(self, names: list[str], values: list) -> list[tuple[str, Variable or None, bool]]:
+        """
+        Bind the parameters of a function call to new scalar variables
+        :param names: upper case variable names
+        :return: the replaced variables, for unbind
+        """
+        bound = []
+        for name, value in zip(names, values):
+            var = Variable(name, self.base_type_of(name))
+            if var.base_type == Variable.TYPE_STR:
+                var.write_str(value)
+            else:
+                var.write_num(value)
+            bound.append(var)
+        saved = []
+        for var in bound:
+            saved.append((var.name, self.variables.get(var.name), var.name in self.shared))
+            self.variables[var.name] = var
+            self.shared.discard(var.name)
+        return saved
+
+    def unbind(self, saved: list[tuple[str, Variable or None, bool]]):
+        for name, var, shared in reversed(saved):
+            if var is None:
+                del self.variables[name]
+            else:
+                self.variables[name] = var
+                if shared:
+                    self.shared.add(name)
 
     def access_var(self, variable_name: str) -> Variable:
         variable_name = variable_name.upper()
@@ -24,17 +66,74 @@ class VariableStorage:
         var = self.variables[variable_name]
         if base_type != var.base_type:
             raise TinyBasicException(f'TYPE MISMATCH, EXPECTED: {base_type}, GOT: {var.base_type} OF {variable_name}')
+        if variable_name in self.shared:
+            var = var.copy()
+            self.variables[variable_name] = var
+            self.shared.discard(variable_name)
         return var
 
-    def dim(self, variable_name: str, dim: int, base_type: str or None = None):
+    def dim(self, variable_name: str, dim: int, base_type: str or None = None, shape: tuple[int, ...] or None = None):
+        """
+        :param dim: number of elements
+        :param shape: extents of a multi-dimensional array, their product is dim
+        """
         variable_name = variable_name.upper()
         if base_type is None:
-            if variable_name.endswith('$'):
-                base_type = Variable.TYPE_STR
-            else:
-                base_type = Variable.TYPE_NUM
-        var = Variable(variable_name, base_type, dim)
+            base_type = self.base_type_of(variable_name)
+        if self.limits is None:
+            self.variables[variable_name] = Variable(variable_name, base_type, dim, shape=shape)
+            self.shared.discard(variable_name)
+            return
+        old = self.variables.get(variable_name)
+        old_elements = 0 if old is None else old.dim
+        self.limits.allocate_elements(dim - old_elements)
+        try:
+            var = Variable(variable_name, base_type, dim, shape=shape)
+        except TinyBasicException:
+            self.limits.allocate_elements(old_elements - dim)
+            raise
+        if old is not None:
+            self.limits.allocate_string(-self.string_size(old.value))
         self.variables[variable_name] = var
+        self.shared.discard(variable_name)
+
+    def dim_map(self, variable_name: str):
+        variable_name = variable_name.upper()
+        old = self.variables.get(variable_name)
+        if self.limits is not None and old is not None:
+            self.limits.allocate_elements(-old.dim)
+            self.limits.allocate_string(-self.string_size(old.value))
+        self.variables[variable_name] = MapVariable(variable_name, self.base_type_of(variable_name))
+        self.shared.discard(variable_name)
+
+    def delete_key(self, variable_name: str, key: int or str):
+        var = self.write_var(variable_name, self.base_type_of(variable_name), True)
+        if not isinstance(var, MapVariable):
+            raise TinyBasicException(f'{var.name} IS NOT A MAP')
+        value = var.read(key)
+        var.delete(key)
+        if self.limits is not None:
+            self.limits.allocate_elements(-1)
+            if isinstance(value, str):
+                self.limits.allocate_string(-len(value))
+
+    @staticmethod
+    def base_type_of(variable_name: str) -> str:
+        return Variable.TYPE_STR if variable_name.endswith('$') else Variable.TYPE_NUM
+
+    @staticmethod
+    def string_size(values: list or dict) -> int:
+        if isinstance(values, dict):
+            values = values.values()
+        return sum(len(value) for value in values if isinstance(value, str))
+
+    def replace_array(self, var: Variable, value: list):
+        self.limits.allocate_elements(len(value) - var.dim)
+        try:
+            self.limits.allocate_string(self.string_size(value) - self.string_size(var.value))
+        except TinyBasicException:
+            self.limits.allocate_elements(var.dim - len(value))
+            raise
 
     def get_dim(self, variable_name) -> int:
         var = self.access_var(variable_name)
@@ -49,11 +148,31 @@ class VariableStorage:
     def read_str_var(self, variable_name: str, index: int = 0) -> str:
         return self.access_var(variable_name).read_str(index)
 
-    def write_num_var(self, variable_name: str, value: int or float, index: int = 0):
-        self.write_var(variable_name, Variable.TYPE_NUM, index != 0).write_num(value, index)
+    def write_num_var(self, variable_name: str, value: int or float, index: int or str = 0):
+        var = self.write_var(variable_name, Variable.TYPE_NUM, index != 0)
+        if self.limits is not None:
+            var.verify_index(index)
+            self.limits.allocate_elements(var.new_elements(index))
+        var.write_num(value, index)
+
+    def write_str_var(self, variable_name: str, value: str, index: int or str = 0):
+        var = self.write_var(variable_name, Variable.TYPE_STR, index != 0)
+        if self.limits is not None and isinstance(value, str):
+            position = var.verify_index(index)
+            new_elements = var.new_elements(index)
+            old = None if new_elements else var.value[position]
+            self.limits.allocate_string(len(value) - (0 if old is None else len(old)))
+            self.limits.allocate_elements(new_elements)
+        var.write_str(value, index)
 
-    def write_str_var(self, variable_name: str, value: str, index: int = 0):
-        self.write_var(variable_name, Variable.TYPE_STR, index != 0).write_str(value, index)
+    def write_num_array(self, variable_name: str, value: list[int or float]):
+        var = self.write_var(variable_name, Variable.TYPE_NUM, False)
+        if self.limits is not None:
+            self.replace_array(var, value)
+        var.write_num_array(value)
 
     def write_str_array(self, variable_name: str, value: list[str]):
-        self.write_var(variable_name, Variable.TYPE_STR, False).write_str_array(value)
+        var = self.write_var(variable_name, Variable.TYPE_STR, False)
+        if self.limits is not None:
+            self.replace_array(var, value)
+        var.write_str_array(value)
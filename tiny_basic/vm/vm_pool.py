@@ -0,0 +1,36 @@
+from collections import deque
+
+from .abstract_vm import AbstractVM
+from .io import AbstractIo
+
+
+class VMPool:
+    """
+    Warm pool of ready-to-run clones of a VM with a loaded program.
+    The template is reset once, so labels and the line table are derived once for all clones.
+    """
+    def __init__(self, template: AbstractVM, size: int = 8):
+        """
+        :param template: VM with the program loaded
+        :param size: number of clones kept ready
+        """
+        self.template = template
+        self.size = size
+        self.template.reset()
+        self.ready: deque[AbstractVM] = deque()
+        self.refill()
+
+    def refill(self):
+        while len(self.ready) < self.size:
+            self.ready.append(self.template.clone())
+
+    def acquire(self, io: AbstractIo or None = None) -> AbstractVM:
+        """
+        Hand out a clone positioned at the first line, call its run() (not RUN, that would reset it)
+        :param io: IO of the clone, the IO of the template when None
+        :return: a fresh clone, it is never returned to the pool
+        """
+        vm = self.ready.popleft() if self.ready else self.template.clone()
+        if io is not None:
+            vm.io = io
+        return vm